@@ -1,53 +1,246 @@
 import os
+import asyncio
 import base64
 import json
-from openai import OpenAI
+import logging
+import random
+import threading
+import time
+
+import cv2
+import openai
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
+import database
+
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Cloud enrichment (facts + second opinion). OPENAI_BASE_URL points it at any
+# OpenAI-compatible server, e.g. cloud_ai_standin.py for local testing.
+CLOUD_AI_MODEL = os.getenv("CLOUD_AI_MODEL", "gpt-4o")
+# Classifier results below this confidence are sent automatically
+CLOUD_AI_CONFIDENCE_THRESHOLD = float(os.getenv("CLOUD_AI_CONFIDENCE_THRESHOLD", "0.6"))
+CLOUD_AI_MAX_CONCURRENCY = int(os.getenv("CLOUD_AI_MAX_CONCURRENCY", "2"))
+CLOUD_AI_REQUESTS_PER_MINUTE = float(os.getenv("CLOUD_AI_REQUESTS_PER_MINUTE", "10"))
+CLOUD_AI_BURST = int(os.getenv("CLOUD_AI_BURST", "3"))
+CLOUD_AI_MAX_RETRIES = int(os.getenv("CLOUD_AI_MAX_RETRIES", "3"))
+CLOUD_AI_TIMEOUT = float(os.getenv("CLOUD_AI_TIMEOUT", "30"))
+# Images of the same species whose hashes differ in at most this many bits share a result
+CLOUD_AI_HASH_DISTANCE = int(os.getenv("CLOUD_AI_HASH_DISTANCE", "6"))
+# Crops are downscaled before upload
+CLOUD_AI_IMAGE_SIZE = 512
+
+SYSTEM_PROMPT = (
+    "You are an expert ornithologist. You will be shown a crop from a bird feeder webcam. "
+    "Identify the bird, give a confidence score (0-1), and a short, interesting fact about it. "
+    "Return ONLY raw JSON."
+)
+
+# Errors worth another try; anything else (bad request, auth) fails at once
+RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+def dhash(image, size=8):
+    """64-bit difference hash of a BGR image, as 16 hex digits."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f"{value:016x}"
+
+
+def hash_distance(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
 
-def analyze_frame(frame_bytes):
+
+def encode_for_upload(image):
+    height, width = image.shape[:2]
+    scale = CLOUD_AI_IMAGE_SIZE / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    ok, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ok:
+        raise ValueError("Could not encode image for upload")
+    return jpeg.tobytes()
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, at most `capacity` saved up."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CloudEnricher:
     """
-    Sends the frame to OpenAI for bird identification.
-    Returns a dictionary or None if error.
+    Optional cloud enrichment stage.
+
+    Runs its own asyncio loop on a background thread, so callers on any
+    thread just submit() and get a concurrent Future back. Requests are
+    deduplicated through a persistent (species, perceptual hash) cache,
+    limited in concurrency and rate, and retried with backoff. Results are
+    written to the detection's interesting_fact.
     """
-    if not client.api_key:
-        print("Error: No OpenAI API Key found.")
+
+    def __init__(self, on_enriched=None, model=CLOUD_AI_MODEL, max_concurrency=CLOUD_AI_MAX_CONCURRENCY,
+                 requests_per_minute=CLOUD_AI_REQUESTS_PER_MINUTE, burst=CLOUD_AI_BURST,
+                 max_retries=CLOUD_AI_MAX_RETRIES):
+        # Called as on_enriched(detection_id) once the result is stored
+        self.on_enriched = on_enriched
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self.max_retries = max_retries
+        self.loop = None
+        self.client = None
+        self._thread = None
+        self._inflight = {}
+        self.stats = {"requests": 0, "cache_hits": 0, "retries": 0, "failures": 0}
+
+    @property
+    def available(self):
+        return bool(os.getenv("OPENAI_API_KEY"))
+
+    def start(self):
+        if self._thread is not None or not self.available:
+            return
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            # Created on the loop they're used from
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.bucket = TokenBucket(self.requests_per_minute / 60.0, self.burst)
+            self.client = AsyncOpenAI(max_retries=0, timeout=CLOUD_AI_TIMEOUT)
+            ready.set()
+            self.loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="cloud-ai", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        async def shutdown():
+            await self.client.close()
+            self.loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop)
+        self._thread.join(timeout=5.0)
+        self._thread = None
+
+    def wants(self, confidence):
+        """Should a classifier result this confident get a second opinion?"""
+        return self._thread is not None and confidence < CLOUD_AI_CONFIDENCE_THRESHOLD
+
+    def submit(self, detection_id, species, image, refresh=False):
+        """
+        Queue enriching a detection from its BGR crop. Returns a Future
+        resolving to the result dict (or None when the model saw no bird).
+        """
+        if self._thread is None:
+            raise RuntimeError("Cloud AI is not configured (set OPENAI_API_KEY)")
+        image_hash = dhash(image)
+        jpeg = encode_for_upload(image)
+        return asyncio.run_coroutine_threadsafe(
+            self._enrich(detection_id, species, image_hash, jpeg, refresh), self.loop)
+
+    def _cached(self, species, image_hash):
+        for cached_hash, result in database.get_cached_enrichments(species):
+            if hash_distance(cached_hash, image_hash) <= CLOUD_AI_HASH_DISTANCE:
+                return result
         return None
 
-    # Encode image to base64
-    base64_image = base64.b64encode(frame_bytes).decode('utf-8')
+    async def _enrich(self, detection_id, species, image_hash, jpeg, refresh):
+        result = None if refresh else await asyncio.to_thread(self._cached, species, image_hash)
+        if result is not None:
+            self.stats["cache_hits"] += 1
+        else:
+            # Identical requests already on their way share one call
+            key = (species, image_hash)
+            task = self._inflight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(self._fetch(species, jpeg))
+                self._inflight[key] = task
+                task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            result = await task
+            database.cache_enrichment(species, image_hash, result)
+
+        if result.get("detected", True) and result.get("interesting_fact"):
+            stored = await asyncio.wrap_future(database.set_enrichment(
+                detection_id, result["interesting_fact"], result.get("species"), result.get("confidence")))
+            if stored and self.on_enriched is not None:
+                self.on_enriched(detection_id)
+        return result
 
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+    async def _fetch(self, species, jpeg):
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.bucket.acquire()
+                self.stats["requests"] += 1
+                try:
+                    return await self._request(species, jpeg)
+                except RETRYABLE as e:
+                    if attempt == self.max_retries:
+                        self.stats["failures"] += 1
+                        raise
+                    self.stats["retries"] += 1
+                    delay = min(60.0, 2 ** attempt) * (0.5 + random.random())
+                    retry_after = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+                    if retry_after:
+                        try:
+                            delay = max(delay, float(retry_after))
+                        except ValueError:
+                            pass
+                    logger.warning("%s, retrying in %.1fs", type(e).__name__, delay)
+                    await asyncio.sleep(delay)
+                except Exception:
+                    self.stats["failures"] += 1
+                    raise
+
+    async def _request(self, species, jpeg):
+        base64_image = base64.b64encode(jpeg).decode('utf-8')
+        response = await self.client.chat.completions.create(
+            model=self.model,
             messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert ornithologist. You will be shown an image from a webcam. Identify if there is a bird in the image. If yes, provide the species name, a confidence score (0-1), and a short, interesting fact about it. Return ONLY raw JSON."
-                },
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {
                     "role": "user",
                     "content": [
-                        {"type": "text", "text": "Identify the bird in this image. Return JSON format: { \"detected\": bool, \"species\": str, \"confidence\": float, \"interesting_fact\": str }"},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
+                        {"type": "text", "text": (
+                            f"Our local classifier thinks this is a {species}. Identify the bird in this image. "
+                            "Return JSON format: { \"detected\": bool, \"species\": str, \"confidence\": float, "
+                            "\"interesting_fact\": str }"
+                        )},
+                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}},
+                    ],
+                },
             ],
             max_tokens=300,
-            response_format={ "type": "json_object" }
+            response_format={"type": "json_object"},
         )
-        
-        result_text = response.choices[0].message.content
-        return json.loads(result_text)
-
-    except Exception as e:
-        print(f"AI Error: {e}")
-        return None
+        return json.loads(response.choices[0].message.content)
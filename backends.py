@@ -0,0 +1,272 @@
+import logging
+import os
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Inference backend for both the detector and the classifier:
+#   torch     - eager PyTorch (default)
+#   onnx      - exported ONNX models through ONNX Runtime
+#   onnx-int8 - INT8-quantized ONNX models through ONNX Runtime
+# Missing exports fall back to PyTorch. Create them with export_models.py.
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 = let ONNX Runtime decide
+# e.g. "OpenVINOExecutionProvider,CPUExecutionProvider" with onnxruntime-openvino
+ONNX_PROVIDERS = [p.strip() for p in os.getenv("ONNX_PROVIDERS", "CPUExecutionProvider").split(",") if p.strip()]
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+# Downloaded weights (YOLO, Hugging Face) are kept here instead of the working directory
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(MODEL_DIR, "cache"))
+# Never touch the network: models must already be in MODEL_CACHE_DIR
+MODELS_OFFLINE = os.getenv("MODELS_OFFLINE", "false").lower() == "true"
+
+YOLO_WEIGHTS = "yolov8n.pt"
+DETECTOR_NAME = "yolov8n"
+CLASSIFIER_MODEL = "dennisjooo/Birds-Classifier-EfficientNetB2"
+CLASSIFIER_NAME = "bird-classifier-effnetb2"
+
+
+def yolo_weights_path():
+    """YOLO weights in the model cache (or where older installs downloaded them)."""
+    if os.path.exists(YOLO_WEIGHTS):
+        return YOLO_WEIGHTS
+    path = os.path.join(MODEL_CACHE_DIR, YOLO_WEIGHTS)
+    if MODELS_OFFLINE and not os.path.exists(path):
+        raise FileNotFoundError(f"{path} is missing and MODELS_OFFLINE is set")
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    return path
+
+
+def hub_options():
+    """from_pretrained() arguments that keep Hugging Face downloads in the model cache."""
+    return {"cache_dir": os.path.join(MODEL_CACHE_DIR, "huggingface"), "local_files_only": MODELS_OFFLINE}
+
+
+def onnx_model_path(name, int8=False):
+    suffix = ".int8.onnx" if int8 else ".onnx"
+    return os.path.join(MODEL_DIR, name + suffix)
+
+
+def wants_onnx():
+    return INFERENCE_BACKEND in ("onnx", "onnx-int8")
+
+
+def resolve_onnx_path(name):
+    """
+    Return the ONNX file to use for `name` under the configured backend,
+    or None if the backend is torch or no export exists.
+    """
+    if not wants_onnx():
+        return None
+    candidates = []
+    if INFERENCE_BACKEND == "onnx-int8":
+        candidates.append(onnx_model_path(name, int8=True))
+    candidates.append(onnx_model_path(name))
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    logger.warning("No ONNX export found for %s in %s, falling back to PyTorch.", name, MODEL_DIR)
+    return None
+
+
+def create_onnx_session(path, threads=None):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    threads = ONNX_THREADS if threads is None else threads
+    if threads > 0:
+        options.intra_op_num_threads = threads
+    available = ort.get_available_providers()
+    providers = [p for p in ONNX_PROVIDERS if p in available] or ["CPUExecutionProvider"]
+    return ort.InferenceSession(path, sess_options=options, providers=providers)
+
+
+def letterbox(image, size):
+    """
+    Resize keeping aspect ratio and pad to a square (as YOLOv8 does).
+    Returns (NCHW float32 blob, scale, (pad_x, pad_y)).
+    """
+    h, w = image.shape[:2]
+    scale = min(size / h, size / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = cv2.resize(image, (new_w, new_h))
+
+    blob = canvas[..., ::-1].transpose(2, 0, 1)[np.newaxis].astype(np.float32) / 255.0
+    return blob, scale, (pad_x, pad_y)
+
+
+class TorchDetector:
+    """YOLOv8 through ultralytics/PyTorch."""
+
+    backend = "torch"
+
+    def __init__(self, weights=None):
+        from ultralytics import YOLO
+        # Downloads 'yolov8n.pt' into the model cache on first run
+        self.model = YOLO(weights or yolo_weights_path())
+
+    def detect(self, image, conf=0.25):
+        """Returns a list of (x1, y1, x2, y2, conf, cls) in image pixels."""
+        detections = []
+        # verbose=False suppresses stdout spam
+        for r in self.model(image, verbose=False, stream=True, conf=conf):
+            for box in r.boxes:
+                x1, y1, x2, y2 = box.xyxy[0].tolist()
+                detections.append((x1, y1, x2, y2, float(box.conf[0]), int(box.cls[0])))
+        return detections
+
+    def detect_batch(self, images, conf=0.25):
+        """Run several images through YOLO as one batch."""
+        batch = []
+        for r in self.model(list(images), verbose=False, conf=conf):
+            detections = []
+            for box in r.boxes:
+                x1, y1, x2, y2 = box.xyxy[0].tolist()
+                detections.append((x1, y1, x2, y2, float(box.conf[0]), int(box.cls[0])))
+            batch.append(detections)
+        return batch
+
+
+class OnnxDetector:
+    """YOLOv8 ONNX export run through ONNX Runtime."""
+
+    backend = "onnx"
+
+    def __init__(self, path, iou=0.45):
+        self.session = create_onnx_session(path)
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Static exports take one image at a time
+        self.dynamic_batch = not isinstance(model_input.shape[0], int)
+        size = model_input.shape[-1]
+        self.size = size if isinstance(size, int) else 640
+        self.iou = iou
+        self.path = path
+
+    def detect(self, image, conf=0.25):
+        blob, scale, (pad_x, pad_y) = self.letterbox(image)
+        # (1, 4 + classes, anchors) -> (anchors, 4 + classes)
+        pred = self.session.run(None, {self.input_name: blob})[0][0].T
+        return self._postprocess(pred, scale, pad_x, pad_y, conf)
+
+    def detect_batch(self, images, conf=0.25):
+        if not self.dynamic_batch or len(images) < 2:
+            return [self.detect(image, conf) for image in images]
+        prepared = [self.letterbox(image) for image in images]
+        blob = np.concatenate([p[0] for p in prepared])
+        preds = self.session.run(None, {self.input_name: blob})[0]
+        return [self._postprocess(pred.T, scale, pad_x, pad_y, conf)
+                for pred, (_, scale, (pad_x, pad_y)) in zip(preds, prepared)]
+
+    def letterbox(self, image):
+        return letterbox(image, self.size)
+
+    def _postprocess(self, pred, scale, pad_x, pad_y, conf):
+        scores = pred[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences > conf
+        if not np.any(keep):
+            return []
+        pred, class_ids, confidences = pred[keep], class_ids[keep], confidences[keep]
+
+        # cx, cy, w, h (letterboxed) -> x, y, w, h (original image)
+        boxes = np.empty((len(pred), 4), dtype=np.float32)
+        boxes[:, 0] = (pred[:, 0] - pred[:, 2] / 2 - pad_x) / scale
+        boxes[:, 1] = (pred[:, 1] - pred[:, 3] / 2 - pad_y) / scale
+        boxes[:, 2] = pred[:, 2] / scale
+        boxes[:, 3] = pred[:, 3] / scale
+
+        # Class-aware NMS, matching ultralytics' default
+        indices = cv2.dnn.NMSBoxesBatched(boxes.tolist(), confidences.tolist(), class_ids.tolist(), conf, self.iou)
+        detections = []
+        for i in np.array(indices).flatten():
+            x, y, w, h = boxes[i]
+            detections.append((float(x), float(y), float(x + w), float(y + h), float(confidences[i]), int(class_ids[i])))
+        return detections
+
+
+def load_detector():
+    """Build the bird detector for the configured backend."""
+    path = resolve_onnx_path(DETECTOR_NAME)
+    if path:
+        try:
+            detector = OnnxDetector(path)
+            logger.info("Detector: using ONNX Runtime (%s)", path)
+            return detector
+        except Exception as e:
+            logger.warning("Failed to load ONNX detector (%s), falling back to PyTorch.", e)
+    return TorchDetector()
+
+
+class SharedDetector:
+    """
+    One detector instance shared by every camera. Calls are serialized:
+    the model is not thread-safe and inference is CPU-bound anyway.
+
+    Starts out empty; load() (run by the model registry in the background)
+    fills it in. Until then cameras check `ready` and skip detection.
+    """
+
+    def __init__(self, detector=None):
+        self.detector = detector
+        self.lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.detector is not None
+
+    @property
+    def backend(self):
+        return self.detector.backend if self.detector is not None else None
+
+    def load(self):
+        with self.lock:
+            if self.detector is None:
+                self.detector = load_detector()
+        return self.detector.backend
+
+    def detect(self, image, conf=0.25):
+        with self.lock:
+            if self.detector is None:
+                return []
+            return self.detector.detect(image, conf)
+
+    def detect_batch(self, images, conf=0.25):
+        with self.lock:
+            if self.detector is None:
+                return [[] for _ in images]
+            return self.detector.detect_batch(images, conf)
+
+
+_shared_detector = None
+_shared_detector_lock = threading.Lock()
+
+
+def get_detector():
+    """The process-wide detector (not loaded until its load() is called)."""
+    global _shared_detector
+    with _shared_detector_lock:
+        if _shared_detector is None:
+            _shared_detector = SharedDetector()
+        return _shared_detector
+
+
+def load_classifier_session():
+    """ONNX Runtime session for the species classifier, or None for PyTorch."""
+    path = resolve_onnx_path(CLASSIFIER_NAME)
+    if not path:
+        return None
+    try:
+        session = create_onnx_session(path)
+        logger.info("Classifier: using ONNX Runtime (%s)", path)
+        return session
+    except Exception as e:
+        logger.warning("Failed to load ONNX classifier (%s), falling back to PyTorch.", e)
+        return None
@@ -0,0 +1,205 @@
+"""
+Benchmark the detection pipeline on recorded footage, no camera needed.
+
+    python benchmark.py run clip.mp4                      # one replay, printed
+    python benchmark.py run frames/ --no-classify --json out.json
+    python benchmark.py record                            # measure every scenario into the baseline
+    python benchmark.py check --tolerance 0.25            # exit 1 on regressions
+    python benchmark.py alloc --size 1920x1080            # per-frame allocations, pooled vs not
+
+Scenarios live in benchmarks/baseline.json next to their recorded numbers.
+Counts must match the baseline exactly; throughput may drop and p95 stage
+latency may grow by at most the tolerance. Timings are only comparable on
+the machine they were recorded on, so re-record them when the hardware
+changes. The synthetic scenario ships with its motion counts only, which
+hold anywhere; `check` fails if no scenario could be compared.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from replay import open_source, run_replay
+
+BASELINE_FILE = os.path.join("benchmarks", "baseline.json")
+# Counts that must not change between runs of the same footage
+EXACT_FIELDS = ("frames", "motion_triggers", "inference_runs", "detections", "visits")
+
+
+def load_classifier(enabled):
+    if not enabled:
+        return None
+    from classifier import BirdClassifier
+    classifier = BirdClassifier()
+    classifier.load()
+    return classifier
+
+
+def replay(spec, frames=None, classify=True, motion=None):
+    return run_replay(open_source(spec, max_frames=frames), classifier=load_classifier(classify),
+                      motion_settings=motion)
+
+
+def scenarios(baseline):
+    """Scenarios whose footage is present; recorded clips are optional."""
+    for scenario in baseline["scenarios"]:
+        source = scenario["source"]
+        if not source.startswith("synthetic") and not os.path.exists(source):
+            print(f"skip {scenario['name']}: {source} not found")
+            continue
+        yield scenario
+
+
+def run_scenario(scenario):
+    print(f"running {scenario['name']} ...")
+    return replay(scenario["source"], scenario.get("frames"), scenario.get("classify", True),
+                  scenario.get("motion"))
+
+
+def compare(name, expected, actual, tolerance):
+    """
+    Regression messages of one scenario (empty if it passed). A baseline
+    may hold only some fields (e.g. just the counts); the rest is skipped.
+    """
+    problems = []
+    for field in EXACT_FIELDS:
+        if field in expected and expected[field] != actual[field]:
+            problems.append(f"{name}: {field} {expected[field]} -> {actual[field]}")
+    if "fps" in expected and actual["fps"] < expected["fps"] * (1 - tolerance):
+        problems.append(f"{name}: throughput {expected['fps']} -> {actual['fps']} fps")
+    for stage, summary in expected.get("stages", {}).items():
+        before = summary.get("p95_ms")
+        after = actual["stages"].get(stage, {}).get("p95_ms")
+        if before is not None and after is not None and after > before * (1 + tolerance):
+            problems.append(f"{name}: {stage} p95 {before} -> {after} ms")
+    return problems
+
+
+def _legacy_clean_copy(frame):
+    """The unannotated copy get_frame() used to take of every frame."""
+    return frame.copy()
+
+
+def frame_path(frames, count, reuse):
+    """
+    The capture + motion hot loop on in-memory frames, with or without
+    buffer reuse. Returns (ms per frame, KB allocated per frame, frame buffers allocated).
+    """
+    import numpy as np
+
+    from framepool import FramePool
+    from motion import MotionDetector
+
+    def run(measure):
+        pool = FramePool() if reuse else FramePool(max_buffers=0)
+        motion = MotionDetector(reuse_buffers=reuse)
+        transient = 0
+        start = time.perf_counter()
+        for source in itertools.islice(itertools.cycle(frames), count):
+            if measure:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            # Stands in for VideoCapture.read() into a pooled buffer (or a fresh one)
+            frame = pool.acquire(source.shape)
+            np.copyto(frame, source)
+            if not reuse:
+                frame = _legacy_clean_copy(frame)
+            motion.update(frame)
+            if measure:
+                transient += tracemalloc.get_traced_memory()[1] - before
+        return (time.perf_counter() - start) * 1000 / count, transient / 1024 / count, pool.allocated
+
+    elapsed, _, allocated = run(measure=False)
+    # A separate pass: tracemalloc slows everything down
+    tracemalloc.start()
+    try:
+        _, transient, _ = run(measure=True)
+    finally:
+        tracemalloc.stop()
+    return elapsed, transient, allocated
+
+
+def allocation_report(size, count):
+    from replay import SyntheticSource
+
+    width, height = (int(v) for v in size.lower().split("x"))
+    frames = [frame for frame, _ in SyntheticSource(frames=40, size=(width, height))]
+    print(f"{count} frames at {width}x{height}:")
+    print(f"  {'path':<18} {'ms/frame':>9} {'KB allocated/frame':>19} {'frame buffers':>14}")
+    for name, reuse in (("allocating (old)", False), ("preallocated", True)):
+        elapsed, transient, allocated = frame_path(frames, count, reuse)
+        print(f"  {name:<18} {elapsed:>9.2f} {transient:>19.0f} {allocated:>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="replay one source and report")
+    run.add_argument("source", help="video file, image directory or synthetic[:frames]")
+    run.add_argument("--frames", type=int, help="stop after this many frames")
+    run.add_argument("--no-classify", action="store_true", help="skip the species classifier")
+    run.add_argument("--json", help="also write the results to this file")
+
+    record = commands.add_parser("record", help="measure every scenario into the baseline file")
+    record.add_argument("--baseline", default=BASELINE_FILE)
+
+    check = commands.add_parser("check", help="compare every scenario against the baseline")
+    check.add_argument("--baseline", default=BASELINE_FILE)
+    check.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    alloc = commands.add_parser("alloc", help="allocations and time of the frame hot loop, old vs pooled")
+    alloc.add_argument("--size", default="1280x720", help="frame size WIDTHxHEIGHT")
+    alloc.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    if args.command == "alloc":
+        allocation_report(args.size, args.frames)
+        return 0
+
+    if args.command == "run":
+        result = replay(args.source, args.frames, not args.no_classify)
+        print(result.summary())
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(result, f, indent=2)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    if args.command == "record":
+        for scenario in scenarios(baseline):
+            result = run_scenario(scenario)
+            print(result.summary())
+            scenario["baseline"] = result
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    problems = []
+    compared = 0
+    for scenario in scenarios(baseline):
+        if not scenario.get("baseline"):
+            print(f"skip {scenario['name']}: no baseline recorded")
+            continue
+        result = run_scenario(scenario)
+        print(result.summary())
+        problems += compare(scenario["name"], scenario["baseline"], result, args.tolerance)
+        compared += 1
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    if not compared:
+        # Passing without comparing anything would hide a broken setup
+        print("FAILED: no scenario was compared")
+        return 1
+    print(f"OK ({compared} scenario(s))" if not problems else f"{len(problems)} regression(s)")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
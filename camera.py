@@ -1,24 +1,38 @@
 import cv2
+import logging
+import os
 import time
 import numpy as np
 import threading
-from ultralytics import YOLO
+
+from backends import get_detector
+from framepool import frame_pool
+from motion import MotionDetector, load_motion_settings, save_motion_settings
+from tiling import nms, plan_tiles
+
+# "roi": run YOLO on native-resolution tiles around motion regions
+# "full": run YOLO on the whole (downscaled) frame
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "roi").lower()
+ROI_TILE_SIZE = int(os.getenv("ROI_TILE_SIZE", "640"))
+ROI_MAX_TILES = int(os.getenv("ROI_MAX_TILES", "6"))
+# How long a newly selected camera may take to deliver its first frame
+SWITCH_TIMEOUT = float(os.getenv("CAMERA_SWITCH_TIMEOUT", "5"))
+
+logger = logging.getLogger(__name__)
 
 class VideoCamera:
-    def __init__(self):
+    def __init__(self, source=0):
         self.video = None
-        self.current_source = 0
+        self._frame_shape = None
+        self.current_source = source
         self.lock = threading.Lock()
-        self.open_camera(0)
+        self._switch_lock = threading.Lock()
+        self._requested_source = source
+        self.motion = None
+        self.open_camera(source)
         
-        # Motion detection variables
-        self.last_frame = None
-        self.min_motion_frames = 8
-        self.motion_counter = 0
-        
-        # Load YOLOv8 Model (Nano version)
-        # It will auto-download 'yolov8n.pt' on first run
-        self.model = YOLO('yolov8n.pt')
+        # YOLOv8 Model (Nano version), shared by all cameras and loaded in the background
+        self.detector = get_detector()
         
         # Detect Bird Class ID (usually 14 in COCO dataset)
         self.target_class_id = 14
@@ -26,155 +40,161 @@ class VideoCamera:
         # Debug Mode
         self.debug_mode = False
 
+        # Set by the pipeline's duty-cycle scheduler (see apply_tier)
+        self.analysis_scale = 1.0
+        self.forced_inference_every = 1
+        self._forced_frames = 0
+
+        # Number of YOLO passes run (for pipeline stats)
+        self.inference_count = 0
+        # Seconds per stage of the last analyze() call
+        self.timings = {}
+
     def toggle_debug(self, enabled: bool):
         self.debug_mode = enabled
 
+    def apply_tier(self, tier):
+        """Analyze at a duty-cycle tier's motion resolution and forced-YOLO rate."""
+        self.analysis_scale = tier["analysis_scale"]
+        self.forced_inference_every = tier["forced_inference_every"]
+
     def open_camera(self, source=0):
+        """
+        Open `source` and switch to it. On a switch the device warms up
+        outside the capture lock, so the current one keeps streaming
+        meanwhile, and a device that never delivers a frame keeps the
+        current one. The first device is used at once: read() returns None
+        until it delivers, and the capture loop backs off on that.
+        """
+        video = cv2.VideoCapture(source)
+        # Keep the driver queue short; the pipeline always wants the newest frame
+        video.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if self.video is not None and not self._warm_up(video):
+            logger.warning("Camera %s delivered no frames, staying on %s", source, self.current_source)
+            video.release()
+            return
+
         with self.lock:
-            if self.video is not None:
-                self.video.release()
-            self.video = cv2.VideoCapture(source)
+            old, self.video = self.video, video
             self.current_source = source
-            # Allow camera to warm up
-            time.sleep(0.5)
+            self._frame_shape = None
+            # Each camera has its own tuned motion settings and background model
+            self.motion = MotionDetector(load_motion_settings(source))
+        if old is not None:
+            old.release()
+
+    @staticmethod
+    def _warm_up(video):
+        """Wait (up to SWITCH_TIMEOUT) for the device's first frame."""
+        deadline = time.monotonic() + SWITCH_TIMEOUT
+        while video.isOpened() and time.monotonic() < deadline:
+            if video.grab():
+                return True
+            time.sleep(0.1)
+        return False
+
+    @property
+    def source_name(self):
+        """The configured source, as shown by the API and keyed in motion.json."""
+        return self.current_source
 
     def set_source(self, source_index):
+        """Switch to another device in the background; returns at once."""
         try:
             source = int(source_index)
-            self.open_camera(source)
         except ValueError:
-            pass
+            return
+        self._requested_source = source
+        threading.Thread(target=self._switch, args=(source,), name="camera-switch", daemon=True).start()
 
-    @staticmethod
-    def list_cameras():
-        import platform
-        import subprocess
-        import json
-        
-        system = platform.system()
-        cameras = []
-        if system == "Darwin":
-            try:
-                cmd = ["system_profiler", "SPCameraDataType", "-json"]
-                result = subprocess.run(cmd, capture_output=True, text=True)
-                data = json.loads(result.stdout)
-                items = data.get('SPCameraDataType', [])
-                for i, item in enumerate(items):
-                     cam_name = item.get('_name', f"Camera {i}")
-                     cap = cv2.VideoCapture(i)
-                     if cap.isOpened():
-                         cameras.append({"id": i, "name": cam_name})
-                         cap.release()
-            except Exception as e:
-                print(f"Error fetching Mac cameras: {e}")
-        elif system == "Linux":
-            import os
-            try:
-                for i in range(10):
-                    if os.path.exists(f"/dev/video{i}"):
-                        cameras.append({"id": i, "name": f"Camera/Device {i}"})
-            except:
-                pass
-
-        if not cameras:
-            for i in range(5):
-                cap = cv2.VideoCapture(i)
-                if cap.isOpened():
-                    ret, _ = cap.read()
-                    if ret:
-                        cameras.append({"id": i, "name": f"Camera {i}"})
-                    cap.release()
-        return cameras
+    def _switch(self, source):
+        # One switch at a time; one that was overtaken by a newer request is dropped
+        with self._switch_lock:
+            if source == self._requested_source:
+                self.open_camera(source)
 
     def __del__(self):
         with self.lock:
             if self.video:
                 self.video.release()
 
-    def get_frame(self):
+    def read(self):
+        """
+        Grab the next raw frame from the capture device (or None).
+        Frames are decoded into pooled buffers; hold on to one as long as
+        needed, it's only reused once nothing references it.
+        """
         with self.lock:
             if not self.video or not self.video.isOpened():
-                return None, False, [], None
-            success, frame = self.video.read()
+                return None
+            if self._frame_shape:
+                success, frame = self.video.read(frame_pool.acquire(self._frame_shape))
+            else:
+                success, frame = self.video.read()
             if not success:
-                return None, False, [], None
+                return None
+            # OpenCV allocates instead if the size changed (first frame, new source)
+            self._frame_shape = frame.shape
+        return frame
 
-        # --- 1. Basic Motion Trigger (CPU optimization) ---
-        # We only run heavy YOLO inference if something is moving.
-        
-        resized_frame = cv2.resize(frame, (640, 480))
-        gray = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (21, 21), 0)
-        
+    def get_frame(self):
+        frame = self.read()
+        if frame is None:
+            return None, False, [], None
+
+        # analyze() leaves the frame untouched, so it doubles as the clean
+        # frame for AI; only the overlay (debug mode with something to draw)
+        # needs a copy to draw on
+        motion_detected, final_detections = self.analyze(frame)
+        display = frame
+        if self.debug_mode and (final_detections or self.motion.regions):
+            display = frame.copy()
+            self.draw_overlay(display, final_detections, motion_detected, self.motion.regions)
+
+        # Return frame (for display), motion flag, detections list, and clean frame (for AI)
+        return display, motion_detected, final_detections, frame
+
+    def analyze(self, frame):
+        """
+        Run the motion trigger and (if warranted) YOLO on a frame.
+        Does not modify the frame. Returns (motion_detected, detections).
+        """
+        # --- 1. Motion Trigger (CPU optimization) ---
+        # We only run heavy YOLO inference if something is moving
+        # inside the region of interest.
+        motion = self.motion.update(frame, self.analysis_scale)
         motion_detected = False
-        significant_motion = False
-        
-        if self.last_frame is None:
-            self.last_frame = gray
-            return frame, False, [], frame.copy()
-
-        frame_delta = cv2.absdiff(self.last_frame, gray)
-        thresh = cv2.threshold(frame_delta, 25, 255, cv2.THRESH_BINARY)[1]
-        thresh = cv2.dilate(thresh, None, iterations=2)
-        contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        for contour in contours:
-            if cv2.contourArea(contour) < 500:
-                continue
-            significant_motion = True
-            break
-            
-        if significant_motion:
-            self.motion_counter += 1
-        else:
-            self.motion_counter = 0
+        detect_time = 0.0
 
         # --- 2. YOLO Detection Logic ---
         # Trigger if motion persists OR if strict debug mode forces it
-        should_run_yolo = False
-        if self.motion_counter >= 5: # Slightly faster trigger than before (was 8)
-            should_run_yolo = True
-        if self.debug_mode:
-            should_run_yolo = True
+        # (until the detector has loaded in the background, frames are only streamed)
+        forced = False
+        if self.debug_mode and self.forced_inference_every:
+            # An idle duty-cycle tier only forces every Nth frame
+            self._forced_frames += 1
+            forced = self._forced_frames % self.forced_inference_every == 0
+        should_run_yolo = (motion.triggered or forced) and self.detector.ready
             
         final_detections = []
         
         if should_run_yolo:
-            # Run YOLO on the resized frame (faster) or original? 
-            # YOLOv8n is fast (Nano). Let's try resized first for speed.
-            # verbose=False suppresses stdout spam
-            results = self.model(resized_frame, verbose=False, stream=True)
-            
-            # Calculate scaling back to original frame
-            height, width = frame.shape[:2]
-            scale_x = width / 640
-            scale_y = height / 480
-            
-            for r in results:
-                boxes = r.boxes
-                for box in boxes:
-                    cls = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    
-                    # Class 14 is 'bird' in COCO
-                    if cls == self.target_class_id: 
-                        # Confidence threshold
-                        if conf > 0.4:
-                            # Coordinates (x1, y1, x2, y2)
-                            x1, y1, x2, y2 = box.xyxy[0]
-                            
-                            # Scale to original
-                            sx1 = int(x1 * scale_x)
-                            sy1 = int(y1 * scale_y)
-                            sx2 = int(x2 * scale_x)
-                            sy2 = int(y2 * scale_y)
-                            
-                            final_detections.append((sx1, sy1, sx2, sy2, conf))
-
-        # Store clean frame for processing (before drawing)
-        clean_frame = frame.copy()
-
-        # --- 3. Action & Drawing ---
+            start = time.perf_counter()
+            # Debug mode (or no usable regions) looks at the whole frame
+            if INFERENCE_MODE == "roi" and motion.regions and not self.debug_mode:
+                final_detections = self._detect_regions(frame, motion.regions)
+            else:
+                final_detections = self._detect_full(frame)
+            detect_time = time.perf_counter() - start
+            self.inference_count += 1
+
+        # Per-stage seconds of this call, picked up by the pipeline's metrics
+        preprocess_time, motion_time = self.motion.timings
+        self.timings = {"preprocess": preprocess_time, "motion": motion_time}
+        if should_run_yolo:
+            self.timings["detect"] = detect_time
+
+        # --- 3. Action ---
         
         if len(final_detections) > 0:
             # We found a bird!
@@ -185,29 +205,94 @@ class VideoCamera:
             # Should we reset motion counter? No, let it stream as long as bird is there.
             # But the 'motion_detected' flag tells backend to save.
             # Only trigger backend save if motion counter is high enough to be stable.
-            if self.motion_counter >= 5:
+            if motion.triggered:
                 motion_detected = True
-            
-            # Draw on the display frame
-            if self.debug_mode:
-                for (x1, y1, x2, y2, conf) in final_detections:
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    label = f"Bird {conf:.2f}"
-                    cv2.putText(frame, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                    
-                if motion_detected:
-                     cv2.putText(frame, ">>> TRIGGERED <<<", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 3)
-
         else:
             # No birds found by YOLO.
             # If motion was high, but YOLO sees nothing, it's just wind/leaves/book.
             # We do NOT set motion_detected = True.
             pass
 
-        self.last_frame = gray
-        # Return frame (for display), motion flag, detections list, and clean frame (for AI)
-        return frame, motion_detected, final_detections, clean_frame
+        return motion_detected, final_detections
+
+    def _is_bird(self, cls, conf):
+        # Class 14 is 'bird' in COCO; 0.4 confidence threshold
+        return cls == self.target_class_id and conf > 0.4
+
+    def _detect_full(self, frame):
+        """YOLO on the whole frame, squashed to 640x480."""
+        # YOLOv8n is fast (Nano). Run on the resized frame for speed.
+        resized_frame = cv2.resize(frame, (640, 480), dst=frame_pool.acquire((480, 640, 3)))
+        results = self.detector.detect(resized_frame)
+
+        # Calculate scaling back to original frame
+        height, width = frame.shape[:2]
+        scale_x = width / 640
+        scale_y = height / 480
+
+        detections = []
+        for (x1, y1, x2, y2, conf, cls) in results:
+            if self._is_bird(cls, conf):
+                # Scale to original
+                detections.append((int(x1 * scale_x), int(y1 * scale_y), int(x2 * scale_x), int(y2 * scale_y), conf))
+        return detections
+
+    def _detect_regions(self, frame, regions):
+        """
+        YOLO on native-resolution tiles around the motion regions only.
+        Small, distant birds keep their pixels and static background is skipped.
+        """
+        tiles = plan_tiles(regions, frame.shape, tile_size=ROI_TILE_SIZE)
+        frame_area = frame.shape[0] * frame.shape[1]
+        tile_area = sum((x2 - x1) * (y2 - y1) for (x1, y1, x2, y2) in tiles)
+        if len(tiles) > ROI_MAX_TILES or tile_area >= frame_area:
+            # Tiling would cost more than a single full-frame pass
+            return self._detect_full(frame)
+
+        crops = [frame[y1:y2, x1:x2] for (x1, y1, x2, y2) in tiles]
+        results = self.detector.detect_batch(crops)
+
+        detections = []
+        for (tx, ty, _, _), tile_results in zip(tiles, results):
+            for (x1, y1, x2, y2, conf, cls) in tile_results:
+                if self._is_bird(cls, conf):
+                    # Offset back into frame coordinates
+                    detections.append((int(x1) + tx, int(y1) + ty, int(x2) + tx, int(y2) + ty, conf))
+        return nms(detections)
+
+    def draw_overlay(self, frame, detections, motion_detected, motion_regions=()):
+        """Draw debug boxes onto a display frame (in place)."""
+        if not self.debug_mode:
+            return
+        for (x1, y1, x2, y2) in motion_regions:
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 128, 0), 1)
+
+        for (x1, y1, x2, y2, conf) in detections:
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            label = f"Bird {conf:.2f}"
+            cv2.putText(frame, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+            
+        if detections and motion_detected:
+             cv2.putText(frame, ">>> TRIGGERED <<<", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), 3)
+
+    def update_motion_settings(self, overrides):
+        """
+        Apply and persist motion settings for the current source. Settings
+        a MotionDetector can't be built from raise (ValueError / cv2.error)
+        and are not saved.
+        """
+        motion = MotionDetector({**load_motion_settings(self.source_name), **overrides})
+        save_motion_settings(self.source_name, overrides)
+        self.motion = motion
 
     def get_jpeg(self, frame):
         ret, jpeg = cv2.imencode('.jpg', frame)
         return jpeg.tobytes()
+
+
+def open_camera_source(source):
+    """A VideoCamera; "replay:<video|image dir|synthetic>" plays footage in a loop at its own pace."""
+    if isinstance(source, str) and source.startswith("replay:"):
+        from replay import ReplayCamera, open_source
+        return ReplayCamera(open_source(source[len("replay:"):]), camera_id=source, realtime=True, loop=True)
+    return VideoCamera(source)
@@ -0,0 +1,161 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+from fastapi.staticfiles import StaticFiles
+
+logger = logging.getLogger(__name__)
+
+# Served as-is at /static/captures, so stored paths double as URLs
+CAPTURE_DIR = "static/captures"
+# Visit clips live in this folder under the capture root
+CLIP_FOLDER = "clips"
+THUMB_WIDTH = int(os.getenv("THUMB_WIDTH", "320"))
+CAPTURE_QUALITY = 92
+THUMB_QUALITY = 75
+
+# Content-addressed files never change, so browsers may cache them forever
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+
+class Capture:
+    """A stored crop: where it lives and what it is."""
+
+    def __init__(self, digest, image_path, thumb_path, width, height, size, thumb_future=None):
+        self.digest = digest
+        self.image_path = image_path
+        self.thumb_path = thumb_path
+        self.width = width
+        self.height = height
+        self.size = size
+        # Resolves to thumb_path once the thumbnail is on disk
+        self.thumb_future = thumb_future
+        # Reused by several visits (near-duplicates): never removed on its own
+        self.shared = False
+
+
+def _write_atomic(path, data):
+    if os.path.exists(path):
+        # Same content, same name: nothing to do
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class CaptureStore:
+    """
+    Writes capture crops under their SHA-256 (`ab/abcdef....jpg`) so names
+    never collide and a URL always means the same bytes. Thumbnails (WebP,
+    or JPEG where OpenCV lacks WebP) are made on a small background pool.
+    """
+
+    def __init__(self, root=CAPTURE_DIR, thumb_width=THUMB_WIDTH, workers=1):
+        self.root = root
+        self.thumb_width = thumb_width
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbs")
+        self.thumb_format = ".webp" if cv2.haveImageWriter("x.webp") else ".jpg"
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest, suffix, folder=""):
+        return os.path.join(self.root, folder, digest[:2], f"{digest}{suffix}")
+
+    def thumb_path(self, digest):
+        return self._path(digest, f"_{self.thumb_width}{self.thumb_format}", folder="thumbs")
+
+    def save(self, image):
+        """Store a BGR crop; returns a Capture (its thumbnail follows shortly)."""
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, CAPTURE_QUALITY])
+        if not ok:
+            raise ValueError("Could not encode capture")
+        data = encoded.tobytes()
+        digest = hashlib.sha256(data).hexdigest()
+        image_path = self._path(digest, ".jpg")
+        _write_atomic(image_path, data)
+
+        thumb_path = self.thumb_path(digest)
+        thumb_future = self.executor.submit(self._make_thumb, image, thumb_path)
+        height, width = image.shape[:2]
+        return Capture(digest, image_path, thumb_path, width, height, len(data), thumb_future)
+
+    def _make_thumb(self, image, path):
+        height, width = image.shape[:2]
+        if width > self.thumb_width:
+            size = (self.thumb_width, max(1, round(height * self.thumb_width / width)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        if self.thumb_format == ".webp":
+            params = [cv2.IMWRITE_WEBP_QUALITY, THUMB_QUALITY]
+        else:
+            params = [cv2.IMWRITE_JPEG_QUALITY, THUMB_QUALITY]
+        ok, encoded = cv2.imencode(self.thumb_format, image, params)
+        if not ok:
+            raise ValueError(f"Could not encode thumbnail {path}")
+        _write_atomic(path, encoded.tobytes())
+        return path
+
+    def remove(self, *paths):
+        """Delete stored files (missing ones are ignored)."""
+        for path in paths:
+            if path and os.path.isfile(path):
+                try:
+                    os.unlink(path)
+                except OSError as e:
+                    logger.warning("Failed to delete %s. Reason: %s", path, e)
+
+    def clear(self):
+        """
+        Delete every stored capture, thumbnail and clip (including legacy
+        files). Entries are moved aside at once and deleted in the background,
+        so this returns quickly however many files there are. Clips still
+        being recorded (hidden `.tmp` files) are left for their recorder.
+        """
+        trash = os.path.join(self.root, f".trash-{time.time_ns()}")
+        os.makedirs(trash)
+        for entry in os.listdir(self.root):
+            if entry.startswith(".trash-"):
+                continue
+            if entry == CLIP_FOLDER:
+                self._clear_clips(trash)
+                continue
+            self._discard(entry, trash)
+        threading.Thread(target=shutil.rmtree, args=(trash,), kwargs={"ignore_errors": True},
+                         name="captures-clear", daemon=True).start()
+
+    def _clear_clips(self, trash):
+        folder = os.path.join(self.root, CLIP_FOLDER)
+        if not os.path.isdir(folder):
+            self._discard(CLIP_FOLDER, trash)
+            return
+        os.makedirs(os.path.join(trash, CLIP_FOLDER), exist_ok=True)
+        for name in os.listdir(folder):
+            if name.startswith(".") and ".tmp." in name:
+                continue
+            self._discard(os.path.join(CLIP_FOLDER, name), trash)
+
+    def _discard(self, entry, trash):
+        try:
+            os.replace(os.path.join(self.root, entry), os.path.join(trash, entry))
+        except OSError as e:
+            logger.warning("Failed to delete %s. Reason: %s", entry, e)
+
+    def stop(self):
+        self.executor.shutdown(wait=True)
+
+
+class CaptureFiles(StaticFiles):
+    """StaticFiles for the capture directory with immutable caching for hashed files."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        name = os.path.basename(full_path)
+        # Legacy captures (capture_<ts>_...) aren't content-addressed
+        if not name.startswith("capture_"):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE
+        return response
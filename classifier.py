@@ -1,60 +1,258 @@
 import io
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
 from PIL import Image
-import torch
-from transformers import EfficientNetImageProcessor, EfficientNetForImageClassification
+
+from backends import CLASSIFIER_MODEL, hub_options, load_classifier_session
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 class BirdClassifier:
     _instance = None
     _model = None
     _processor = None
+    _session = None
+    _id2label = None
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(BirdClassifier, cls).__new__(cls)
-            cls._instance._load_model()
+            # Set once load() has finished, successfully or not
+            cls._instance.loaded = threading.Event()
         return cls._instance
 
-    def _load_model(self):
-        print("Loading Local Bird Classifier (dennisjooo/Birds-Classifier-EfficientNetB2)...")
-        model_name = "dennisjooo/Birds-Classifier-EfficientNetB2"
+    def load(self):
+        """
+        Load the model (slow: imports torch/transformers and may download
+        weights). Run by the model registry on a background thread;
+        raises if the model can't be loaded.
+        """
+        if self._is_ready():
+            return self.backend
+        from transformers import AutoConfig, EfficientNetImageProcessor, EfficientNetForImageClassification
+
+        logger.info("Loading Local Bird Classifier (%s)...", CLASSIFIER_MODEL)
+        model_name = CLASSIFIER_MODEL
         try:
-            self._processor = EfficientNetImageProcessor.from_pretrained(model_name)
-            self._model = EfficientNetForImageClassification.from_pretrained(model_name)
-            self._model.eval() # Set to evaluation mode
-            print("Bird Classifier loaded successfully.")
-        except Exception as e:
-            print(f"Failed to load Bird Classifier: {e}")
+            processor = EfficientNetImageProcessor.from_pretrained(model_name, **hub_options())
+            self._session = load_classifier_session()
+            if self._session is not None:
+                # Only the label map is needed alongside the ONNX graph
+                self._id2label = AutoConfig.from_pretrained(model_name, **hub_options()).id2label
+            else:
+                model = EfficientNetForImageClassification.from_pretrained(model_name, **hub_options())
+                model.eval() # Set to evaluation mode
+                self._id2label = model.config.id2label
+                self._model = model
+            self._processor = processor
+            logger.info("Bird Classifier loaded successfully.")
+            return self.backend
+        except Exception:
             self._model = None
+            self._session = None
+            raise
+        finally:
+            self.loaded.set()
+
+    @property
+    def backend(self):
+        return "onnx" if self._session is not None else "torch"
+
+    def _is_ready(self):
+        return self._processor is not None and (self._model is not None or self._session is not None)
 
     def predict(self, image_bytes):
-        if not self._model or not self._processor:
+        """Classify a single encoded image. Returns (label, score)."""
+        if not self._is_ready():
             return None, 0.0
 
         try:
-            # Convert bytes to PIL Image
+            # Convert bytes to RGB array
             image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-            
-            # Preprocess
-            print("Classifier: Preprocessing image...")
-            inputs = self._processor(image, return_tensors="pt")
-            
-            # Inference
-            print("Classifier: Running inference...")
-            with torch.no_grad():
-                logits = self._model(**inputs).logits
-            
-            # Get prediction
-            probs = torch.nn.functional.softmax(logits, dim=-1)
-            top_prob, top_idx = torch.max(probs, dim=-1)
-            
-            label = self._model.config.id2label[top_idx.item()]
-            score = top_prob.item()
-            print(f"Classifier result: {label} ({score:.4f})")
-            
-            return label, score
-            
         except Exception as e:
-            print(f"Error during classification: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.warning("Error decoding image for classification: %s", e)
             return None, 0.0
+
+        label, score, _ = self._classify([np.asarray(image)])[0]
+        return label, score
+
+    def predict_batch(self, crops):
+        """
+        Classify a list of BGR numpy crops (as produced by OpenCV) in a
+        single forward pass. Returns a list of (label, score).
+        """
+        return [(label, score) for label, score, _ in self.predict_batch_embedded(crops)]
+
+    def predict_batch_embedded(self, crops):
+        """
+        predict_batch() that also returns each crop's embedding (the pooled
+        penultimate layer, L2-normalized float32) from the same forward
+        pass: a list of (label, score, embedding). The embedding is None for
+        ONNX exports made before it was added as an output.
+        """
+        if not crops:
+            return []
+        if not self._is_ready():
+            return [(None, 0.0, None)] * len(crops)
+
+        # BGR -> RGB without going through an encoder
+        images = [np.ascontiguousarray(crop[..., ::-1]) for crop in crops]
+        return self._classify(images)
+
+    def infer(self, images):
+        """(logits, embeddings or None) as numpy, batch first, for a list of RGB arrays."""
+        if self._session is not None:
+            inputs = self._processor(images, return_tensors="np")
+            # Already float32: no copy
+            pixel_values = np.asarray(inputs["pixel_values"], dtype=np.float32)
+            outputs = self._session.run(None, {"pixel_values": pixel_values})
+            return outputs[0], outputs[1] if len(outputs) > 1 else None
+
+        import torch
+
+        inputs = self._processor(images, return_tensors="pt")
+        with torch.no_grad():
+            # Backbone and head separately, to keep the pooled features
+            pooled = self._model.efficientnet(pixel_values=inputs["pixel_values"]).pooler_output
+            return self._model.classifier(pooled).numpy(), pooled.numpy()
+
+    def logits(self, images):
+        """Raw logits (numpy, batch x classes) for a list of RGB arrays."""
+        return self.infer(images)[0]
+
+    def _classify(self, images):
+        try:
+            logits, embeddings = self.infer(images)
+            if embeddings is not None:
+                embeddings = embeddings.reshape(len(images), -1).astype(np.float32)
+                embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+            # Get prediction (softmax)
+            exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            probs = exp / exp.sum(axis=-1, keepdims=True)
+            top_idxs = probs.argmax(axis=-1)
+
+            results = []
+            for i, (row, idx) in enumerate(zip(probs, top_idxs)):
+                embedding = embeddings[i] if embeddings is not None else None
+                results.append((self._id2label[int(idx)], float(row[idx]), embedding))
+            return results
+
+        except Exception:
+            logger.exception("Error during classification")
+            return [(None, 0.0, None)] * len(images)
+
+
+class ClassifierWorker:
+    """
+    Persistent classification thread fed by a queue.
+
+    Crops submitted within `max_wait_ms` of each other (up to `max_batch`)
+    are classified together in one forward pass. Each submit() returns a
+    Future resolving to (label, score, embedding).
+    """
+
+    def __init__(self, classifier, max_batch=8, max_wait_ms=50, max_queue=64):
+        self.classifier = classifier
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._stopped = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="classifier-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        # Nobody will classify what's still queued: don't leave callers waiting
+        while True:
+            try:
+                _, future = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            with self._pending_lock:
+                self._pending -= 1
+            if not future.done():
+                future.set_exception(RuntimeError("classifier stopped"))
+
+    def submit(self, crop):
+        future = Future()
+        if self._stopped:
+            future.set_exception(RuntimeError("classifier stopped"))
+            return future
+        with self._pending_lock:
+            self._pending += 1
+        try:
+            self.queue.put_nowait((crop, future))
+        except queue.Full:
+            with self._pending_lock:
+                self._pending -= 1
+            future.set_exception(RuntimeError("Classifier queue is full"))
+        return future
+
+    @property
+    def pending(self):
+        """Crops queued or currently being classified."""
+        return self._pending
+
+    def _collect_batch(self):
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Crops queued while the model is still loading wait for it
+        while self._running and not self.classifier.loaded.wait(0.5):
+            pass
+        while self._running:
+            batch = self._collect_batch()
+            if not batch:
+                continue
+
+            # Drop anything the caller no longer cares about
+            live = [(crop, f) for crop, f in batch if f.set_running_or_notify_cancel()]
+            try:
+                if live:
+                    with metrics.time("classify"):
+                        results = self.classifier.predict_batch_embedded([crop for crop, _ in live])
+                    metrics.inc("classifications", amount=len(live))
+                    for (_, future), result in zip(live, results):
+                        future.set_result(result)
+            except Exception as e:
+                for _, future in live:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                with self._pending_lock:
+                    self._pending -= len(batch)
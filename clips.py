@@ -0,0 +1,290 @@
+import logging
+import math
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ENABLE_CLIPS = os.getenv("ENABLE_CLIPS", "true").lower() == "true"
+# Seconds kept before the first detection / recorded after the last one
+CLIP_PRE_SECONDS = float(os.getenv("CLIP_PRE_SECONDS", "3"))
+CLIP_POST_SECONDS = float(os.getenv("CLIP_POST_SECONDS", "5"))
+CLIP_MAX_SECONDS = float(os.getenv("CLIP_MAX_SECONDS", "30"))
+CLIP_FPS = float(os.getenv("CLIP_FPS", "10"))
+# Frames are stored (and clips written) at most this wide to bound memory
+CLIP_WIDTH = int(os.getenv("CLIP_WIDTH", "640"))
+# avc1 plays in browsers; OpenCV builds without H.264 fall back to mp4v
+CLIP_CODECS = ("avc1", "mp4v")
+
+
+class FrameRing:
+    """
+    Fixed-memory ring of recent frames.
+
+    Slots are one preallocated uint8 array; push() copies (or resizes)
+    into the next slot, so the capture loop allocates nothing per frame.
+    Frames are addressed by a sequence number; readers copy a slot out
+    under the lock and get None once it has been overwritten.
+    """
+
+    def __init__(self, seconds, fps=CLIP_FPS, width=CLIP_WIDTH):
+        self.capacity = max(2, int(math.ceil(seconds * fps)))
+        self.interval = 1.0 / fps
+        self.width = width
+        self.condition = threading.Condition()
+        self.buffer = None
+        self.stamps = np.zeros(self.capacity, dtype=np.float64)
+        self.source_shape = None
+        self.size = None
+        self.seq = 0          # sequence number of the next push
+        self.first_valid = 0  # older frames were dropped (e.g. resolution change)
+        self.last_push = 0.0
+
+    @property
+    def frame_shape(self):
+        return None if self.buffer is None else self.buffer.shape[1:]
+
+    def _allocate(self, frame):
+        height, width = frame.shape[:2]
+        if width > self.width:
+            height, width = max(2, int(round(height * self.width / width)) // 2 * 2), self.width
+        self.buffer = np.empty((self.capacity, height, width, 3), dtype=np.uint8)
+        self.source_shape = frame.shape
+        self.size = (width, height)
+        self.first_valid = self.seq
+
+    def push(self, frame, now):
+        """Store `frame` if a slot is due (pushes are capped at `fps`)."""
+        if now - self.last_push < self.interval:
+            return False
+        self.last_push = now
+        with self.condition:
+            if frame.shape != self.source_shape:
+                self._allocate(frame)
+            index = self.seq % self.capacity
+            slot = self.buffer[index]
+            if slot.shape == frame.shape:
+                np.copyto(slot, frame)
+            else:
+                cv2.resize(frame, self.size, dst=slot, interpolation=cv2.INTER_AREA)
+            self.stamps[index] = now
+            self.seq += 1
+            self.condition.notify_all()
+        return True
+
+    def oldest(self):
+        with self.condition:
+            return max(self.first_valid, self.seq - self.capacity)
+
+    def seq_at(self, timestamp):
+        """Oldest stored frame taken at or after `timestamp`."""
+        with self.condition:
+            for seq in range(max(self.first_valid, self.seq - self.capacity), self.seq):
+                if self.stamps[seq % self.capacity] >= timestamp:
+                    return seq
+            return self.seq
+
+    def read(self, seq, out):
+        """Copy frame `seq` into `out`; returns its timestamp or None."""
+        with self.condition:
+            if seq < max(self.first_valid, self.seq - self.capacity) or seq >= self.seq:
+                return None
+            slot = self.buffer[seq % self.capacity]
+            if out.shape != slot.shape:
+                return None
+            np.copyto(out, slot)
+            return float(self.stamps[seq % self.capacity])
+
+    def wait(self, seq, timeout=0.5):
+        """Block until frame `seq` has been pushed (or timeout)."""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.seq > seq, timeout=timeout)
+
+
+class ClipEvent:
+    """One clip in the making: a time window plus the tracks seen in it."""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        # tracker.Track objects seen in it, by id
+        self.tracks = {}
+        # (time, detector confidence) of inference results inside the clip
+        self.notes = []
+
+    def confidence_at(self, timestamp, window=1.0):
+        best = 0.0
+        for t, conf in reversed(self.notes):
+            if t <= timestamp:
+                if timestamp - t <= window:
+                    best = conf
+                break
+        return best
+
+
+class ClipRecorder:
+    """
+    Background clip writer for one camera.
+
+    trigger() is cheap and called from the inference thread whenever a
+    confirmed bird is in view; the recorder thread then writes the ring's
+    frames from CLIP_PRE_SECONDS before the first trigger until
+    CLIP_POST_SECONDS after the last one, and keeps the frame with the best
+    sharpness x confidence as the clip's poster.
+    """
+
+    def __init__(self, ring, out_dir, name, on_clip=None, pre_seconds=CLIP_PRE_SECONDS,
+                 post_seconds=CLIP_POST_SECONDS, max_seconds=CLIP_MAX_SECONDS, fps=CLIP_FPS):
+        self.ring = ring
+        self.out_dir = out_dir
+        self.name = name
+        # Called as on_clip(tracks, clip_path, poster_path)
+        self.on_clip = on_clip
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_seconds = max_seconds
+        self.fps = fps
+        self.lock = threading.Condition()
+        self.active = None
+        self.clips_written = 0
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-clips", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        with self.lock:
+            if self.active is not None:
+                self.active.end = min(self.active.end, time.time())
+            self.lock.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def trigger(self, tracks, confidence, now):
+        with self.lock:
+            event = self.active
+            if event is None:
+                event = self.active = ClipEvent(now - self.pre_seconds, now + self.post_seconds)
+                self.lock.notify_all()
+            else:
+                event.end = min(max(event.end, now + self.post_seconds), event.start + self.max_seconds)
+            event.tracks.update((track.id, track) for track in tracks)
+            event.notes.append((now, confidence))
+
+    def _next_event(self):
+        with self.lock:
+            self.lock.wait_for(lambda: self.active is not None or not self._running, timeout=1.0)
+            return self.active
+
+    def _finished(self, event):
+        # Decided under the lock so a late trigger starts a fresh clip instead
+        with self.lock:
+            if time.time() < event.end:
+                return False
+            self.active = None
+            return True
+
+    def _abandon(self, event):
+        with self.lock:
+            if self.active is event:
+                self.active = None
+
+    def _run(self):
+        while self._running or self.active is not None:
+            event = self._next_event()
+            if event is None:
+                continue
+            try:
+                self._record(event)
+            except Exception as e:
+                logger.exception("Clip recording failed: %s", e)
+                self._abandon(event)
+
+    def _open_writer(self, path, size):
+        for codec in CLIP_CODECS:
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), self.fps, size)
+            if writer.isOpened():
+                return writer
+            writer.release()
+        raise RuntimeError("No usable video codec for clips")
+
+    def _record(self, event):
+        os.makedirs(self.out_dir, exist_ok=True)
+        basename = f"clip_{self.name}_{int(event.start)}_{self.clips_written}"
+        clip_path = os.path.join(self.out_dir, f"{basename}.mp4")
+        tmp_path = os.path.join(self.out_dir, f".{basename}.tmp.mp4")
+
+        writer = None
+        frame = None
+        best, best_score = None, -1.0
+        written = 0
+        seq = self.ring.seq_at(event.start)
+        try:
+            while True:
+                shape = self.ring.frame_shape
+                if shape is None:
+                    if self._finished(event):
+                        break
+                    self.ring.wait(seq)
+                    continue
+                if frame is None or frame.shape != shape:
+                    if writer is not None:
+                        # Resolution changed mid-clip: keep what we have
+                        self._abandon(event)
+                        break
+                    frame = np.empty(shape, dtype=np.uint8)
+                    best = np.empty(shape, dtype=np.uint8)
+
+                stamp = self.ring.read(seq, frame)
+                if stamp is None:
+                    if seq < self.ring.oldest():
+                        # Fell behind the ring: skip ahead
+                        seq = self.ring.oldest()
+                        continue
+                    if self._finished(event):
+                        break
+                    self.ring.wait(seq)
+                    continue
+                seq += 1
+
+                if writer is None:
+                    writer = self._open_writer(tmp_path, (shape[1], shape[0]))
+                writer.write(frame)
+                written += 1
+
+                confidence = event.confidence_at(stamp)
+                if confidence > 0:
+                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    score = cv2.Laplacian(gray, cv2.CV_64F).var() * confidence
+                    if score > best_score:
+                        best_score = score
+                        np.copyto(best, frame)
+        finally:
+            if writer is not None:
+                writer.release()
+
+        if not written:
+            return
+        # The folder may have been cleared meanwhile; in-progress files are kept
+        os.makedirs(self.out_dir, exist_ok=True)
+        os.replace(tmp_path, clip_path)
+        poster_path = None
+        if best_score >= 0:
+            poster_path = os.path.join(self.out_dir, f"{basename}.jpg")
+            if not cv2.imwrite(poster_path, best):
+                poster_path = None
+        self.clips_written += 1
+        logger.info("Clip %s (%d frames, tracks %s)", clip_path, written, sorted(event.tracks))
+        if self.on_clip is not None:
+            self.on_clip([event.tracks[id] for id in sorted(event.tracks)], clip_path, poster_path)
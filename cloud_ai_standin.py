@@ -0,0 +1,100 @@
+"""
+Local stand-in for the cloud model, for testing enrichment without an API key
+or costs. Speaks just enough of the OpenAI chat completions API:
+
+    python cloud_ai_standin.py --port 8099 --latency 0.5 --fail-rate 0.3
+    OPENAI_BASE_URL=http://localhost:8099/v1 OPENAI_API_KEY=test python main.py
+
+--fail-rate answers that share of requests with 429/503 to exercise retries.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FACTS = [
+    "It can eat up to a third of its body weight in seeds every day.",
+    "It remembers the locations of hundreds of food caches.",
+    "Its song has regional dialects that young birds learn from their neighbours.",
+]
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    fail_rate = 0.0
+    counter = {"requests": 0}
+    lock = threading.Lock()
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with self.lock:
+            self.counter["requests"] += 1
+            number = self.counter["requests"]
+        time.sleep(self.latency)
+
+        if random.random() < self.fail_rate:
+            if random.random() < 0.5:
+                self._send(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}},
+                           {"Retry-After": "1"})
+            else:
+                self._send(503, {"error": {"message": "overloaded", "type": "server_error"}})
+            return
+
+        # Echo the local classifier's guess back as the second opinion
+        prompt = request["messages"][-1]["content"][0]["text"]
+        species = prompt.split("thinks this is a ", 1)[-1].split(".", 1)[0] if "thinks this is a " in prompt else "Unknown"
+        content = json.dumps({
+            "detected": True,
+            "species": species,
+            "confidence": round(random.uniform(0.6, 0.95), 2),
+            "interesting_fact": random.choice(FACTS),
+        })
+        self._send(200, {
+            "id": f"chatcmpl-standin-{number}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "standin"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def log_message(self, format, *args):
+        print(f"STANDIN: {self.address_string()} {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered 429/503")
+    args = parser.parse_args()
+
+    StandinHandler.latency = args.latency
+    StandinHandler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer((args.host, args.port), StandinHandler)
+    print(f"Cloud AI stand-in on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
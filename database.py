@@ -1,14 +1,56 @@
 import sqlite3
 import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime
 
+from metrics import metrics
+
 DB_NAME = "birdybird.db"
 
-def init_db():
-    """Initialize the database with the detections table."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''
+logger = logging.getLogger(__name__)
+
+# Each thread keeps one long-lived connection (readers never share a
+# connection with the writer; WAL lets them run while it commits).
+_local = threading.local()
+
+def _connect():
+    # isolation_level=None: we issue BEGIN/COMMIT ourselves
+    conn = sqlite3.connect(DB_NAME, isolation_level=None, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    return conn
+
+def get_connection():
+    """The calling thread's connection (opened on first use)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+    return conn
+
+def _timestamp(value):
+    """Store datetimes in the same text format sqlite3 has always written."""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value
+
+# --- Schema migrations ---
+# Each entry runs once, in order; PRAGMA user_version records how far a
+# database has been migrated. Append new steps, never edit old ones.
+
+def _add_column(conn, table, name, kind):
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if name not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {kind}')
+
+def _migration_1_detections(conn):
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS detections (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             species TEXT,
@@ -18,72 +60,602 @@ def init_db():
             interesting_fact TEXT
         )
     ''')
-    conn.commit()
-    conn.close()
 
-def add_detection(species, confidence, image_path, interesting_fact):
-    """Add a new bird detection to the database."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO detections (species, confidence, image_path, timestamp, interesting_fact)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (species, confidence, image_path, datetime.now(), interesting_fact))
-    conn.commit()
-    return c.lastrowid
-    conn.close()
+def _migration_2_cameras_and_visits(conn):
+    _add_column(conn, 'detections', 'camera_id', 'TEXT')
+    _add_column(conn, 'detections', 'track_id', 'TEXT')
+    _add_column(conn, 'detections', 'ended_at', 'DATETIME')
 
-def get_recent_detections(limit=10):
-    """Get the most recent detections."""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('''
-        SELECT * FROM detections ORDER BY timestamp DESC LIMIT ?
-    ''', (limit,))
-    rows = c.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+def _migration_3_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_timestamp ON detections (timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_species ON detections (species)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_track ON detections (track_id)')
 
-def clear_all_detections():
-    """Delete all detections from the database."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('DELETE FROM detections')
-    conn.commit()
+def _migration_4_bbox(conn):
+    # JSON [x1, y1, x2, y2] of the stored crop in the source frame
+    _add_column(conn, 'detections', 'bbox', 'TEXT')
+
+def _migration_5_keyset_index(conn):
+    # Keyset pagination walks (timestamp, id) newest-first
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_detections_timestamp_id ON detections (timestamp, id)')
+
+def _migration_6_capture_files(conn):
+    # Content-addressed capture store: thumbnail plus original size/dimensions
+    _add_column(conn, 'detections', 'thumb_path', 'TEXT')
+    _add_column(conn, 'detections', 'width', 'INTEGER')
+    _add_column(conn, 'detections', 'height', 'INTEGER')
+    _add_column(conn, 'detections', 'size', 'INTEGER')
+
+def _migration_7_clips(conn):
+    # Short video of the visit and its best (sharpest, most confident) frame
+    _add_column(conn, 'detections', 'clip_path', 'TEXT')
+    _add_column(conn, 'detections', 'poster_path', 'TEXT')
+
+# Rollups: visit counts per (hour|day, camera, species), kept in step with
+# detections by triggers so statistics never scan the detections table.
+# camera is '' rather than NULL so it can be part of the primary key.
+ROLLUPS = {
+    'stats_hourly': "strftime('%Y-%m-%d %H:00:00', {row}.timestamp)",
+    'stats_daily': "date({row}.timestamp)",
+}
+
+def _rollup_apply(table, bucket, row, sign):
+    if sign > 0:
+        return f'''
+            INSERT INTO {table} (bucket, camera_id, species, visits, confidence_sum)
+            VALUES ({bucket.format(row=row)}, COALESCE({row}.camera_id, ''), {row}.species, 1, COALESCE({row}.confidence, 0))
+            ON CONFLICT (bucket, camera_id, species) DO UPDATE SET
+                visits = visits + 1, confidence_sum = confidence_sum + excluded.confidence_sum;
+        '''
+    return f'''
+        UPDATE {table} SET visits = visits - 1, confidence_sum = confidence_sum - COALESCE({row}.confidence, 0)
+        WHERE bucket = {bucket.format(row=row)} AND camera_id = COALESCE({row}.camera_id, '') AND species = {row}.species;
+        DELETE FROM {table}
+        WHERE bucket = {bucket.format(row=row)} AND camera_id = COALESCE({row}.camera_id, '') AND species = {row}.species
+          AND visits <= 0;
+    '''
+
+def _migration_8_rollups(conn):
+    for table, bucket in ROLLUPS.items():
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TEXT NOT NULL,
+                camera_id TEXT NOT NULL,
+                species TEXT NOT NULL,
+                visits INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL,
+                PRIMARY KEY (bucket, camera_id, species)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_species ON {table} (species, bucket)')
+        conn.execute(f'''
+            INSERT INTO {table} (bucket, camera_id, species, visits, confidence_sum)
+            SELECT {bucket.format(row='detections')}, COALESCE(camera_id, ''), species, COUNT(*), TOTAL(confidence)
+            FROM detections WHERE species IS NOT NULL AND timestamp IS NOT NULL
+            GROUP BY 1, 2, 3
+        ''')
+        counted = "{row}.species IS NOT NULL AND {row}.timestamp IS NOT NULL"
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON detections
+            WHEN {counted.format(row='NEW')}
+            BEGIN {_rollup_apply(table, bucket, 'NEW', +1)} END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON detections
+            WHEN {counted.format(row='OLD')}
+            BEGIN {_rollup_apply(table, bucket, 'OLD', -1)} END
+        ''')
+        # Two triggers so each side only runs when that row was counted
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_update_old
+            AFTER UPDATE OF species, confidence, timestamp, camera_id ON detections
+            WHEN {counted.format(row='OLD')}
+            BEGIN {_rollup_apply(table, bucket, 'OLD', -1)} END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_update_new
+            AFTER UPDATE OF species, confidence, timestamp, camera_id ON detections
+            WHEN {counted.format(row='NEW')}
+            BEGIN {_rollup_apply(table, bucket, 'NEW', +1)} END
+        ''')
+
+def _migration_9_cloud_enrichment(conn):
+    # Second opinion from the cloud model, and a cache so it's asked once per image
+    _add_column(conn, 'detections', 'cloud_species', 'TEXT')
+    _add_column(conn, 'detections', 'cloud_confidence', 'REAL')
+    _add_column(conn, 'detections', 'enriched_at', 'DATETIME')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS enrichment_cache (
+            species TEXT NOT NULL,
+            image_hash TEXT NOT NULL,
+            result TEXT NOT NULL,
+            created_at DATETIME NOT NULL,
+            PRIMARY KEY (species, image_hash)
+        )
+    ''')
+
+MIGRATIONS = [
+    _migration_1_detections,
+    _migration_2_cameras_and_visits,
+    _migration_3_indexes,
+    _migration_4_bbox,
+    _migration_5_keyset_index,
+    _migration_6_capture_files,
+    _migration_7_clips,
+    _migration_8_rollups,
+    _migration_9_cloud_enrichment,
+]
+
+def init_db():
+    """
+    Create/upgrade the schema and switch the database to WAL mode. New
+    databases start in incremental auto-vacuum mode (see compact()); an
+    existing one is only converted by compact(convert=True).
+    """
+    conn = _connect()
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] == 0:
+        # WAL mode has already written the header, so even an empty database
+        # needs a VACUUM to switch (instant while it has no tables)
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        logger.info("Database migrated to version %d (%s)", number, migration.__name__)
+    latest_id = conn.execute('SELECT MAX(id) FROM detections').fetchone()[0] or 0
     conn.close()
+    _changes.reset(latest_id)
+
+# --- Change tracking ---
+
+class ChangeTracker:
+    """
+    In-memory record of the newest row id and a write counter, bumped by
+    the writer after each commit. Lets readers build ETags and answer
+    conditional requests without touching the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Distinguishes this process' counters from a previous run's
+        self.boot = format(int(time.time()), 'x')
+        self.latest_id = 0
+        self.changes = 0
+        self.last_modified = datetime.now()
+
+    def reset(self, latest_id):
+        with self.lock:
+            self.latest_id = latest_id
+
+    def record(self, count, latest_id=None):
+        with self.lock:
+            self.changes += count
+            if latest_id is not None:
+                self.latest_id = max(self.latest_id, latest_id)
+            self.last_modified = datetime.now()
+
+    def snapshot(self):
+        with self.lock:
+            return f"{self.boot}-{self.latest_id}-{self.changes}", self.last_modified
+
+_changes = ChangeTracker()
+
+def get_data_version():
+    """(version string, last modified datetime) of the detections data."""
+    return _changes.snapshot()
+
+# --- Batched writer ---
+
+class DatabaseWriter:
+    """
+    Single writer thread. Writes are queued as callables taking a
+    connection; whatever is waiting (up to `max_batch`, or `max_wait_ms`
+    after the first) is committed in one transaction. Each write gets its
+    own savepoint, so one failing statement doesn't sink the batch. Only
+    writes flagged `detections` that changed rows bump the data version.
+    """
+
+    def __init__(self, max_batch=100, max_wait_ms=50):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, operation, detections=True):
+        future = Future()
+        self._ensure_started()
+        self.queue.put((operation, future, detections))
+        return future
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout=5.0):
+        """Block until everything queued so far is committed."""
+        if self._thread is not None:
+            self.submit(lambda conn: None, detections=False).result(timeout=timeout)
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = get_connection()
+        while True:
+            batch = self._collect()
+            results = []
+            # Detection writes that changed rows (including through triggers)
+            changed = 0
+            start = time.perf_counter()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for operation, future, detections in batch:
+                    conn.execute('SAVEPOINT write')
+                    try:
+                        before = conn.total_changes
+                        results.append((future, operation(conn), None))
+                        if detections and conn.total_changes != before:
+                            changed += 1
+                        conn.execute('RELEASE write')
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO write')
+                        conn.execute('RELEASE write')
+                        results.append((future, None, e))
+                conn.execute('COMMIT')
+            except Exception as e:
+                logger.error("Database write batch failed: %s", e)
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                results = [(future, None, e) for _, future, _ in batch]
+                changed = 0
+            metrics.observe("db_write", time.perf_counter() - start)
+
+            if changed:
+                _changes.record(changed, conn.execute('SELECT MAX(id) FROM detections').fetchone()[0])
+
+            # Resolve only after commit so callers see durable results
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+writer = DatabaseWriter()
+
+def queue_write(operation, detections=True):
+    """
+    Queue operation(conn) on the writer thread. Returns a Future.
+    Pass detections=False for writes that leave the detections (and their
+    rollups) alone, so they don't invalidate cached API responses.
+    Future callbacks run on the writer thread: they may queue more writes
+    but must not block on one.
+    """
+    return writer.submit(operation, detections)
+
+def pending_writes():
+    """Writes queued but not yet picked up by the writer thread."""
+    return writer.queue.qsize()
+
+def flush_writes(timeout=5.0):
+    """Wait for all queued writes to be committed (e.g. on shutdown)."""
+    writer.flush(timeout)
+
+# --- Writes ---
+
+def _capture_values(capture):
+    if capture is None:
+        return (None, None, None, None)
+    return (capture.thumb_path, capture.width, capture.height, capture.size)
+
+def add_detection_async(species, confidence, image_path, interesting_fact, camera_id=None,
+                        track_id=None, timestamp=None, ended_at=None, bbox=None, capture=None):
+    """
+    Queue a new bird detection (visit). The Future resolves to its id.
+    `capture` (a captures.Capture) supplies the thumbnail and image size.
+    """
+    values = (species, confidence, image_path, _timestamp(timestamp or datetime.now()), interesting_fact,
+              camera_id, track_id, _timestamp(ended_at), json.dumps(bbox) if bbox is not None else None,
+              *_capture_values(capture))
+
+    def insert(conn):
+        c = conn.execute('''
+            INSERT INTO detections (species, confidence, image_path, timestamp, interesting_fact,
+                                    camera_id, track_id, ended_at, bbox, thumb_path, width, height, size)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', values)
+        return c.lastrowid
+    return queue_write(insert)
+
+def add_detection(species, confidence, image_path, interesting_fact, **kwargs):
+    """Add a new bird detection to the database and return its id."""
+    return add_detection_async(species, confidence, image_path, interesting_fact, **kwargs).result()
+
+def update_visit(id, species, confidence, image_path, interesting_fact, ended_at, bbox=None, capture=None):
+    """Queue replacing a visit's label and best frame after re-classification."""
+    values = (species, confidence, image_path, interesting_fact, _timestamp(ended_at),
+              json.dumps(bbox) if bbox is not None else None, *_capture_values(capture), id)
+    return queue_write(lambda conn: conn.execute('''
+        UPDATE detections
+        SET species = ?, confidence = ?, image_path = ?,
+            -- a cloud fact beats the placeholder description
+            interesting_fact = CASE WHEN enriched_at IS NULL THEN ? ELSE interesting_fact END, ended_at = ?,
+            bbox = COALESCE(?, bbox), thumb_path = ?, width = ?, height = ?, size = ?
+        WHERE id = ?
+    ''', values).rowcount > 0)
+
+def end_visit(id, ended_at):
+    """Queue recording when a visit's bird was last seen."""
+    return queue_write(lambda conn: conn.execute(
+        'UPDATE detections SET ended_at = ? WHERE id = ?', (_timestamp(ended_at), id)
+    ).rowcount > 0)
+
+def attach_clip(track_ids, clip_path, poster_path):
+    """Queue linking a clip to the visits of `track_ids`. Resolves to their row ids."""
+    def attach(conn):
+        placeholders = ', '.join('?' for _ in track_ids)
+        ids = [row[0] for row in conn.execute(
+            f'SELECT id FROM detections WHERE track_id IN ({placeholders})', list(track_ids))]
+        conn.executemany('UPDATE detections SET clip_path = ?, poster_path = ? WHERE id = ?',
+                         [(clip_path, poster_path, id) for id in ids])
+        return ids
+    return queue_write(attach)
 
 def update_detection(id, species, interesting_fact, confidence):
     """Update a detection's species, fact, and confidence."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''
-        UPDATE detections 
+    return queue_write(lambda conn: conn.execute('''
+        UPDATE detections
         SET species = ?, interesting_fact = ?, confidence = ?
         WHERE id = ?
-    ''', (species, interesting_fact, confidence, id))
-    conn.commit()
-    rows_affected = c.rowcount
-    conn.close()
-    return rows_affected > 0
+    ''', (species, interesting_fact, confidence, id)).rowcount > 0).result()
 
 def delete_detection(id):
     """Delete a specific detection."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('DELETE FROM detections WHERE id = ?', (id,))
-    conn.commit()
-    rows_affected = c.rowcount
-    conn.close()
-    return rows_affected > 0
+    return queue_write(lambda conn: conn.execute(
+        'DELETE FROM detections WHERE id = ?', (id,)
+    ).rowcount > 0).result()
+
+FILE_COLUMNS = ('image_path', 'thumb_path', 'clip_path', 'poster_path')
+
+def delete_detections(ids):
+    """
+    Queue deleting several detections. Resolves to the file paths they
+    referenced that no remaining row uses (safe to delete from disk).
+    """
+    ids = list(ids)
+
+    def delete(conn):
+        placeholders = ', '.join('?' for _ in ids)
+        paths = set()
+        for row in conn.execute(f"SELECT {', '.join(FILE_COLUMNS)} FROM detections WHERE id IN ({placeholders})", ids):
+            paths.update(path for path in row if path)
+        conn.execute(f'DELETE FROM detections WHERE id IN ({placeholders})', ids)
+        if not paths:
+            return []
+        # Content-addressed files can be shared by several rows
+        candidates = list(paths)
+        in_paths = ', '.join('?' for _ in candidates)
+        for column in FILE_COLUMNS:
+            paths.difference_update(row[0] for row in conn.execute(
+                f'SELECT {column} FROM detections WHERE {column} IN ({in_paths})', candidates))
+        return sorted(paths)
+    return queue_write(delete)
 
 def clear_all_detections():
     """Delete all detections from the database."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('DELETE FROM detections')
-    conn.commit()
-    conn.close()
+    queue_write(lambda conn: conn.execute('DELETE FROM detections').rowcount).result()
+
+# --- Reads ---
+
+def get_detection(id):
+    """A single detection as a dict, or None."""
+    row = get_connection().execute('SELECT * FROM detections WHERE id = ?', (id,)).fetchone()
+    return dict(row) if row else None
+
+def get_recent_detections(limit=10):
+    """Get the most recent detections."""
+    return query_detections(limit)[0]
+
+def query_detections(limit=10, before=None, species=None, min_confidence=None, max_confidence=None,
+                     since=None, until=None, camera_id=None):
+    """
+    Newest-first page of detections using keyset pagination.
+    `before` is the (timestamp, id) of the last row of the previous page.
+    Returns (rows, next_key) where next_key is None on the last page.
+    """
+    clauses, params = [], []
+    if before is not None:
+        clauses.append('(timestamp < ? OR (timestamp = ? AND id < ?))')
+        params.extend([before[0], before[0], before[1]])
+    if species:
+        clauses.append(f"species IN ({', '.join('?' for _ in species)})")
+        params.extend(species)
+    if min_confidence is not None:
+        clauses.append('confidence >= ?')
+        params.append(min_confidence)
+    if max_confidence is not None:
+        clauses.append('confidence <= ?')
+        params.append(max_confidence)
+    if since is not None:
+        clauses.append('timestamp >= ?')
+        params.append(_timestamp(since))
+    if until is not None:
+        clauses.append('timestamp < ?')
+        params.append(_timestamp(until))
+    if camera_id is not None:
+        clauses.append('camera_id = ?')
+        params.append(camera_id)
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    # Fetch one extra row to know whether another page exists
+    rows = get_connection().execute(f'''
+        SELECT * FROM detections {where}
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+
+    rows = [dict(row) for row in rows]
+    next_key = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_key = (rows[-1]['timestamp'], rows[-1]['id'])
+    return rows, next_key
+
+# --- Cloud enrichment ---
+
+def set_enrichment(id, interesting_fact, cloud_species=None, cloud_confidence=None):
+    """Queue storing a cloud model's fact and second opinion for a detection."""
+    return queue_write(lambda conn: conn.execute('''
+        UPDATE detections
+        SET interesting_fact = ?, cloud_species = ?, cloud_confidence = ?, enriched_at = ?
+        WHERE id = ?
+    ''', (interesting_fact, cloud_species, cloud_confidence, _timestamp(datetime.now()), id)).rowcount > 0)
+
+def get_cached_enrichments(species):
+    """[(image_hash, result dict)] cached for a species."""
+    rows = get_connection().execute(
+        'SELECT image_hash, result FROM enrichment_cache WHERE species = ?', (species,))
+    return [(row[0], json.loads(row[1])) for row in rows]
+
+def cache_enrichment(species, image_hash, result):
+    return queue_write(lambda conn: conn.execute('''
+        INSERT OR REPLACE INTO enrichment_cache (species, image_hash, result, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', (species, image_hash, json.dumps(result), _timestamp(datetime.now()))), detections=False)
+
+# --- Statistics (answered from the rollup tables) ---
+
+def _rollup_filters(since, until, species, camera_id):
+    clauses, params = [], []
+    if since is not None:
+        clauses.append('bucket >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('bucket < ?')
+        params.append(until)
+    if species:
+        clauses.append(f"species IN ({', '.join('?' for _ in species)})")
+        params.extend(species)
+    if camera_id is not None:
+        clauses.append('camera_id = ?')
+        params.append(camera_id)
+    return (f"WHERE {' AND '.join(clauses)}" if clauses else ''), params
+
+def _day(value):
+    return value.date().isoformat() if isinstance(value, datetime) else value
+
+def _hour(value):
+    return value.strftime('%Y-%m-%d %H:00:00') if isinstance(value, datetime) else value
+
+def get_species_totals(since=None, until=None, camera_id=None):
+    """Visits and mean confidence per species, most visited first."""
+    where, params = _rollup_filters(_day(since), _day(until), None, camera_id)
+    rows = get_connection().execute(f'''
+        SELECT species, SUM(visits) AS visits, SUM(confidence_sum) / SUM(visits) AS avg_confidence,
+               MIN(bucket) AS first_day, MAX(bucket) AS last_day
+        FROM stats_daily {where}
+        GROUP BY species ORDER BY visits DESC, species
+    ''', params)
+    return [dict(row) for row in rows]
+
+def get_visit_series(interval='hour', since=None, until=None, species=None, camera_id=None):
+    """Visits per species per hour or day: [{bucket, species, visits}]."""
+    table, bound = ('stats_hourly', _hour) if interval == 'hour' else ('stats_daily', _day)
+    where, params = _rollup_filters(bound(since), bound(until), species, camera_id)
+    rows = get_connection().execute(f'''
+        SELECT bucket, species, SUM(visits) AS visits
+        FROM {table} {where}
+        GROUP BY bucket, species ORDER BY bucket, species
+    ''', params)
+    return [dict(row) for row in rows]
+
+def get_activity_heatmap(since=None, until=None, species=None, camera_id=None):
+    """Visits per day and hour of day: [{day, hour, visits}] (activity heatmaps)."""
+    where, params = _rollup_filters(_hour(since), _hour(until), species, camera_id)
+    rows = get_connection().execute(f'''
+        SELECT substr(bucket, 1, 10) AS day, CAST(substr(bucket, 12, 2) AS INTEGER) AS hour,
+               SUM(visits) AS visits
+        FROM stats_hourly {where}
+        GROUP BY day, hour ORDER BY day, hour
+    ''', params)
+    return [dict(row) for row in rows]
+
+# --- Retention ---
+
+def get_file_paths():
+    """Every file path referenced by a detection."""
+    paths = set()
+    for row in get_connection().execute(f"SELECT {', '.join(FILE_COLUMNS)} FROM detections"):
+        paths.update(path for path in row if path)
+    return paths
+
+def get_oldest_file_rows(limit=100):
+    """(id, [file paths]) of the oldest detections."""
+    rows = get_connection().execute(f'''
+        SELECT id, {', '.join(FILE_COLUMNS)} FROM detections
+        ORDER BY timestamp, id LIMIT ?
+    ''', (limit,))
+    return [(row[0], [path for path in row[1:] if path]) for row in rows]
+
+def get_ids_older_than(cutoff):
+    return [row[0] for row in get_connection().execute(
+        'SELECT id FROM detections WHERE timestamp < ?', (_timestamp(cutoff),))]
+
+def get_ids_beyond_best(per_day, before):
+    """Ids ranked past the `per_day` most confident of their species and day, for days before `before`."""
+    return [row[0] for row in get_connection().execute('''
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY species, date(timestamp) ORDER BY confidence DESC, id DESC
+            ) AS rank
+            FROM detections WHERE timestamp < ?
+        ) WHERE rank > ?
+    ''', (_timestamp(before), per_day))]
+
+def compact(max_pages=None, convert=False):
+    """
+    Return free pages to the filesystem and truncate the WAL. Needs the
+    incremental auto-vacuum mode new databases get; with `convert`, older
+    databases are switched to it by a one-off full VACUUM, which blocks
+    writers for as long as it takes. Returns the number of pages freed.
+    """
+    conn = _connect()
+    try:
+        before = conn.execute('PRAGMA page_count').fetchone()[0]
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if mode != 2 and convert:
+            logger.info("Converting the database to incremental auto-vacuum (one-off VACUUM)")
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        elif mode == 2:
+            # Pages are only freed as the pragma is stepped, one per step. It has
+            # no result columns, so execute() steps it once and fetchall() gets
+            # nothing more; executescript() runs it to completion
+            conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages or 0)});')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return max(0, before - conn.execute('PRAGMA page_count').fetchone()[0])
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
     init_db()
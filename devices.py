@@ -0,0 +1,234 @@
+import glob
+import json
+import logging
+import os
+import platform
+import re
+import struct
+import subprocess
+import threading
+
+import cv2
+
+try:
+    import fcntl
+except ImportError:
+    # No ioctl() (Windows): cameras are found by probing instead
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# How often /dev is checked for cameras being plugged in or out (Linux)
+DEVICE_POLL_SECONDS = float(os.getenv("DEVICE_POLL_SECONDS", "2"))
+
+
+def _ioc(direction, nr, size):
+    """Request number of a 'V' ioctl: direction 2 = _IOR, 3 = _IOWR."""
+    return (direction << 30) | (size << 16) | (ord("V") << 8) | nr
+
+
+# From linux/videodev2.h
+VIDIOC_QUERYCAP = _ioc(2, 0, 104)
+VIDIOC_ENUM_FMT = _ioc(3, 2, 64)
+VIDIOC_ENUM_FRAMESIZES = _ioc(3, 74, 44)
+VIDIOC_ENUM_FRAMEINTERVALS = _ioc(3, 75, 52)
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+V4L2_FRMSIZE_TYPE_DISCRETE = 1
+V4L2_FRMIVAL_TYPE_DISCRETE = 1
+
+
+def _ioctl(fd, request, fmt, *values):
+    """One V4L2 query; None once an enumeration runs out (EINVAL)."""
+    buffer = bytearray(struct.pack(fmt, *values))
+    try:
+        fcntl.ioctl(fd, request, buffer, True)
+    except OSError:
+        return None
+    return struct.unpack(fmt, buffer)
+
+
+def _text(raw):
+    return raw.split(b"\0", 1)[0].decode(errors="replace")
+
+
+def _frame_rates(fd, pixelformat, width, height):
+    rates = []
+    for index in range(32):
+        result = _ioctl(fd, VIDIOC_ENUM_FRAMEINTERVALS, "5I6I2I", index, pixelformat, width, height, 0, *[0] * 8)
+        if result is None:
+            break
+        kind, numerator, denominator = result[4], result[5], result[6]
+        if kind != V4L2_FRMIVAL_TYPE_DISCRETE:
+            # Continuous/stepwise: report the fastest rate
+            rates.append(round(denominator / numerator, 1) if numerator else None)
+            break
+        if numerator:
+            rates.append(round(denominator / numerator, 1))
+    return sorted({r for r in rates if r}, reverse=True)
+
+
+def _formats(fd):
+    formats = []
+    for index in range(32):
+        result = _ioctl(fd, VIDIOC_ENUM_FMT, "3I32s2I3I", index, V4L2_BUF_TYPE_VIDEO_CAPTURE, 0, b"", 0, 0, 0, 0, 0)
+        if result is None:
+            break
+        description, pixelformat = _text(result[3]), result[4]
+        sizes = []
+        for size_index in range(64):
+            size = _ioctl(fd, VIDIOC_ENUM_FRAMESIZES, "3I6I2I", size_index, pixelformat, 0, *[0] * 8)
+            if size is None:
+                break
+            if size[2] == V4L2_FRMSIZE_TYPE_DISCRETE:
+                width, height = size[3], size[4]
+            else:
+                # Stepwise: min_width, max_width, step, min_height, max_height, step; report the largest
+                width, height = size[4], size[7]
+            sizes.append({"width": width, "height": height, "fps": _frame_rates(fd, pixelformat, width, height)})
+            if size[2] != V4L2_FRMSIZE_TYPE_DISCRETE:
+                break
+        formats.append({
+            "format": struct.pack("<I", pixelformat).decode(errors="replace").strip(),
+            "description": description,
+            "sizes": sizes,
+        })
+    return formats
+
+
+def query_v4l2(path):
+    """Name and capture formats of a /dev/video* node, or None if it can't capture video."""
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+    except OSError as e:
+        logger.debug("Cannot open %s: %s", path, e)
+        return None
+    try:
+        cap = _ioctl(fd, VIDIOC_QUERYCAP, "16s32s32s3I3I", b"", b"", b"", 0, 0, 0, 0, 0, 0)
+        if cap is None:
+            return None
+        capabilities, device_caps = cap[4], cap[5]
+        # UVC cameras also expose metadata nodes; only capture nodes are cameras
+        caps = device_caps if capabilities & V4L2_CAP_DEVICE_CAPS else capabilities
+        if not caps & V4L2_CAP_VIDEO_CAPTURE:
+            return None
+        return {
+            "name": _text(cap[1]),
+            "driver": _text(cap[0]),
+            "bus": _text(cap[2]),
+            "formats": _formats(fd),
+        }
+    finally:
+        os.close(fd)
+
+
+def _use_v4l2():
+    return fcntl is not None and platform.system() == "Linux"
+
+
+def _device_index(path):
+    match = re.search(r"(\d+)$", path)
+    return int(match.group(1)) if match else None
+
+
+def list_mac_cameras():
+    cameras = []
+    try:
+        cmd = ["system_profiler", "SPCameraDataType", "-json"]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        items = json.loads(result.stdout).get("SPCameraDataType", [])
+        for i, item in enumerate(items):
+            cap = cv2.VideoCapture(i)
+            if cap.isOpened():
+                cameras.append({"id": i, "name": item.get("_name", f"Camera {i}")})
+                cap.release()
+    except Exception as e:
+        logger.warning("Error fetching Mac cameras: %s", e)
+    return cameras
+
+
+def probe_cameras(count=5):
+    """Last resort: open the first few indices and see which deliver a frame."""
+    cameras = []
+    for i in range(count):
+        cap = cv2.VideoCapture(i)
+        if cap.isOpened():
+            ret, _ = cap.read()
+            if ret:
+                cameras.append({"id": i, "name": f"Camera {i}"})
+            cap.release()
+    return cameras
+
+
+class DeviceRegistry:
+    """
+    Cached list of the attached cameras, so /api/cameras never touches a
+    device.
+
+    On Linux the /dev/video* nodes are queried once through V4L2 (name,
+    pixel formats, resolutions, frame rates - without streaming) and the
+    directory is polled for hotplug; only new nodes are queried again.
+    Elsewhere the cameras are probed once in the background and again on
+    refresh().
+    """
+
+    def __init__(self, poll_seconds=DEVICE_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.lock = threading.Lock()
+        self.devices = {}  # path -> camera dict (None: not a capture node)
+        self.scanned = threading.Event()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="device-registry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread = None
+
+    def _run(self):
+        self.refresh()
+        if not _use_v4l2():
+            return
+        while not self._stopping.wait(self.poll_seconds):
+            self.refresh(rescan=False)
+
+    def refresh(self, rescan=True):
+        """Re-read the device list. `rescan=False` only queries nodes that are new."""
+        if not _use_v4l2():
+            cameras = list_mac_cameras() if platform.system() == "Darwin" else []
+            devices = {str(c["id"]): c for c in cameras or probe_cameras()}
+        else:
+            paths = set(glob.glob("/dev/video*"))
+            with self.lock:
+                known = dict(self.devices)
+            if not rescan and paths == set(known):
+                return
+            devices = {}
+            for path in sorted(paths):
+                if not rescan and path in known:
+                    devices[path] = known[path]
+                    continue
+                info = query_v4l2(path)
+                devices[path] = info and {"id": _device_index(path), "path": path, **info}
+            if not rescan:
+                added, removed = paths - set(known), set(known) - paths
+                logger.info("Cameras changed: %s", ", ".join(
+                    [f"+{p}" for p in sorted(added)] + [f"-{p}" for p in sorted(removed)]))
+        with self.lock:
+            self.devices = devices
+        self.scanned.set()
+
+    def cameras(self, timeout=5.0):
+        """[{"id", "name", ...}] of the capture devices, from the cache."""
+        # Right after startup the first scan may still be running
+        self.scanned.wait(timeout)
+        with self.lock:
+            cameras = [c for c in self.devices.values() if c is not None]
+        return sorted(cameras, key=lambda c: c["id"])
@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# "0" runs every camera at full rate around the clock
+DUTY_CYCLE = os.getenv("DUTY_CYCLE", "1") != "0"
+# Mean gray level (0-255) of the motion image below which the scene counts as
+# dark, once it has stayed that way for DUTY_NIGHT_SECONDS
+DUTY_NIGHT_BRIGHTNESS = float(os.getenv("DUTY_NIGHT_BRIGHTNESS", "25"))
+DUTY_NIGHT_SECONDS = float(os.getenv("DUTY_NIGHT_SECONDS", "120"))
+# Brightness must rise this much above the threshold before it's day again
+NIGHT_HYSTERESIS = 10.0
+
+# From full rate down. A tier applies once the scene has been quiet for
+# `idle_seconds`; the `dark` tier once the scene is dark and has been quiet as long.
+#   max_fps: capture rate cap (0 = camera rate)
+#   analysis_scale: motion analysis resolution, relative to the motion settings
+#   forced_inference_every: YOLO on every Nth frame when debug mode forces it (0 = never)
+DEFAULT_TIERS = [
+    {"name": "active", "idle_seconds": 0, "max_fps": 0, "analysis_scale": 1.0, "forced_inference_every": 1},
+    {"name": "idle", "idle_seconds": 30, "max_fps": 5, "analysis_scale": 0.5, "forced_inference_every": 5},
+    {"name": "standby", "idle_seconds": 300, "max_fps": 2, "analysis_scale": 0.5, "forced_inference_every": 20},
+    {"name": "night", "dark": True, "idle_seconds": 30, "max_fps": 1, "analysis_scale": 0.5, "forced_inference_every": 0},
+]
+
+
+def load_tiers():
+    """DEFAULT_TIERS, or the JSON list in DUTY_CYCLE_TIERS (same keys)."""
+    value = os.getenv("DUTY_CYCLE_TIERS")
+    if not value:
+        return DEFAULT_TIERS
+    try:
+        tiers = json.loads(value)
+    except ValueError as e:
+        logger.warning("Ignoring invalid DUTY_CYCLE_TIERS: %s", e)
+        return DEFAULT_TIERS
+    defaults = {"idle_seconds": 0, "max_fps": 0, "analysis_scale": 1.0, "forced_inference_every": 1}
+    return [{**defaults, **tier} for tier in tiers]
+
+
+class DutyCycleScheduler:
+    """
+    Steps a camera down to cheaper settings while nothing happens.
+
+    The pipeline reports every analyzed frame's brightness and whether
+    anything moved; after a quiet spell the scheduler moves to the next
+    tier (lower capture rate, smaller motion image, rarer forced YOLO), and
+    at night to the dark tier. The first frame with motion puts it straight
+    back on the full-rate tier, and wakes a capture loop sleeping in pace(),
+    so the frames that trigger YOLO are captured at camera rate.
+    """
+
+    def __init__(self, tiers=None, enabled=DUTY_CYCLE, night_brightness=DUTY_NIGHT_BRIGHTNESS,
+                 night_seconds=DUTY_NIGHT_SECONDS):
+        self.tiers = tiers or load_tiers()
+        self.enabled = enabled
+        self.night_brightness = night_brightness
+        self.night_seconds = night_seconds
+        self.lock = threading.Lock()
+        self.index = 0
+        self.brightness = None
+        self.changes = 0
+        now = time.monotonic()
+        self.last_activity = now
+        self.dark_since = None
+        self.night = False
+        self.entered = now
+        self.seconds_in = {tier["name"]: 0.0 for tier in self.tiers}
+        self._wake = threading.Event()
+        self._next_capture = 0.0
+
+    @property
+    def tier(self):
+        return self.tiers[self.index]
+
+    def _select(self, now):
+        quiet = now - self.last_activity
+        if self.night:
+            for index, tier in enumerate(self.tiers):
+                # Something moving at night still gets the daytime tiers
+                if tier.get("dark") and quiet >= tier["idle_seconds"]:
+                    return index
+        index = 0
+        for candidate, tier in enumerate(self.tiers):
+            if not tier.get("dark") and quiet >= tier["idle_seconds"]:
+                index = candidate
+        return index
+
+    def observe(self, brightness, active, now=None):
+        """
+        Feed one analyzed frame: its mean brightness (or None) and whether
+        there was motion or a bird. Returns the new tier if it changed, else None.
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if active:
+                self.last_activity = now
+            if brightness is not None:
+                self.brightness = brightness
+                if brightness < self.night_brightness:
+                    if self.dark_since is None:
+                        self.dark_since = now
+                    self.night = now - self.dark_since >= self.night_seconds
+                elif brightness > self.night_brightness + NIGHT_HYSTERESIS:
+                    self.dark_since = None
+                    self.night = False
+
+            index = self._select(now)
+            if index == self.index:
+                return None
+            old, old_index = self.tier, self.index
+            self.seconds_in[old["name"]] += now - self.entered
+            self.entered = now
+            self.index = index
+            self.changes += 1
+            tier = self.tier
+        logger.info("Duty cycle: %s -> %s", old["name"], tier["name"])
+        if index < old_index:
+            # Stepping up: don't let the capture loop finish a long idle sleep
+            self._wake.set()
+        return tier
+
+    def pace(self, viewing=False):
+        """
+        Sleep until the current tier's next capture slot. Live viewers get
+        camera rate for their stream; analysis still follows the tier.
+        """
+        max_fps = self.tier["max_fps"] if self.enabled and not viewing else 0
+        if not max_fps:
+            self._next_capture = 0.0
+            return
+        now = time.monotonic()
+        if now < self._next_capture:
+            self._wake.wait(self._next_capture - now)
+            self._wake.clear()
+            if self.tier["max_fps"] != max_fps:
+                self._next_capture = 0.0
+                return
+        self._next_capture = max(now, self._next_capture) + 1.0 / max_fps
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            seconds_in = dict(self.seconds_in)
+            seconds_in[self.tier["name"]] += now - self.entered
+            return {
+                "enabled": self.enabled,
+                "tier": self.tier["name"],
+                "level": self.index,
+                "max_fps": self.tier["max_fps"],
+                "analysis_scale": self.tier["analysis_scale"],
+                "night": self.night,
+                "brightness": round(self.brightness, 1) if self.brightness is not None else None,
+                "quiet_seconds": round(now - self.last_activity, 1),
+                "changes": self.changes,
+                "seconds_in_tier": {name: round(seconds) for name, seconds in seconds_in.items()},
+            }
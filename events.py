@@ -0,0 +1,85 @@
+import asyncio
+import itertools
+import json
+import threading
+
+
+class EventBus:
+    """
+    Fan-out of server events to Server-Sent Events subscribers.
+
+    publish() may be called from any thread (pipeline, classifier, DB
+    writer); events are handed to each subscriber's asyncio queue on its
+    own event loop. A subscriber that falls too far behind is cut off and
+    its client reconnects and resyncs.
+    """
+
+    def __init__(self, max_queue=256):
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.ids = itertools.count(1)
+
+    def publish(self, event, data):
+        message = (next(self.ids), event, data)
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            loop, queue = subscriber
+            try:
+                loop.call_soon_threadsafe(self._deliver, subscriber, message)
+            except RuntimeError:
+                # Loop already closed
+                self.unsubscribe(subscriber)
+
+    def _deliver(self, subscriber, message):
+        _, queue = subscriber
+        if subscriber not in self.subscribers:
+            return
+        if queue.qsize() >= self.max_queue:
+            # Too slow: drop the client; the reserved slot fits the sentinel
+            self.unsubscribe(subscriber)
+            queue.put_nowait(None)
+            return
+        queue.put_nowait(message)
+
+    def subscribe(self):
+        # One extra slot so the disconnect sentinel always fits
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=self.max_queue + 1))
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    @property
+    def has_subscribers(self):
+        return bool(self.subscribers)
+
+
+def format_sse(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def event_stream(bus, request, initial=(), heartbeat=15.0):
+    """Async generator of SSE messages for one client."""
+    subscriber = bus.subscribe()
+    _, queue = subscriber
+    try:
+        for event, data in initial:
+            yield format_sse(0, event, data)
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            if message is None:
+                break
+            yield format_sse(*message)
+    finally:
+        bus.unsubscribe(subscriber)
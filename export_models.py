@@ -0,0 +1,259 @@
+"""
+Export the detector and classifier to ONNX (optionally INT8) and compare
+them against the PyTorch path.
+
+    python export_models.py download
+    python export_models.py export [--int8] [--calibration-dir DIR] [--force]
+    python export_models.py compare [--images DIR] [--runs 20] [--threads N]
+
+`download` fills MODEL_CACHE_DIR (default ./models/cache) with the PyTorch
+weights, after which the app can run with MODELS_OFFLINE=true.
+Exports are cached in MODEL_DIR (default ./models) and picked up at
+runtime with INFERENCE_BACKEND=onnx or INFERENCE_BACKEND=onnx-int8.
+"""
+import argparse
+import glob
+import os
+import shutil
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+from backends import (
+    CLASSIFIER_MODEL, CLASSIFIER_NAME, DETECTOR_NAME, MODEL_CACHE_DIR, MODEL_DIR,
+    OnnxDetector, TorchDetector, create_onnx_session, hub_options, letterbox, onnx_model_path, yolo_weights_path,
+)
+
+DETECTOR_INPUT_SIZE = 640
+ONNX_OPSET = 17
+
+
+def download():
+    """Fetch the PyTorch weights into the model cache for offline use."""
+    from ultralytics import YOLO
+    from transformers import EfficientNetImageProcessor, EfficientNetForImageClassification
+
+    YOLO(yolo_weights_path())
+    EfficientNetImageProcessor.from_pretrained(CLASSIFIER_MODEL, **hub_options())
+    EfficientNetForImageClassification.from_pretrained(CLASSIFIER_MODEL, **hub_options())
+    print(f"Models cached in {MODEL_CACHE_DIR}")
+
+
+def export_detector(force=False):
+    target = onnx_model_path(DETECTOR_NAME)
+    if os.path.exists(target) and not force:
+        print(f"Detector already exported: {target}")
+        return target
+
+    from ultralytics import YOLO
+    weights = yolo_weights_path()
+    print(f"Exporting {weights} to ONNX...")
+    exported = YOLO(weights).export(format="onnx", imgsz=DETECTOR_INPUT_SIZE, opset=ONNX_OPSET)
+    shutil.move(exported, target)
+    print(f"Detector exported: {target}")
+    return target
+
+
+def export_classifier(force=False):
+    target = onnx_model_path(CLASSIFIER_NAME)
+    if os.path.exists(target) and not force:
+        print(f"Classifier already exported: {target}")
+        return target
+
+    import torch
+    from transformers import EfficientNetImageProcessor, EfficientNetForImageClassification
+
+    class LogitsAndEmbedding(torch.nn.Module):
+        """Logits plus the pooled features the similarity index uses."""
+
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            pooled = self.model.efficientnet(pixel_values=pixel_values).pooler_output
+            return self.model.classifier(pooled), pooled
+
+    print(f"Exporting {CLASSIFIER_MODEL} to ONNX...")
+    processor = EfficientNetImageProcessor.from_pretrained(CLASSIFIER_MODEL, **hub_options())
+    model = EfficientNetForImageClassification.from_pretrained(CLASSIFIER_MODEL, **hub_options()).eval()
+    dummy = processor(np.zeros((300, 300, 3), dtype=np.uint8), return_tensors="pt")["pixel_values"]
+
+    torch.onnx.export(
+        LogitsAndEmbedding(model), (dummy,), target,
+        input_names=["pixel_values"], output_names=["logits", "embedding"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}, "embedding": {0: "batch"}},
+        opset_version=ONNX_OPSET,
+    )
+    print(f"Classifier exported: {target}")
+    return target
+
+
+def load_images(directory, count=16):
+    """Images to export/compare with; random noise if no directory is given."""
+    if directory:
+        paths = sorted(glob.glob(os.path.join(directory, "*.jpg")) + glob.glob(os.path.join(directory, "*.png")))
+        images = [cv2.imread(p) for p in paths[:count]]
+        images = [img for img in images if img is not None]
+        if images:
+            return images
+        print(f"No images found in {directory}, using random frames.")
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(count)]
+
+
+class DetectorCalibrationReader:
+    """Feeds letterboxed frames to ONNX Runtime's static quantizer."""
+
+    def __init__(self, images, input_name):
+        self.blobs = iter([{input_name: letterbox(img, DETECTOR_INPUT_SIZE)[0]} for img in images])
+
+    def get_next(self):
+        return next(self.blobs, None)
+
+
+def quantize_models(calibration_dir=None, force=False):
+    from onnxruntime.quantization import QuantType, quantize_dynamic, quantize_static
+
+    # The classifier quantizes well with dynamic (weight-only) INT8
+    source, target = onnx_model_path(CLASSIFIER_NAME), onnx_model_path(CLASSIFIER_NAME, int8=True)
+    if os.path.exists(source) and (force or not os.path.exists(target)):
+        print("Quantizing classifier to INT8 (dynamic)...")
+        quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+        print(f"Classifier quantized: {target}")
+
+    # Conv-heavy YOLO needs static quantization with real calibration frames
+    source, target = onnx_model_path(DETECTOR_NAME), onnx_model_path(DETECTOR_NAME, int8=True)
+    if not os.path.exists(source) or (os.path.exists(target) and not force):
+        return
+    if not calibration_dir:
+        print("Skipping detector INT8: pass --calibration-dir with feeder frames to calibrate it.")
+        return
+    import onnxruntime as ort
+    input_name = ort.InferenceSession(source, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    print("Quantizing detector to INT8 (static, calibrated)...")
+    reader = DetectorCalibrationReader(load_images(calibration_dir, count=64), input_name)
+    quantize_static(source, target, reader, weight_type=QuantType.QInt8, activation_type=QuantType.QUInt8)
+    print(f"Detector quantized: {target}")
+
+
+def time_call(fn, runs):
+    fn()  # warm-up
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def box_iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def compare_detector(images, path, runs, threads):
+    reference = TorchDetector()
+    candidate = OnnxDetector(path)
+    if threads:
+        candidate.session = create_onnx_session(path, threads=threads)
+
+    matched = total = 0
+    for img in images:
+        ref = reference.detect(img)
+        cand = candidate.detect(img)
+        total += len(ref)
+        for r in ref:
+            if any(c[5] == r[5] and box_iou(r, c) > 0.5 for c in cand):
+                matched += 1
+
+    frame = images[0]
+    torch_ms = time_call(lambda: reference.detect(frame), runs)
+    onnx_ms = time_call(lambda: candidate.detect(frame), runs)
+    recall = f"{matched / total:.1%}" if total else "n/a (no reference boxes)"
+    print(f"  {os.path.basename(path)}: torch {torch_ms:.1f} ms, onnx {onnx_ms:.1f} ms, box agreement {recall}")
+
+
+def compare_classifier(images, path, runs, threads):
+    import torch
+    from transformers import EfficientNetImageProcessor, EfficientNetForImageClassification
+
+    processor = EfficientNetImageProcessor.from_pretrained(CLASSIFIER_MODEL, **hub_options())
+    model = EfficientNetForImageClassification.from_pretrained(CLASSIFIER_MODEL, **hub_options()).eval()
+    session = create_onnx_session(path, threads=threads or None)
+
+    rgb = [np.ascontiguousarray(img[..., ::-1]) for img in images]
+
+    def run_torch(batch):
+        with torch.no_grad():
+            return model(**processor(batch, return_tensors="pt")).logits.numpy()
+
+    def run_onnx(batch):
+        pixel_values = processor(batch, return_tensors="np")["pixel_values"].astype(np.float32)
+        return session.run(None, {"pixel_values": pixel_values})[0]
+
+    ref, cand = run_torch(rgb), run_onnx(rgb)
+    agreement = float(np.mean(ref.argmax(axis=-1) == cand.argmax(axis=-1)))
+    max_diff = float(np.abs(ref - cand).max())
+
+    torch_ms = time_call(lambda: run_torch(rgb[:1]), runs)
+    onnx_ms = time_call(lambda: run_onnx(rgb[:1]), runs)
+    print(f"  {os.path.basename(path)}: torch {torch_ms:.1f} ms, onnx {onnx_ms:.1f} ms, "
+          f"top-1 agreement {agreement:.1%}, max logit diff {max_diff:.4f}")
+
+
+def compare(images_dir, runs, threads):
+    images = load_images(images_dir)
+    if not images_dir:
+        print("Note: comparing on random frames; pass --images for meaningful accuracy numbers.")
+
+    print("Detector:")
+    for int8 in (False, True):
+        path = onnx_model_path(DETECTOR_NAME, int8=int8)
+        if os.path.exists(path):
+            compare_detector(images, path, runs, threads)
+
+    print("Classifier:")
+    for int8 in (False, True):
+        path = onnx_model_path(CLASSIFIER_NAME, int8=int8)
+        if os.path.exists(path):
+            compare_classifier(images, path, runs, threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("download", help="Cache the PyTorch weights for MODELS_OFFLINE")
+
+    export_cmd = sub.add_parser("export", help="Export (and cache) ONNX models")
+    export_cmd.add_argument("--int8", action="store_true", help="Also write INT8-quantized models")
+    export_cmd.add_argument("--calibration-dir", help="Frames used to calibrate the INT8 detector")
+    export_cmd.add_argument("--force", action="store_true", help="Re-export even if cached")
+
+    compare_cmd = sub.add_parser("compare", help="Accuracy/latency of ONNX vs PyTorch")
+    compare_cmd.add_argument("--images", help="Directory of sample frames (jpg/png)")
+    compare_cmd.add_argument("--runs", type=int, default=20)
+    compare_cmd.add_argument("--threads", type=int, default=0, help="ONNX Runtime intra-op threads")
+
+    args = parser.parse_args()
+    os.makedirs(MODEL_DIR, exist_ok=True)
+
+    if args.command == "download":
+        download()
+    elif args.command == "export":
+        export_detector(force=args.force)
+        export_classifier(force=args.force)
+        if args.int8:
+            quantize_models(args.calibration_dir, force=args.force)
+    else:
+        compare(args.images, args.runs, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import threading
+import weakref
+
+import numpy as np
+
+# Buffers kept per shape; enough for the frames the capture, inference and
+# streaming stages hold at once, plus a few in flight
+FRAME_POOL_BUFFERS = 8
+
+
+class _Lease:
+    """
+    Exposes one pooled buffer to numpy. The array handed out, and every
+    view derived from it, keeps its lease alive; once the lease is
+    garbage, nothing can reach the buffer any more.
+    """
+
+    __slots__ = ("storage", "__array_interface__", "__weakref__")
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.__array_interface__ = storage.__array_interface__
+
+
+class FramePool:
+    """
+    Reusable image buffers, so the hot loop stops allocating a few MB per
+    frame. Meant for the few fixed sizes of the frame path (camera frames,
+    detector input, stream profiles), not for variable-sized crops.
+
+    Nothing has to be given back: each acquired array is backed by a lease
+    object that all of its views (crops, reshapes, ...) reference, and the
+    buffer returns to the pool when a weakref finalizer sees the lease
+    collected. A caller can therefore hand a pooled frame to any number of
+    stages - queue, broadcaster, encoder - and it's reused only once they
+    have all let go.
+    """
+
+    def __init__(self, max_buffers=FRAME_POOL_BUFFERS):
+        self.max_buffers = max_buffers
+        # Reentrant: a finalizer may run while this thread holds the lock
+        self.lock = threading.RLock()
+        self.free = {}  # (shape, dtype) -> [arrays not leased out]
+        self.counts = {}  # (shape, dtype) -> buffers owned by the pool
+        self.reused = 0
+        self.allocated = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        """An array of `shape` with undefined contents, meant to be written with dst=."""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self.lock:
+            free = self.free.setdefault(key, [])
+            if free:
+                self.reused += 1
+                storage = free.pop()
+            else:
+                self.allocated += 1
+                storage = np.empty(shape, dtype=dtype)
+                if self.counts.get(key, 0) >= self.max_buffers:
+                    # Everything is busy (e.g. a slow viewer): hand out an untracked array
+                    return storage
+                self.counts[key] = self.counts.get(key, 0) + 1
+        lease = _Lease(storage)
+        weakref.finalize(lease, self._release, key, storage)
+        return np.asarray(lease)
+
+    def _release(self, key, storage):
+        with self.lock:
+            self.free[key].append(storage)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "buffers": sum(self.counts.values()),
+                "free": sum(len(f) for f in self.free.values()),
+                "reused": self.reused,
+                "allocated": self.allocated,
+            }
+
+
+# Shared by the capture, streaming and classification stages
+frame_pool = FramePool()
@@ -1,17 +1,24 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Card } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { ScrollArea } from "@/components/ui/scroll-area";
 import { Trash2 } from "lucide-react";
 import { EditDetectionDialog } from './edit-detection-dialog';
+import { useServerEvent } from '@/lib/events';
 
 interface Detection {
     id: number;
     species: string;
     confidence: number;
     image_path: string;
+    thumb_path: string | null;
+    width: number | null;
+    height: number | null;
+    clip_path: string | null;
+    poster_path: string | null;
     timestamp: string;
     interesting_fact: string;
+    camera_id: string | null;
 }
 
 import {
@@ -27,22 +34,76 @@ import {
 
 export function DetectionList() {
     const [detections, setDetections] = useState<Detection[]>([]);
+    const [older, setOlder] = useState<Detection[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const hasOlder = useRef(false);
     const [selectedDetection, setSelectedDetection] = useState<Detection | null>(null);
     const [isDialogOpen, setIsDialogOpen] = useState(false);
     const [showClearConfirm, setShowClearConfirm] = useState(false);
 
+    // Full resync (on mount, reconnect and after local edits)
     const fetchDetections = () => {
         fetch('/api/detections')
-            .then(res => res.json())
-            .then(data => setDetections(data));
+            .then(res => {
+                const cursor = res.headers.get('X-Next-Cursor');
+                return res.json().then(data => {
+                    setDetections(data);
+                    // Once older pages are loaded, keep paging from where they ended
+                    if (!hasOlder.current) setNextCursor(cursor);
+                });
+            });
+    };
+
+    const loadOlder = () => {
+        if (!nextCursor) return;
+        fetch(`/api/detections?cursor=${encodeURIComponent(nextCursor)}`)
+            .then(res => {
+                setNextCursor(res.headers.get('X-Next-Cursor'));
+                return res.json();
+            })
+            .then(data => {
+                hasOlder.current = true;
+                setOlder(prev => [...prev, ...data]);
+            });
     };
 
+    const visible = [...detections, ...older.filter(o => !detections.some(d => d.id === o.id))];
+
     useEffect(() => {
         fetchDetections();
-        const interval = setInterval(fetchDetections, 3000);
-        return () => clearInterval(interval);
     }, []);
 
+    // Live updates pushed by the server instead of polling
+    useServerEvent("open", fetchDetections);
+    useServerEvent("detection", (event) => {
+        const replace = (list: Detection[]) =>
+            list.map(d => (d.id === event.detection?.id ? event.detection : d));
+        switch (event.action) {
+            case "created":
+                setDetections(prev => [event.detection, ...prev.filter(d => d.id !== event.detection.id)]);
+                break;
+            case "updated":
+                setDetections(replace);
+                setOlder(replace);
+                break;
+            case "deleted":
+                setDetections(prev => prev.filter(d => d.id !== event.id));
+                setOlder(prev => prev.filter(d => d.id !== event.id));
+                break;
+            case "pruned":
+                // Removed by retention rules
+                setDetections(prev => prev.filter(d => !event.ids.includes(d.id)));
+                setOlder(prev => prev.filter(d => !event.ids.includes(d.id)));
+                break;
+            case "cleared":
+                hasOlder.current = false;
+                setDetections([]);
+                setOlder([]);
+                setNextCursor(null);
+                break;
+        }
+    });
+
     const handleClearAll = () => {
         setShowClearConfirm(true);
     };
@@ -50,6 +111,9 @@ export function DetectionList() {
     const confirmClearAll = () => {
         fetch('/api/detections', { method: 'DELETE' })
             .then(() => {
+                hasOlder.current = false;
+                setOlder([]);
+                setNextCursor(null);
                 fetchDetections();
                 setShowClearConfirm(false);
             });
@@ -88,20 +152,28 @@ export function DetectionList() {
 
             <ScrollArea className="flex-1 p-4">
                 <div className="flex flex-col gap-3">
-                    {detections.length === 0 ? (
+                    {visible.length === 0 ? (
                         <div className="text-center text-muted-foreground py-10">
                             No birds detected yet.
                         </div>
                     ) : (
-                        detections.map(d => (
+                        visible.map(d => (
                             <div
                                 key={d.id}
                                 className="flex gap-3 p-3 rounded-lg border border-border/40 bg-card/40 hover:bg-accent/10 hover:border-accent/50 transition-all cursor-pointer"
                                 onClick={() => handleCardClick(d)}
                             >
                                 <img
-                                    src={d.image_path}
+                                    src={d.thumb_path || d.image_path}
                                     alt={d.species}
+                                    loading="lazy"
+                                    decoding="async"
+                                    // The thumbnail is written in the background; fall back to the original
+                                    onError={e => {
+                                        if (e.currentTarget.src !== new URL(d.image_path, location.href).href) {
+                                            e.currentTarget.src = d.image_path;
+                                        }
+                                    }}
                                     className="w-20 h-20 rounded object-cover bg-black"
                                 />
                                 <div className="flex-1 flex flex-col justify-center">
@@ -110,6 +182,12 @@ export function DetectionList() {
                                         <span>{new Date(d.timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })}</span>
                                         <span>&bull;</span>
                                         <span>{Math.round(d.confidence * 100)}% Match</span>
+                                        {d.camera_id !== null && (
+                                            <>
+                                                <span>&bull;</span>
+                                                <span>Cam {d.camera_id}</span>
+                                            </>
+                                        )}
                                     </div>
                                     <p className="text-xs text-accent line-clamp-1 mt-1">
                                         {d.confidence < 0.4 ? "Low confidence match" : "Visual match confirmed"}
@@ -118,6 +196,11 @@ export function DetectionList() {
                             </div>
                         ))
                     )}
+                    {nextCursor && (
+                        <Button variant="ghost" size="sm" onClick={loadOlder}>
+                            Load older
+                        </Button>
+                    )}
                 </div>
             </ScrollArea>
 
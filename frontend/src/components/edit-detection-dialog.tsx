@@ -20,6 +20,8 @@ interface Detection {
     species: string;
     confidence: number;
     image_path: string;
+    clip_path?: string | null;
+    poster_path?: string | null;
     timestamp: string;
     interesting_fact: string;
 }
@@ -89,7 +91,19 @@ export function EditDetectionDialog({ open, onOpenChange, detection, onUpdate }:
                 </DialogHeader>
                 <div className="grid gap-4 py-4">
                     <div className="w-full aspect-video rounded-lg overflow-hidden bg-black">
-                        <img src={detection.image_path} alt={detection.species} className="w-full h-full object-contain" />
+                        {detection.clip_path ? (
+                            <video
+                                src={detection.clip_path}
+                                poster={detection.poster_path || detection.image_path}
+                                controls
+                                muted
+                                playsInline
+                                preload="none"
+                                className="w-full h-full object-contain"
+                            />
+                        ) : (
+                            <img src={detection.image_path} alt={detection.species} className="w-full h-full object-contain" />
+                        )}
                     </div>
 
                     <div className="grid grid-cols-4 items-center gap-4">
@@ -3,14 +3,30 @@ import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Camera, RefreshCw } from "lucide-react";
 import { Switch } from "@/components/ui/switch"
 import { Label } from "@/components/ui/label"
+import { useServerEvent } from "@/lib/events"
 
 
+// Stream profiles: lower ones cut bandwidth for remote viewers on slow links
+const QUALITIES: Record<string, string> = {
+    full: "",
+    medium: "width=640&quality=70&fps=10",
+    low: "width=320&quality=50&fps=5",
+};
+
+function feedUrl(feedId: string, quality: string, bust = false) {
+    const params = [QUALITIES[quality], bust ? `t=${Date.now()}` : ""].filter(Boolean).join("&");
+    return `/video_feed/${feedId}${params ? `?${params}` : ""}`;
+}
+
 export function StreamPanel() {
     const [cameras, setCameras] = useState<{ id: number; name: string }[]>([]);
+    const [feeds, setFeeds] = useState<{ id: string; source: number | string }[]>([]);
+    const [selectedFeed, setSelectedFeed] = useState("0");
     const [selectedCamera, setSelectedCamera] = useState<string>("");
     const [debugMode, setDebugMode] = useState(false);
+    const [quality, setQuality] = useState("full");
     const [streamUrl, setStreamUrl] = useState("/video_feed");
-    const [status, setStatus] = useState({ processing: false, cooldown: 0 });
+    const [status, setStatus] = useState({ processing: false, tracking: 0 });
 
     useEffect(() => {
         // Load cameras
@@ -21,27 +37,40 @@ export function StreamPanel() {
                 if (data.length > 0) setSelectedCamera(String(data[0].id));
             });
 
-        // Poll status
-        const interval = setInterval(() => {
-            fetch('/api/status')
-                .then(res => res.json())
-                .then(data => setStatus(data));
-        }, 1000);
+        // Load feeds (one per configured camera)
+        fetch('/api/feeds')
+            .then(res => res.json())
+            .then(data => setFeeds(data));
 
-        return () => clearInterval(interval);
     }, []);
 
+    // Status is pushed whenever it changes
+    useServerEvent("status", setStatus);
+
     const handleCameraChange = (e: React.ChangeEvent<HTMLSelectElement>) => {
         const camId = e.target.value;
         setSelectedCamera(camId);
-        fetch(`/api/cameras/${camId}`, { method: 'POST' })
+        fetch(`/api/cameras/${camId}?feed=${selectedFeed}`, { method: 'POST' })
             .then(() => {
                 // Force refresh stream
                 setStreamUrl("");
-                setTimeout(() => setStreamUrl(`/video_feed?t=${Date.now()}`), 200);
+                setTimeout(() => setStreamUrl(feedUrl(selectedFeed, quality, true)), 200);
             });
     };
 
+    const handleFeedChange = (e: React.ChangeEvent<HTMLSelectElement>) => {
+        const feedId = e.target.value;
+        setSelectedFeed(feedId);
+        const feed = feeds.find(f => f.id === feedId);
+        if (feed) setSelectedCamera(String(feed.source));
+        setStreamUrl(feedUrl(feedId, quality));
+    };
+
+    const handleQualityChange = (e: React.ChangeEvent<HTMLSelectElement>) => {
+        setQuality(e.target.value);
+        setStreamUrl(feedUrl(selectedFeed, e.target.value));
+    };
+
     const toggleDebug = (checked: boolean) => {
         setDebugMode(checked);
         fetch(`/api/debug/${checked}`, { method: 'POST' });
@@ -59,6 +88,26 @@ export function StreamPanel() {
                         <Switch id="debug-mode" checked={debugMode} onCheckedChange={toggleDebug} />
                         <Label htmlFor="debug-mode">Debug Overlay</Label>
                     </div>
+                    {feeds.length > 1 && (
+                        <select
+                            className="bg-background border border-input rounded px-2 py-1 text-sm"
+                            value={selectedFeed}
+                            onChange={handleFeedChange}
+                        >
+                            {feeds.map(feed => (
+                                <option key={feed.id} value={feed.id}>Feed {feed.id}</option>
+                            ))}
+                        </select>
+                    )}
+                    <select
+                        className="bg-background border border-input rounded px-2 py-1 text-sm"
+                        value={quality}
+                        onChange={handleQualityChange}
+                    >
+                        <option value="full">Full quality</option>
+                        <option value="medium">Medium</option>
+                        <option value="low">Low bandwidth</option>
+                    </select>
                     <select
                         className="bg-background border border-input rounded px-2 py-1 text-sm"
                         value={selectedCamera}
@@ -71,8 +120,8 @@ export function StreamPanel() {
                     {status.processing && (
                         <span className="text-xs font-bold text-accent animate-pulse">ANALYZING...</span>
                     )}
-                    {!status.processing && status.cooldown > 0 && (
-                        <span className="text-xs text-muted-foreground">Cooling down ({Math.ceil(status.cooldown)}s)</span>
+                    {!status.processing && status.tracking > 0 && (
+                        <span className="text-xs text-muted-foreground">Tracking {status.tracking} bird{status.tracking === 1 ? "" : "s"}</span>
                     )}
                 </div>
             </CardHeader>
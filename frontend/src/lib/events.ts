@@ -0,0 +1,43 @@
+import { useEffect, useRef } from "react"
+
+// One EventSource (/api/events) shared by every component on the page.
+// eslint-disable-next-line @typescript-eslint/no-explicit-any
+type Handler = (data: any) => void
+
+let source: EventSource | null = null
+const handlers = new Map<string, Set<Handler>>()
+
+function attach(event: string) {
+    source?.addEventListener(event, (e) => {
+        const data = JSON.parse((e as MessageEvent).data)
+        handlers.get(event)?.forEach(handler => handler(data))
+    })
+}
+
+function ensureSource() {
+    if (source) return
+    source = new EventSource("/api/events")
+    // "open" fires on the first connect and on every reconnect: time to resync
+    source.addEventListener("open", () => handlers.get("open")?.forEach(handler => handler(null)))
+    handlers.forEach((_, event) => event !== "open" && attach(event))
+}
+
+function subscribe(event: string, handler: Handler) {
+    ensureSource()
+    if (!handlers.has(event)) {
+        handlers.set(event, new Set())
+        if (event !== "open") attach(event)
+    }
+    handlers.get(event)!.add(handler)
+    return () => {
+        handlers.get(event)?.delete(handler)
+    }
+}
+
+/** Subscribe to a server event ("detection", "status", "stats", or "open" for (re)connects). */
+export function useServerEvent(event: string, handler: Handler) {
+    const latest = useRef(handler)
+    latest.current = handler
+
+    useEffect(() => subscribe(event, data => latest.current(data)), [event])
+}
@@ -1,22 +1,58 @@
 import cv2
-import threading
+import functools
+import logging
 import time
 import os
 import asyncio
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
+import base64
+import hashlib
+import json
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import List, Optional
+from fastapi import FastAPI, Request, Response, Query, BackgroundTasks, HTTPException
 import pydantic
-from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse
+from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from camera import VideoCamera
-from ai import analyze_frame
-from database import init_db, add_detection, get_recent_detections, clear_all_detections
-from classifier import BirdClassifier
+from camera import open_camera_source
+from devices import DeviceRegistry
+from pipeline import CameraPipeline
+from events import EventBus, event_stream
+import webrtc
+from ai import CloudEnricher
+from database import (
+    init_db, pending_writes, add_detection_async, update_visit, end_visit, attach_clip, clear_all_detections, flush_writes,
+    get_data_version, get_detection, query_detections,
+    get_species_totals, get_visit_series, get_activity_heatmap,
+)
+from classifier import BirdClassifier, ClassifierWorker
+from backends import get_detector
+from model_registry import ModelRegistry
+from process_pipeline import PIPELINE_MODE, ProcessCameraPipeline, RemoteClassifier, WorkerSupervisor, wait_for_detectors
+from metrics import metrics
+from framepool import frame_pool
+from captures import CAPTURE_DIR, CLIP_FOLDER, CaptureFiles, CaptureStore
+from clips import ENABLE_CLIPS
+from retention import RetentionManager
+from similarity import SimilarityIndex, phash
+from tracker import when_all_settled
 import shutil
 
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger("birdybird")
+
 app = FastAPI()
 
+# Captured crops and thumbnails: content-addressed, cached forever
+capture_store = CaptureStore(CAPTURE_DIR)
+app.mount(f"/{CAPTURE_DIR}", CaptureFiles(directory=CAPTURE_DIR), name="captures")
+
 # Mount static files (Legacy captures)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -29,119 +65,315 @@ if os.path.exists("frontend/dist/assets"):
 # Initialize DB
 init_db()
 
-# Global camera instance
-camera = VideoCamera()
-classifier = BirdClassifier()
+def parse_camera_sources(value):
+    """CAMERA_SOURCES="0,2" -> [0, 2]; non-numeric entries are URLs/paths."""
+    sources = []
+    for item in value.split(","):
+        item = item.strip()
+        if item:
+            sources.append(int(item) if item.isdigit() else item)
+    return sources or [0]
+
+# One camera pipeline per configured source. Feed ids are their position ("0", "1", ...)
+CAMERA_SOURCES = parse_camera_sources(os.getenv("CAMERA_SOURCES", "0"))
+# Legacy single-camera routes act on the first feed
+DEFAULT_CAMERA_ID = "0"
+
+# PIPELINE_MODE=process moves capture, detection and classification into
+# supervised worker processes; by default everything runs on threads here
+supervisor = WorkerSupervisor()
+if PIPELINE_MODE == "process":
+    classifier = RemoteClassifier(supervisor)
+else:
+    classifier = BirdClassifier()
 
-# Processing lock/flag to prevent overlapping AI calls
-is_processing = False
-last_ai_call_time = 0
-AI_COOLDOWN = 10  # Seconds between AI checks
+# Classification runs on a persistent, micro-batching worker
+classifier_worker = ClassifierWorker(
+    classifier,
+    max_batch=int(os.getenv("CLASSIFIER_BATCH_SIZE", "8")),
+    max_wait_ms=int(os.getenv("CLASSIFIER_BATCH_WAIT_MS", "50")),
+)
+
+# A bird that goes unseen this long ends its visit
+TRACK_TIMEOUT = float(os.getenv("TRACK_TIMEOUT", "30"))
 
 # Config
 ENABLE_CLOUD_AI = os.getenv("ENABLE_CLOUD_AI", "true").lower() == "true"
 
-def process_bird_detection(clean_frame, detections):
+# Optional second opinion + facts from a cloud model (needs OPENAI_API_KEY)
+enricher = CloudEnricher(on_enriched=lambda detection_id: publish_detection("updated", detection_id))
+
+def enrich_when_stored(track, bird_name, bird_crop):
+    """Ask the cloud model about a low-confidence visit, once per label."""
+    if track.enriched_label == bird_name:
+        return
+    track.enriched_label = bird_name
+
+    def on_done(future):
+        if future.exception() is not None:
+            logger.warning("AI enrichment of track %s failed: %s", track.id, future.exception())
+
+    when_stored(track, lambda detection_id: enricher.submit(detection_id, bird_name, bird_crop).add_done_callback(on_done))
+
+# Visit fingerprints for near-duplicate suppression and similarity search
+similarity = SimilarityIndex()
+# Ids of older visits being fingerprinted for /similar
+fingerprinting = set()
+
+def fingerprint_visit(detection_id, image):
+    """Index a visit stored before the similarity index, on the classifier worker."""
+    if detection_id in fingerprinting:
+        return
+    # A racing request at most classifies the same image twice
+    fingerprinting.add(detection_id)
+
+    def on_done(future):
+        try:
+            embedding = future.result()[2] if future.exception() is None else None
+            similarity.add(detection_id, phash(image), embedding)
+        finally:
+            fingerprinting.discard(detection_id)
+    classifier_worker.submit(image).add_done_callback(on_done)
+
+def save_visit(camera_id, track, bird_crop, crop_hash, future, reuse=None):
     """
-    Background task to handle AI analysis on specific crops.
+    Future callback: store (or improve) the visit for a classified track.
+    A track is written once; later, sharper crops only replace the stored
+    label and best frame if they classify at least as confidently.
+    `reuse` is the stored capture of a near-duplicate crop, used instead
+    of saving this one.
     """
-    global is_processing, last_ai_call_time
-    
-    print(f"Processing {len(detections)} detection(s)...")
-    
-    # Update timestamp immediately
-    last_ai_call_time = time.time()
-    
     try:
-        for i, (x1, y1, x2, y2, conf) in enumerate(detections):
-            # Crop the bird
-            # Ensure coordinates are within bounds
-            h, w, _ = clean_frame.shape
-            x1, y1 = max(0, x1), max(0, y1)
-            x2, y2 = min(w, x2), min(h, y2)
-            
-            if x1 >= x2 or y1 >= y2:
-                continue
-                
-            bird_crop = clean_frame[y1:y2, x1:x2]
-            
-            # Encode just the crop for the classifier
-            ret, crop_jpeg = cv2.imencode('.jpg', bird_crop)
-            if not ret:
-                continue
-            crop_bytes = crop_jpeg.tobytes()
-            
-            print(f"Analyzing Bird #{i+1}...")
-            
-            # Local Classification
-            label, score = classifier.predict(crop_bytes)
-            
-            # Save if it's a valid bird
-            if label and score > 0.1:
-                # Format label to Title Case (e.g., "Snowy Plover")
-                bird_name = label.replace('_', ' ').lower().title()
-                
-                if score < 0.4:
-                    description = "Low confidence match."
-                else:
-                    description = "Visual match confirmed."
-                
-                print(f"Identified Bird #{i+1}: {bird_name} ({score:.2f})")
-                
-                # Save crop to disk
-                filename = f"capture_{int(time.time())}_{i}.jpg"
-                filepath = os.path.join("static/captures", filename)
-                
-                with open(filepath, "wb") as f:
-                    f.write(crop_bytes)
-                    
-                # Save to DB
-                add_detection(bird_name, score, filepath, description)
+        label, score, embedding = future.result()
+    except Exception as e:
+        logger.error("Error classifying track %s: %s", track.id, e)
+        track.pending = False
+        return
+
+    with track.lock:
+        track.pending = False
+
+        # Save if it's a valid bird
+        if not label or score <= 0.1:
+            logger.debug("Track %s too weak: %s (%s)", track.id, label, score)
+            return
+        if track.detection_future is not None and score < track.score:
+            return
+
+        try:
+            # Format label to Title Case (e.g., "Snowy Plover")
+            bird_name = label.replace('_', ' ').lower().title()
+
+            if score < 0.4:
+                description = "Low confidence match."
             else:
-                print(f"Bird #{i+1} too weak: {label} ({score})")
+                description = "Visual match confirmed."
 
-    except Exception as e:
-        print(f"Error processing detection: {e}")
-        import traceback
-        traceback.print_exc()
-        
-    finally:
-        is_processing = False
+            logger.info("Identified track %s: %s (%.2f)", track.id, bird_name, score)
 
-def gen(camera):
-    """Video streaming generator function."""
-    global is_processing, last_ai_call_time
-    
-    while True:
-        frame, motion_detected, detections, clean_frame = camera.get_frame()
-        if frame is None:
-            break
-            
-        # Encode for streaming/AI
-        jpeg_bytes = camera.get_jpeg(frame)
-        
-        # Motion Logic Trigger
-        # Only trigger if:
-        # 1. Motion detected
-        # 2. Not currently processing
-        # 3. Cooldown passed
-        if motion_detected:
-            # print("Motion detected!") # excessive spam
-            if not is_processing:
-                if (time.time() - last_ai_call_time) > AI_COOLDOWN:
-                    print(f"MAIN: Motion Triggered with {len(detections)} birds! Starting classification thread...")
-                    # Start background thread for specific tasks
-                    is_processing = True
-                    # Pass the clean frame and the detections list
-                    t = threading.Thread(target=process_bird_detection, args=(clean_frame, detections))
-                    t.daemon = True
-                    t.start()
-                else:
-                    remaining = AI_COOLDOWN - (time.time() - last_ai_call_time)
-                    print(f"MAIN: Cooldown active ({remaining:.1f}s remaining)")
+            if reuse is not None:
+                capture = reuse
+                capture.shared = True
             else:
-                print("MAIN: Already processing (locked)")
+                # Only encode the crops we actually keep
+                with metrics.time("crop_encode", camera_id):
+                    capture = capture_store.save(bird_crop)
+            filepath = capture.image_path
+
+            started_at = datetime.fromtimestamp(track.start_time)
+            ended_at = datetime.fromtimestamp(track.last_seen)
+            bbox = [int(v) for v in track.box]
+            if track.detection_future is None:
+                # Queued on the batched DB writer; don't block the classifier
+                track.detection_future = add_detection_async(
+                    bird_name, score, filepath, description, camera_id=camera_id,
+                    track_id=track.id, timestamp=started_at, ended_at=ended_at, bbox=bbox, capture=capture,
+                )
+                when_stored(track, lambda detection_id: publish_detection("created", detection_id))
+                metrics.inc("visits", camera_id)
+            else:
+                when_stored(track, lambda detection_id: publish_when_written(
+                    update_visit(detection_id, bird_name, score, filepath, description, ended_at,
+                                 bbox=bbox, capture=capture),
+                    "updated", detection_id))
+                if track.capture is not None and track.capture.digest != capture.digest \
+                        and not track.capture.shared:
+                    capture_store.remove(track.capture.image_path, track.capture.thumb_path)
+
+            track.label, track.score, track.image_path = bird_name, score, filepath
+            track.capture = capture
+            similarity.remember(camera_id, crop_hash, bird_name, score, capture, track.id)
+            when_stored(track, lambda detection_id: similarity.add(detection_id, crop_hash, embedding))
+            if enricher.wants(score):
+                enrich_when_stored(track, bird_name, bird_crop)
+        except Exception:
+            logger.exception("Error processing detection")
+
+def publish_detection(action, detection_id):
+    """Push a created/updated detection row to live clients."""
+    if events.has_subscribers:
+        events.publish("detection", {"action": action, "detection": get_detection(detection_id)})
+
+def publish_when_written(future, action, detection_id):
+    def on_done(f):
+        if f.exception() is None and f.result():
+            publish_detection(action, detection_id)
+    future.add_done_callback(on_done)
+
+def when_stored(track, callback):
+    """Run callback(detection_id) once the track's visit row exists."""
+    def on_done(future):
+        if future.exception() is None:
+            callback(future.result())
+    track.detection_future.add_done_callback(on_done)
+
+def handle_track_event(camera_id, event, track):
+    """
+    Called by a camera pipeline's tracker. New tracks, and tracks that just
+    got a clearly sharper crop, are queued for classification; ended tracks
+    close their visit.
+    """
+    if event == "classify":
+        bird_crop = track.best_crop
+        crop_hash = phash(bird_crop)
+        duplicate = similarity.recent_match(camera_id, crop_hash)
+        if duplicate is not None:
+            metrics.inc("duplicates_skipped", camera_id)
+            if duplicate.track_id == track.id:
+                # A "sharper" crop that looks the same as the one already stored
+                track.settle()
+                return
+            logger.debug("Track %s nearly duplicates track %s, reusing %s", track.id, duplicate.track_id,
+                         duplicate.label)
+            future = Future()
+            future.set_result((duplicate.label, duplicate.score, None))
+            save_visit(camera_id, track, bird_crop, crop_hash, future, reuse=duplicate.capture)
+            track.settle()
+            return
+        logger.debug("Camera %s queueing track %s for classification", camera_id, track.id)
+        future = classifier_worker.submit(bird_crop)
+        future.add_done_callback(functools.partial(save_visit, camera_id, track, bird_crop, crop_hash))
+        # Callbacks run in order: settle() sees the visit save_visit queued
+        future.add_done_callback(lambda _: track.settle())
+    elif event == "end":
+        with track.lock:
+            if track.detection_future is not None:
+                ended_at = datetime.fromtimestamp(track.last_seen)
+                when_stored(track, lambda detection_id: end_visit(detection_id, ended_at))
+
+def handle_clip(camera_id, tracks, clip_path, poster_path):
+    """
+    Called by a camera's clip recorder. Clips often finish before their
+    tracks are classified, so the clip is linked once every track has
+    settled, and only removed if none of them became a visit.
+    """
+    def on_attached(future):
+        if future.exception() is not None:
+            logger.error("Failed to store clip %s: %s", clip_path, future.exception())
+            return
+        for detection_id in future.result():
+            publish_detection("updated", detection_id)
+
+    def on_settled(visits):
+        if not visits:
+            # None of the tracks became a visit (e.g. too weak to classify)
+            capture_store.remove(clip_path, poster_path)
+            return
+        for track in visits:
+            when_stored(track, lambda _, track_id=track.id: attach_clip(
+                [track_id], clip_path, poster_path).add_done_callback(on_attached))
+    when_all_settled(tracks, on_settled)
+
+# Live updates for dashboards (Server-Sent Events)
+events = EventBus()
+
+def publish_pruned(ids):
+    similarity.remove(ids)
+    events.publish("detection", {"action": "pruned", "ids": ids})
+
+# Keeps captures and the database within their disk budget
+retention = RetentionManager(CAPTURE_DIR, on_deleted=publish_pruned)
+# Attached cameras, enumerated in the background and kept current on hotplug
+devices = DeviceRegistry()
+
+def create_pipeline(camera_id, source):
+    options = dict(
+        camera_id=camera_id, on_track_event=handle_track_event, track_timeout=TRACK_TIMEOUT,
+        on_clip=handle_clip if ENABLE_CLIPS else None, clip_dir=os.path.join(CAPTURE_DIR, CLIP_FOLDER),
+    )
+    if PIPELINE_MODE == "process":
+        return ProcessCameraPipeline(source, supervisor, **options)
+    return CameraPipeline(open_camera_source(source), **options)
+
+# One capture/analysis pipeline per camera; every viewer reads from its broadcast buffer
+pipelines = {str(i): create_pipeline(str(i), source) for i, source in enumerate(CAMERA_SOURCES)}
+
+# Models load in the background after startup; until then the feeds stream raw frames
+models = ModelRegistry()
+if PIPELINE_MODE == "process":
+    models.register("detector", functools.partial(wait_for_detectors, list(pipelines.values())))
+else:
+    models.register("detector", get_detector().load)
+models.register("classifier", classifier.load)
+
+def get_pipeline(camera_id):
+    if camera_id not in pipelines:
+        raise HTTPException(status_code=404, detail=f"Unknown camera '{camera_id}'")
+    return pipelines[camera_id]
+
+@app.on_event("startup")
+def start_pipeline():
+    supervisor.start()
+    models.start()
+    classifier_worker.start()
+    if ENABLE_CLOUD_AI:
+        enricher.start()
+    retention.start()
+    devices.start()
+    for pipeline in pipelines.values():
+        pipeline.start()
+
+async def publish_status_changes():
+    """Push processing/tracking state when it changes, and stats every few seconds."""
+    last_status = None
+    last_stats = 0.0
+    while True:
+        await asyncio.sleep(0.5)
+        if not events.has_subscribers:
+            continue
+        status = status_snapshot()
+        if status != last_status:
+            events.publish("status", status)
+            last_status = status
+        if time.monotonic() - last_stats >= 5:
+            events.publish("stats", pipeline_stats())
+            last_stats = time.monotonic()
+
+@app.on_event("startup")
+async def start_event_publisher():
+    app.state.status_task = asyncio.create_task(publish_status_changes())
+
+@app.on_event("shutdown")
+async def close_webrtc_peers():
+    await webrtc.close_all()
+
+@app.on_event("shutdown")
+def stop_pipeline():
+    supervisor.stop()
+    for pipeline in pipelines.values():
+        pipeline.stop()
+    classifier_worker.stop()
+    enricher.stop()
+    retention.stop()
+    devices.stop()
+    capture_store.stop()
+    models.stop()
+    flush_writes()
+    similarity.save()
 
+def gen(pipeline, width=None, quality=None, fps=None):
+    """Video streaming generator function."""
+    for jpeg_bytes in pipeline.frames(width=width, quality=quality, max_fps=fps):
         yield (b'--frame\r\n'
                b'Content-Type: image/jpeg\r\n\r\n' + jpeg_bytes + b'\r\n\r\n')
 
@@ -151,27 +383,239 @@ def gen(camera):
 #    return templates.TemplateResponse("index.html", {"request": request})
 
 @app.get("/video_feed")
-def video_feed():
-    return StreamingResponse(gen(camera), media_type="multipart/x-mixed-replace; boundary=frame")
+def video_feed(
+    width: Optional[int] = Query(None, ge=160, le=1920),
+    quality: Optional[int] = Query(None, ge=10, le=100),
+    fps: Optional[float] = Query(None, gt=0, le=60),
+):
+    return video_feed_camera(DEFAULT_CAMERA_ID, width, quality, fps)
+
+@app.get("/video_feed/{camera_id}")
+def video_feed_camera(
+    camera_id: str,
+    width: Optional[int] = Query(None, ge=160, le=1920),
+    quality: Optional[int] = Query(None, ge=10, le=100),
+    fps: Optional[float] = Query(None, gt=0, le=60),
+):
+    """
+    MJPEG stream. `width` downscales, `quality` sets JPEG quality and `fps`
+    caps the frame rate; clients with the same settings share one encode.
+    """
+    pipeline = get_pipeline(camera_id)
+    return StreamingResponse(gen(pipeline, width, quality, fps),
+                             media_type="multipart/x-mixed-replace; boundary=frame")
+
+class WebRTCOffer(pydantic.BaseModel):
+    sdp: str
+    type: str
+
+@app.post("/api/webrtc/{camera_id}/offer")
+async def webrtc_offer(camera_id: str, offer: WebRTCOffer,
+                       width: Optional[int] = Query(None, ge=160, le=1920),
+                       fps: Optional[float] = Query(None, gt=0, le=30)):
+    """Low-bandwidth H.264 alternative to MJPEG (needs aiortc installed)."""
+    pipeline = get_pipeline(camera_id)
+    if not webrtc.available():
+        raise HTTPException(status_code=501, detail="WebRTC support is not installed (pip install aiortc)")
+    try:
+        return await webrtc.answer(pipeline, offer.sdp, offer.type, width=width, max_fps=fps)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid offer: {e}")
+
+@app.get("/api/feeds")
+def get_feeds():
+    return [
+        {"id": camera_id, "source": pipeline.camera.source_name, "stats": pipeline.stats()}
+        for camera_id, pipeline in pipelines.items()
+    ]
 
 @app.get("/api/cameras")
-def get_cameras():
-    return camera.list_cameras()
+def get_cameras(refresh: bool = False):
+    """Cached; `refresh` re-queries every device first."""
+    if refresh:
+        devices.refresh()
+    return devices.cameras()
 
 @app.post("/api/cameras/{index}")
-def set_camera(index: int):
-    camera.set_source(index)
-    return {"status": "success", "message": f"Switched to camera {index}"}
+def set_camera(index: int, feed: str = DEFAULT_CAMERA_ID):
+    # Opens in the background; the feed switches once the new camera delivers frames
+    get_pipeline(feed).camera.set_source(index)
+    return {"status": "success", "message": f"Switching feed {feed} to camera {index}"}
 
 @app.post("/api/debug/{enabled}")
 def set_debug_mode(enabled: str):
     is_enabled = enabled.lower() == "true"
-    camera.toggle_debug(is_enabled)
+    for pipeline in pipelines.values():
+        pipeline.camera.toggle_debug(is_enabled)
     return {"status": "success", "debug_mode": is_enabled}
 
+class MotionSettingsRequest(pydantic.BaseModel):
+    # Stored settings are applied on every restart, so anything that can't
+    # be analysed with is rejected here rather than in the inference thread
+    method: Optional[str] = None
+    analysis_width: Optional[int] = pydantic.Field(None, ge=16)
+    analysis_height: Optional[int] = pydantic.Field(None, ge=16)
+    blur_kernel: Optional[int] = pydantic.Field(None, ge=1)
+    threshold: Optional[int] = pydantic.Field(None, ge=0, le=255)
+    min_area: Optional[float] = pydantic.Field(None, ge=0)
+    trigger_frames: Optional[int] = pydantic.Field(None, ge=1)
+    learning_rate: Optional[float] = pydantic.Field(None, ge=0, le=1)
+    mog2_history: Optional[int] = pydantic.Field(None, ge=1)
+    mog2_var_threshold: Optional[float] = pydantic.Field(None, gt=0)
+    roi: Optional[List[List[List[float]]]] = None
+    exclude: Optional[List[List[List[float]]]] = None
+
+    @pydantic.field_validator("roi", "exclude")
+    @classmethod
+    def check_polygons(cls, polygons):
+        for polygon in polygons or []:
+            if len(polygon) < 3:
+                raise ValueError("a polygon needs at least 3 points")
+            for point in polygon:
+                if len(point) != 2 or not all(0.0 <= v <= 1.0 for v in point):
+                    raise ValueError("points must be [x, y] pairs between 0 and 1")
+        return polygons
+
+@app.get("/api/motion")
+def get_motion(feed: str = DEFAULT_CAMERA_ID):
+    camera = get_pipeline(feed).camera
+    motion = camera.motion
+    return {
+        "feed": feed,
+        "camera": camera.source_name,
+        "settings": motion.settings,
+        "active": motion.counter > 0,
+        "regions": motion.regions,
+    }
+
+@app.put("/api/motion")
+def update_motion(request: MotionSettingsRequest, feed: str = DEFAULT_CAMERA_ID):
+    camera = get_pipeline(feed).camera
+    overrides = request.model_dump(exclude_none=True)
+    if "method" in overrides and overrides["method"] not in ("average", "mog2"):
+        raise HTTPException(status_code=400, detail="method must be 'average' or 'mog2'")
+    try:
+        camera.update_motion_settings(overrides)
+    except (ValueError, cv2.error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid motion settings: {e}")
+    return {"status": "success", "settings": camera.motion.settings}
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return timestamp, int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_date(value, name):
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected ISO 8601")
+
+def conditional_headers(request):
+    """
+    Validators for responses derived from the detections data. Returns
+    (headers, not_modified) where not_modified means a 304 will do.
+    """
+    version, last_modified = get_data_version()
+    etag = f'W/"{version}-{hashlib.sha1(str(request.url.query).encode()).hexdigest()[:12]}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": format_datetime(last_modified.astimezone(timezone.utc), usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return headers, True
+    elif request.headers.get("if-modified-since"):
+        try:
+            since_header = parsedate_to_datetime(request.headers["if-modified-since"])
+            if last_modified.astimezone(timezone.utc).replace(microsecond=0) <= since_header:
+                return headers, True
+        except (TypeError, ValueError):
+            pass
+    return headers, False
+
 @app.get("/api/detections")
-def get_detections():
-    return get_recent_detections()
+def get_detections(
+    request: Request,
+    limit: int = Query(10, ge=1, le=200),
+    cursor: Optional[str] = None,
+    species: Optional[List[str]] = Query(None),
+    min_confidence: Optional[float] = Query(None, ge=0, le=1),
+    max_confidence: Optional[float] = Query(None, ge=0, le=1),
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    camera: Optional[str] = None,
+):
+    """
+    Newest-first detections with keyset paging: follow the X-Next-Cursor
+    header (or Link rel="next") for older rows. Unchanged polls get a 304
+    straight from the in-memory data version, without a database query.
+    """
+    headers, not_modified = conditional_headers(request)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    rows, next_key = query_detections(
+        limit=limit,
+        before=decode_cursor(cursor) if cursor else None,
+        species=species,
+        min_confidence=min_confidence,
+        max_confidence=max_confidence,
+        since=parse_date(since, "since"),
+        until=parse_date(until, "until"),
+        camera_id=camera,
+    )
+    if next_key is not None:
+        next_cursor = encode_cursor(next_key)
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return JSONResponse(rows, headers=headers)
+
+# --- Statistics: answered from rollup tables, never by scanning detections ---
+
+def stats_response(request, query):
+    headers, not_modified = conditional_headers(request)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(query(), headers=headers)
+
+@app.get("/api/stats/species")
+def get_species_stats(request: Request, since: Optional[str] = None, until: Optional[str] = None,
+                      camera: Optional[str] = None):
+    """Total visits and mean confidence per species."""
+    return stats_response(request, lambda: get_species_totals(
+        parse_date(since, "since"), parse_date(until, "until"), camera_id=camera))
+
+@app.get("/api/stats/visits")
+def get_visit_stats(
+    request: Request,
+    interval: str = Query("hour", pattern="^(hour|day)$"),
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    species: Optional[List[str]] = Query(None),
+    camera: Optional[str] = None,
+):
+    """Visits per species per hour or day."""
+    return stats_response(request, lambda: get_visit_series(
+        interval, parse_date(since, "since"), parse_date(until, "until"), species=species, camera_id=camera))
+
+@app.get("/api/stats/heatmap")
+def get_heatmap_stats(request: Request, since: Optional[str] = None, until: Optional[str] = None,
+                      species: Optional[List[str]] = Query(None), camera: Optional[str] = None):
+    """Visits per day and hour of day."""
+    return stats_response(request, lambda: get_activity_heatmap(
+        parse_date(since, "since"), parse_date(until, "until"), species=species, camera_id=camera))
 
 class UpdateDetectionRequest(pydantic.BaseModel):
     species: str
@@ -183,15 +627,62 @@ def update_detection_endpoint(id: int, request: UpdateDetectionRequest):
     from database import update_detection
     success = update_detection(id, request.species, request.interesting_fact, request.confidence)
     if success:
+        publish_detection("updated", id)
         return {"status": "success", "message": "Detection updated"}
     else:
         raise HTTPException(status_code=404, detail="Detection not found")
 
+@app.post("/api/detections/{id}/enrich", status_code=202)
+def enrich_detection(id: int, refresh: bool = False):
+    """Ask the cloud model for a fact and second opinion; the result arrives as an "updated" event."""
+    detection = get_detection(id)
+    if detection is None:
+        raise HTTPException(status_code=404, detail="Detection not found")
+    if not ENABLE_CLOUD_AI or not enricher.available:
+        raise HTTPException(status_code=503, detail="Cloud AI is not configured")
+    image = cv2.imread(detection["image_path"]) if detection["image_path"] else None
+    if image is None:
+        raise HTTPException(status_code=404, detail="Detection image not found")
+    enricher.submit(id, detection["species"], image, refresh=refresh)
+    return {"status": "queued"}
+
+@app.get("/api/detections/{id}/similar")
+def get_similar_detections(id: int, limit: int = Query(12, ge=1, le=100),
+                           min_similarity: float = Query(0.0, ge=0, le=1)):
+    """
+    Visits that look most like this one (classifier embeddings, or the
+    perceptual hash where no embedding exists), each with a "similarity".
+    Visits stored before the index existed are fingerprinted in the
+    background; until then this answers 202 with a Retry-After.
+    """
+    detection = get_detection(id)
+    if detection is None:
+        raise HTTPException(status_code=404, detail="Detection not found")
+    if id not in similarity:
+        if id not in fingerprinting:
+            image = cv2.imread(detection["image_path"]) if detection["image_path"] else None
+            if image is None:
+                raise HTTPException(status_code=404, detail="Detection image not found")
+            fingerprint_visit(id, image)
+        return JSONResponse(status_code=202, content={"status": "indexing"}, headers={"Retry-After": "1"})
+
+    results = []
+    for other_id, score in similarity.similar(id, limit):
+        if score < min_similarity:
+            break
+        row = get_detection(other_id)
+        if row is not None:
+            row["similarity"] = round(score, 3)
+            results.append(row)
+    return results
+
 @app.delete("/api/detections/{id}")
 def delete_detection_endpoint(id: int):
     from database import delete_detection
     success = delete_detection(id)
     if success:
+        similarity.remove([id])
+        events.publish("detection", {"action": "deleted", "id": id})
         return {"status": "success", "message": "Detection deleted"}
     else:
         raise HTTPException(status_code=404, detail="Detection not found")
@@ -200,23 +691,112 @@ def delete_detection_endpoint(id: int):
 def clear_detections():
     # 1. Clear DB
     clear_all_detections()
+    similarity.clear()
     
-    # 2. Clear images
-    folder = "static/captures"
-    if os.path.exists(folder):
-        for filename in os.listdir(folder):
-            file_path = os.path.join(folder, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-            except Exception as e:
-                print(f"Failed to delete {file_path}. Reason: {e}")
-                
+    # 2. Clear images, thumbnails and clips (deleted in the background)
+    capture_store.clear()
+
+    events.publish("detection", {"action": "cleared"})
     return {"status": "success", "message": "All detections cleared"}
 
+@app.get("/api/retention")
+def get_retention():
+    """Retention rules, disk usage and the progress/result of cleanup runs."""
+    return retention.status()
+
+@app.post("/api/retention/run", status_code=202)
+def run_retention():
+    retention.run_now()
+    return retention.status()
+
+def status_snapshot():
+    return {
+        "processing": classifier_worker.pending > 0,
+        "queued": classifier_worker.pending,
+        "tracking": sum(len(p.tracker.tracks) for p in pipelines.values()),
+    }
+
+def pipeline_stats():
+    return {camera_id: p.stats() for camera_id, p in pipelines.items()}
+
 @app.get("/api/status")
 def get_status():
-    return {"processing": is_processing, "cooldown": max(0, AI_COOLDOWN - (time.time() - last_ai_call_time))}
+    status = status_snapshot()
+    status["pipeline"] = pipelines[DEFAULT_CAMERA_ID].stats()
+    status["pipelines"] = pipeline_stats()
+    status["cloud_ai"] = enricher.stats
+    status["models"] = models.status()
+    status["workers"] = supervisor.status()
+    status["duty_cycle"] = {camera_id: p.duty.status() for camera_id, p in pipelines.items()}
+    return status
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the server answers. Model states are informational."""
+    return {"status": "ok", "models": models.status()}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: 503 until every model has loaded."""
+    ready = models.ready
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "models": models.status()})
+
+def queue_depths():
+    return {
+        "classifier": classifier_worker.pending,
+        "db_writes": pending_writes(),
+        "event_subscribers": len(events.subscribers),
+    }
+
+@app.get("/api/pipeline/stats")
+def get_pipeline_stats():
+    """Per-stage latency summaries (ms), counters, rates and queue depths."""
+    return {
+        "cameras": pipeline_stats(),
+        "queues": queue_depths(),
+        "frame_pool": frame_pool.stats(),
+        **metrics.snapshot(),
+    }
+
+# Per-camera gauges exported on /metrics: (stats key, metric name, help)
+PIPELINE_GAUGES = [
+    ("capture_fps", "capture_fps", "Frames captured per second."),
+    ("analysis_fps", "analysis_fps", "Frames analyzed per second."),
+    ("inference_fps", "inference_fps", "YOLO passes per second."),
+    ("dropped_frames", "dropped_frames", "Frames skipped because inference was busy."),
+    ("queue_depth", "inference_queue_depth", "Frames waiting for the inference stage."),
+    ("active_tracks", "active_tracks", "Birds currently tracked."),
+    ("viewers", "stream_viewers", "Live stream viewers."),
+    ("duty_level", "duty_cycle_level", "Duty-cycle tier, 0 = full rate."),
+]
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of the pipeline metrics."""
+    stats = pipeline_stats()
+    gauges = [
+        (name, help_text, {(("camera", camera_id),): camera_stats[key] for camera_id, camera_stats in stats.items()})
+        for key, name, help_text in PIPELINE_GAUGES
+    ]
+    gauges.append(("queue_depth", "Items waiting per queue.",
+                   {(("queue", queue),): depth for queue, depth in queue_depths().items()}))
+    gauges.append(("model_ready", "1 once the model has loaded.",
+                   {(("model", name),): int(model["state"] == "ready") for name, model in models.status().items()}))
+    return Response(metrics.prometheus(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/events")
+async def get_events(request: Request):
+    """
+    Server-Sent Events: "detection" (created/updated/deleted/cleared),
+    "status" (on change) and "stats" (periodic). Clients resync with
+    /api/detections whenever the stream (re)connects.
+    """
+    initial = [("status", status_snapshot())]
+    return StreamingResponse(
+        event_stream(events, request, initial=initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/{full_path:path}")
 async def serve_spa(full_path: str):
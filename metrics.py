@@ -0,0 +1,152 @@
+import bisect
+import threading
+import time
+
+# Upper bounds (seconds) shared by every stage histogram: 0.5 ms .. 5 s
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Stages timed through the pipeline, in processing order
+STAGES = ("capture", "preprocess", "motion", "detect", "crop_encode", "classify", "db_write", "stream_encode")
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; observe() is a bisect and three adds."""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    @staticmethod
+    def quantile(buckets, counts, count, q):
+        """Estimate a quantile by interpolating inside its bucket."""
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = buckets[index - 1] if index > 0 else 0.0
+                upper = buckets[index] if index < len(buckets) else buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return buckets[-1]
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """
+    Process-wide registry of per-stage latency histograms and counters,
+    labelled by camera ("" for shared stages such as classify/db_write).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def histogram(self, stage, camera=""):
+        key = (stage, camera)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, stage, seconds, camera=""):
+        self.histogram(stage, camera).observe(seconds)
+
+    def time(self, stage, camera=""):
+        """Context manager timing one run of `stage`."""
+        return _Timer(self.histogram(stage, camera))
+
+    def inc(self, name, camera="", amount=1):
+        key = (name, camera)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """JSON-friendly {stages: {stage: {camera: summary}}, counters: {...}}."""
+        with self.lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        stages = {}
+        for (stage, camera), histogram in sorted(histograms.items()):
+            counts, total, count = histogram.snapshot()
+            summary = {"count": count, "mean_ms": round(total / count * 1000, 3) if count else None}
+            for name, q in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+                value = Histogram.quantile(histogram.buckets, counts, count, q)
+                summary[name] = round(value * 1000, 3) if value is not None else None
+            stages.setdefault(stage, {})[camera] = summary
+        counter_tree = {}
+        for (name, camera), value in sorted(counters.items()):
+            counter_tree.setdefault(name, {})[camera] = value
+        return {"stages": stages, "counters": counter_tree}
+
+    def prometheus(self, gauges=()):
+        """
+        Prometheus text exposition. `gauges` is an iterable of
+        (name, help, {labels tuple: value}) added alongside the histograms.
+        """
+        with self.lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        lines = [
+            "# HELP birdybird_stage_seconds Time spent per pipeline stage.",
+            "# TYPE birdybird_stage_seconds histogram",
+        ]
+        for (stage, camera), histogram in sorted(histograms.items()):
+            counts, total, count = histogram.snapshot()
+            labels = f'stage="{stage}",camera="{camera}"'
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'birdybird_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'birdybird_stage_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"birdybird_stage_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"birdybird_stage_seconds_count{{{labels}}} {count}")
+
+        names = sorted({name for name, _ in counters})
+        for name in names:
+            lines.append(f"# TYPE birdybird_{name}_total counter")
+            for (counter, camera), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f'birdybird_{name}_total{{camera="{camera}"}} {value}')
+
+        for name, help_text, values in gauges:
+            lines.append(f"# HELP birdybird_{name} {help_text}")
+            lines.append(f"# TYPE birdybird_{name} gauge")
+            for labels, value in values.items():
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+                lines.append(f"birdybird_{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Failed loads (e.g. no network yet after boot) are retried with backoff up to this
+MODEL_RETRY_MAX_SECONDS = float(os.getenv("MODEL_RETRY_MAX_SECONDS", "300"))
+
+PENDING, LOADING, READY, FAILED = "pending", "loading", "ready", "failed"
+
+
+class ModelRegistry:
+    """
+    Loads the models on a background thread so the app (and the raw video
+    stream) is up immediately after a restart.
+
+    Models load one after another in registration order - the detector
+    first, since nothing downstream happens without it - which also keeps
+    peak memory down on a Pi. A model that fails doesn't hold up the ones
+    after it: failed models are retried in later rounds, with backoff.
+    status() reports each model's state for the health endpoints.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models = {}
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def register(self, name, load):
+        """`load()` does the work and returns the backend it ended up on."""
+        self.models[name] = {"load": load, "state": PENDING, "backend": None, "error": None,
+                             "attempts": 0, "load_seconds": None}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="model-loader", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # A load in progress can't be interrupted; the daemon thread dies with the process
+        self._stopping.set()
+        self._thread = None
+
+    def _run(self):
+        pending = list(self.models)
+        delay = 5.0
+        while not self._stopping.is_set():
+            pending = [name for name in pending if not self._stopping.is_set() and not self._load(name)]
+            if not pending:
+                return
+            logger.info("Retrying %s in %.0fs", ", ".join(pending), delay)
+            if self._stopping.wait(delay):
+                return
+            delay = min(delay * 2, MODEL_RETRY_MAX_SECONDS)
+
+    def _load(self, name):
+        model = self.models[name]
+        with self.lock:
+            model["state"] = LOADING
+            model["attempts"] += 1
+        start = time.monotonic()
+        try:
+            backend = model["load"]()
+        except Exception as e:
+            logger.error("Failed to load %s: %s", name, e)
+            with self.lock:
+                model["state"] = FAILED
+                model["error"] = str(e)
+            return False
+        with self.lock:
+            model["state"] = READY
+            model["backend"] = backend
+            model["error"] = None
+            model["load_seconds"] = round(time.monotonic() - start, 2)
+        logger.info("%s ready (%s) in %.1fs", name, backend, model["load_seconds"])
+        return True
+
+    @property
+    def ready(self):
+        return all(model["state"] == READY for model in self.models.values())
+
+    def status(self):
+        with self.lock:
+            return {
+                name: {key: value for key, value in model.items() if key != "load"}
+                for name, model in self.models.items()
+            }
@@ -0,0 +1,224 @@
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Per-camera overrides live in this file:
+#   {"default": {...}, "cameras": {"0": {...}, "1": {...}}}
+MOTION_CONFIG_FILE = os.getenv("MOTION_CONFIG", "motion.json")
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MOTION_SETTINGS = {
+    # "average" (running-average background) or "mog2" (Gaussian mixture)
+    "method": "average",
+    # Motion is analysed on a downscaled copy of the frame
+    "analysis_width": 320,
+    "analysis_height": 240,
+    "blur_kernel": 11,
+    # Pixel intensity change that counts as motion
+    "threshold": 25,
+    # Smallest motion blob, as a fraction of the frame (500 px at 640x480)
+    "min_area": 0.0016,
+    # Consecutive motion frames before YOLO is woken up
+    "trigger_frames": 5,
+    # How fast the running-average background adapts (0-1)
+    "learning_rate": 0.05,
+    "mog2_history": 500,
+    "mog2_var_threshold": 16,
+    # Polygons in normalized [x, y] coordinates (0-1). Empty ROI = whole frame.
+    "roi": [],
+    "exclude": [],
+}
+
+MotionResult = collections.namedtuple("MotionResult", ["significant", "triggered", "regions"])
+
+_config_lock = threading.Lock()
+
+
+def _read_config():
+    if not os.path.exists(MOTION_CONFIG_FILE):
+        return {"default": {}, "cameras": {}}
+    try:
+        with open(MOTION_CONFIG_FILE) as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read %s: %s", MOTION_CONFIG_FILE, e)
+        return {"default": {}, "cameras": {}}
+    config.setdefault("default", {})
+    config.setdefault("cameras", {})
+    return config
+
+
+def load_motion_settings(camera_id):
+    """Defaults, overlaid with the file's default and per-camera settings."""
+    with _config_lock:
+        config = _read_config()
+    settings = dict(DEFAULT_MOTION_SETTINGS)
+    settings.update(config["default"])
+    settings.update(config["cameras"].get(str(camera_id), {}))
+    return settings
+
+
+def save_motion_settings(camera_id, overrides):
+    """Persist per-camera overrides (merged with what's already stored)."""
+    with _config_lock:
+        config = _read_config()
+        camera_config = config["cameras"].setdefault(str(camera_id), {})
+        camera_config.update(overrides)
+        with open(MOTION_CONFIG_FILE, "w") as f:
+            json.dump(config, f, indent=2)
+
+
+class MotionDetector:
+    """
+    Background-model motion gate.
+
+    Frames are downscaled to the analysis resolution, compared against a
+    running-average (or MOG2) background, masked by the ROI/exclusion
+    polygons and reduced to a list of motion regions in full-frame pixels.
+    """
+
+    def __init__(self, settings=None, reuse_buffers=True):
+        self.settings = dict(DEFAULT_MOTION_SETTINGS)
+        self.settings.update(settings or {})
+        self.counter = 0
+        self.regions = []
+        # Mean gray level (0-255) of the last analyzed frame
+        self.brightness = None
+        # Seconds spent in the last update(): (resize/blur, background diff + contours)
+        self.timings = (0.0, 0.0)
+        self._background = None
+        self._subtractor = None
+        self._mask = None
+        # Every intermediate image is written into these (OpenCV dst=) instead
+        # of being allocated per frame; reuse_buffers=False is the old behaviour
+        self.reuse_buffers = reuse_buffers
+        self._buffers = {}
+        # Built now so settings that can't work fail here, not mid-stream
+        width, height = self.analysis_size
+        if width < 16 or height < 16:
+            raise ValueError(f"analysis size {width}x{height} is too small")
+        self._mask = self._build_mask((width, height))
+
+    def reset(self):
+        self.counter = 0
+        self.regions = []
+        self._background = None
+        self._subtractor = None
+
+    def _buffer(self, name, shape, dtype=np.uint8):
+        """Preallocated array for one intermediate (None -> OpenCV allocates)."""
+        if not self.reuse_buffers:
+            return None
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buffer
+
+    @property
+    def analysis_size(self):
+        return int(self.settings["analysis_width"]), int(self.settings["analysis_height"])
+
+    def _rescale(self, size):
+        """Carry the background model over to a new analysis size (duty cycling)."""
+        width, height = size
+        if self._background is not None and self._background.shape != (height, width):
+            self._background = cv2.resize(self._background, (width, height), interpolation=cv2.INTER_LINEAR)
+        if self._mask is not None and self._mask.shape != (height, width):
+            self._mask = None
+
+    def _build_mask(self, size):
+        width, height = size
+        scale = np.array([width, height], dtype=np.float32)
+
+        def to_pixels(polygon):
+            return (np.array(polygon, dtype=np.float32) * scale).astype(np.int32)
+
+        if self.settings["roi"]:
+            mask = np.zeros((height, width), dtype=np.uint8)
+            cv2.fillPoly(mask, [to_pixels(p) for p in self.settings["roi"]], 255)
+        else:
+            mask = np.full((height, width), 255, dtype=np.uint8)
+        if self.settings["exclude"]:
+            cv2.fillPoly(mask, [to_pixels(p) for p in self.settings["exclude"]], 0)
+        return mask
+
+    def _foreground(self, gray):
+        if self.settings["method"] == "mog2":
+            if self._subtractor is None:
+                self._subtractor = cv2.createBackgroundSubtractorMOG2(
+                    history=int(self.settings["mog2_history"]),
+                    varThreshold=float(self.settings["mog2_var_threshold"]),
+                    detectShadows=False,
+                )
+            return self._subtractor.apply(gray, self._buffer("foreground", gray.shape))
+
+        if self._background is None:
+            self._background = gray.astype(np.float32)
+            return None
+        background = cv2.convertScaleAbs(self._background, dst=self._buffer("background", gray.shape))
+        frame_delta = cv2.absdiff(gray, background, dst=self._buffer("delta", gray.shape))
+        cv2.accumulateWeighted(gray, self._background, float(self.settings["learning_rate"]))
+        return cv2.threshold(frame_delta, int(self.settings["threshold"]), 255, cv2.THRESH_BINARY,
+                             dst=self._buffer("thresh", gray.shape))[1]
+
+    def update(self, frame, scale=1.0):
+        """
+        Feed one full-resolution BGR frame. Returns a MotionResult.
+        `scale` shrinks the analysis size further (the average method only:
+        MOG2's model can't be resized, so it stays at full analysis size).
+        """
+        start = time.perf_counter()
+        width, height = self.analysis_size
+        if scale != 1.0 and self.settings["method"] != "mog2":
+            width, height = max(16, int(width * scale)), max(16, int(height * scale))
+        self._rescale((width, height))
+        small = cv2.resize(frame, (width, height), dst=self._buffer("small", (height, width, 3)),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=self._buffer("gray", (height, width)))
+        self.brightness = cv2.mean(gray)[0]
+        # Must be odd; shrinks along with a duty-cycled analysis size
+        kernel = max(3, int(self.settings["blur_kernel"]) * width // self.analysis_size[0]) | 1
+        gray = cv2.GaussianBlur(gray, (kernel, kernel), 0, dst=self._buffer("blurred", (height, width)))
+        preprocessed = time.perf_counter()
+
+        thresh = self._foreground(gray)
+        if thresh is None:
+            self.timings = (preprocessed - start, time.perf_counter() - preprocessed)
+            return MotionResult(False, False, [])
+
+        if self._mask is None:
+            self._mask = self._build_mask((width, height))
+        # In place: thresh is ours (a buffer, or freshly allocated)
+        thresh = cv2.bitwise_and(thresh, self._mask, dst=thresh)
+        thresh = cv2.dilate(thresh, None, dst=self._buffer("dilated", thresh.shape), iterations=2)
+        # OpenCV 4 no longer modifies the image passed to findContours, so no copy
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        # Map regions back to the full-resolution frame
+        frame_h, frame_w = frame.shape[:2]
+        scale_x, scale_y = frame_w / width, frame_h / height
+        min_area = float(self.settings["min_area"]) * width * height
+
+        regions = []
+        for contour in contours:
+            if cv2.contourArea(contour) < min_area:
+                continue
+            x, y, w, h = cv2.boundingRect(contour)
+            regions.append((int(x * scale_x), int(y * scale_y), int((x + w) * scale_x), int((y + h) * scale_y)))
+
+        if regions:
+            self.counter += 1
+        else:
+            self.counter = 0
+        self.regions = regions
+
+        triggered = self.counter >= int(self.settings["trigger_frames"])
+        self.timings = (preprocessed - start, time.perf_counter() - preprocessed)
+        return MotionResult(bool(regions), triggered, regions)
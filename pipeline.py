@@ -0,0 +1,339 @@
+import collections
+import logging
+import threading
+import time
+
+from clips import CLIP_PRE_SECONDS, ClipRecorder, FrameRing
+from duty_cycle import DutyCycleScheduler
+from framepool import frame_pool
+from metrics import metrics
+from streaming import FrameRateLimiter, JpegCache, normalize_profile
+from tracker import IouTracker
+
+logger = logging.getLogger(__name__)
+
+
+class FrameBroadcaster:
+    """
+    Holds the latest published frame so any number of viewers can read it
+    without touching the camera themselves. Encoding happens on demand,
+    once per stream profile (see streaming.JpegCache).
+    """
+
+    def __init__(self, label=""):
+        self.condition = threading.Condition()
+        self.seq = 0
+        self.frame = None
+        self.closed = False
+        self.jpegs = JpegCache(label)
+
+    def publish(self, frame):
+        with self.condition:
+            self.frame = frame
+            self.seq += 1
+            self.condition.notify_all()
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """
+        Block until a frame newer than `last_seq` is available.
+        Returns (seq, frame) or (last_seq, None) on timeout/close.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq != last_seq or self.closed, timeout=timeout)
+            if self.closed or self.seq == last_seq:
+                return last_seq, None
+            return self.seq, self.frame
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class LatestFrameQueue:
+    """
+    Bounded queue between capture and inference. When full, the oldest
+    frame is dropped so the consumer always gets the freshest one.
+    """
+
+    def __init__(self, maxsize=1):
+        self.items = collections.deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout=1.0):
+        """Return the newest item (discarding older ones) or None on timeout."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.items) > 0, timeout=timeout):
+                return None
+            item = self.items.pop()
+            self.dropped += len(self.items)
+            self.items.clear()
+            return item
+
+    def __len__(self):
+        return len(self.items)
+
+
+class RateMeter:
+    """Events per second over a short sliding window."""
+
+    def __init__(self, window=2.0):
+        self.window = window
+        self.stamps = collections.deque()
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def tick(self):
+        now = time.monotonic()
+        with self.lock:
+            self.total += 1
+            self.stamps.append(now)
+            while self.stamps and now - self.stamps[0] > self.window:
+                self.stamps.popleft()
+
+    def rate(self):
+        now = time.monotonic()
+        with self.lock:
+            while self.stamps and now - self.stamps[0] > self.window:
+                self.stamps.popleft()
+            if len(self.stamps) < 2:
+                return 0.0
+            span = now - self.stamps[0]
+            return (len(self.stamps) - 1) / span if span > 0 else 0.0
+
+
+class CameraPipeline:
+    """
+    Background capture + analysis stages that own a VideoCamera.
+
+    The capture thread grabs frames at camera rate, publishes them to the
+    broadcast buffer for viewers and hands them to the inference thread
+    through a drop-oldest queue. Live preview therefore never waits on YOLO;
+    the inference stage simply skips whatever went stale while it was busy.
+
+    While the scene is dark or quiet, a DutyCycleScheduler lowers the
+    capture rate and the cost of analysis until something moves again.
+    """
+
+    # How long a set of debug boxes stays on the preview after inference
+    OVERLAY_TTL = 1.0
+
+    def __init__(self, camera, camera_id="0", on_track_event=None, track_timeout=30.0,
+                 on_clip=None, clip_dir=None):
+        self.camera = camera
+        self.camera_id = camera_id
+        # Called as on_track_event(camera_id, "classify" | "end", track)
+        self.on_track_event = on_track_event
+        self.tracker = IouTracker(camera_id, max_age=track_timeout)
+        self.duty = DutyCycleScheduler()
+
+        # Optional visit clips: the capture thread feeds a fixed-memory ring,
+        # a recorder thread writes clips around confirmed detections
+        self.ring = None
+        self.recorder = None
+        if on_clip is not None:
+            self.ring = FrameRing(CLIP_PRE_SECONDS + 2.0)
+            self.recorder = ClipRecorder(
+                self.ring, clip_dir, f"camera{camera_id}",
+                on_clip=lambda tracks, clip_path, poster_path: on_clip(camera_id, tracks, clip_path, poster_path),
+            )
+        self.broadcaster = FrameBroadcaster(camera_id)
+        self.queue = LatestFrameQueue(maxsize=1)
+        self.capture_meter = RateMeter()
+        self.analysis_meter = RateMeter()
+        self.inference_meter = RateMeter()
+        self._overlay = ([], False, [], 0.0)
+        self._triggered = False
+        self._viewers = 0
+        self._viewers_lock = threading.Lock()
+        self._threads = []
+        self._running = False
+
+    def start(self):
+        if self._threads:
+            return
+        self._running = True
+        if self.recorder is not None:
+            self.recorder.start()
+        for name, target in (("capture", self._capture_loop), ("inference", self._inference_loop)):
+            t = threading.Thread(target=target, name=f"camera{self.camera_id}-{name}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        self._running = False
+        self.broadcaster.close()
+        for t in self._threads:
+            t.join(timeout=2.0)
+        self._threads = []
+        if self.recorder is not None:
+            self.recorder.stop()
+        for track in self.tracker.flush():
+            self._emit("end", track)
+
+    def _capture_loop(self):
+        while self._running:
+            try:
+                self._capture_once()
+            except Exception:
+                # Keep the feed alive; a failing camera backs off like a missing one
+                logger.exception("Camera %s: capture failed", self.camera_id)
+                metrics.inc("pipeline_errors", self.camera_id)
+                time.sleep(0.1)
+
+    def _capture_once(self):
+        self.duty.pace(viewing=self._viewers > 0)
+        start = time.perf_counter()
+        frame = self.camera.read()
+        if frame is None:
+            # Camera not ready (or switching source), back off briefly
+            time.sleep(0.1)
+            return
+        self.capture_meter.tick()
+        metrics.observe("capture", time.perf_counter() - start, self.camera_id)
+
+        if self.ring is not None:
+            self.ring.push(frame, time.time())
+
+        # The inference stage owns this frame from here on
+        self.queue.put(frame)
+        self._publish(frame)
+
+    def _publish(self, frame):
+        display = frame
+        detections, triggered, regions, stamp = self._overlay
+        if self._viewers and self.camera.debug_mode and (detections or regions) \
+                and time.monotonic() - stamp < self.OVERLAY_TTL:
+            display = frame_pool.acquire(frame.shape)
+            display[...] = frame
+            self.camera.draw_overlay(display, detections, triggered, regions)
+
+        # Nothing is encoded here: viewers encode on demand, once per profile
+        self.broadcaster.publish(display)
+
+    def _inference_loop(self):
+        while self._running:
+            try:
+                self._analyze_once()
+            except Exception:
+                # One bad frame (or model/tracker error) must not end detection for good
+                logger.exception("Camera %s: analysis failed", self.camera_id)
+                metrics.inc("pipeline_errors", self.camera_id)
+                time.sleep(0.1)
+
+    def _analyze_once(self):
+        frame = self.queue.get(timeout=0.5)
+        if frame is None:
+            return
+
+        inference_count = self.camera.inference_count
+        motion_detected, detections = self.camera.analyze(frame)
+        self._handle_analysis(frame, motion_detected, detections,
+                              self.camera.inference_count != inference_count, self.camera.timings)
+
+    def _handle_analysis(self, frame, motion_detected, detections, ran_inference, timings):
+        """Stats, overlay, tracking and clip triggers for one analyzed frame."""
+        self.analysis_meter.tick()
+        if ran_inference:
+            self.inference_meter.tick()
+        self._overlay = (detections, motion_detected, self.camera.motion.regions, time.monotonic())
+        for stage, seconds in timings.items():
+            metrics.observe(stage, seconds, self.camera_id)
+        triggered = self.camera.motion.counter >= int(self.camera.motion.settings["trigger_frames"])
+        if triggered and not self._triggered:
+            metrics.inc("motion_triggers", self.camera_id)
+        self._triggered = triggered
+        if motion_detected and detections:
+            metrics.inc("detections", self.camera_id, len(detections))
+        active = bool(self.camera.motion.regions or detections or self.tracker.tracks)
+        tier = self.duty.observe(self.camera.motion.brightness, active)
+        if tier is not None:
+            self._apply_tier(tier)
+
+        # Only confirmed (motion-triggered) birds feed the tracker
+        now = time.time()
+        confirmed = detections if motion_detected else []
+        to_classify, ended = self.tracker.update(confirmed, frame, now)
+        if confirmed and self.recorder is not None:
+            seen = [t for t in self.tracker.tracks if t.last_seen == now]
+            self.recorder.trigger(seen, max(d[4] for d in confirmed), now)
+        for track in to_classify:
+            self._emit("classify", track)
+        for track in ended:
+            self._emit("end", track)
+
+    def _apply_tier(self, tier):
+        self.camera.apply_tier(tier)
+
+    def _emit(self, event, track):
+        if self.on_track_event is None:
+            return
+        try:
+            self.on_track_event(self.camera_id, event, track)
+        except Exception:
+            logger.exception("Track handler failed")
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def viewers(self):
+        return self._viewers
+
+    def add_viewer(self):
+        with self._viewers_lock:
+            self._viewers += 1
+
+    def remove_viewer(self):
+        with self._viewers_lock:
+            self._viewers -= 1
+
+    def frames(self, width=None, quality=None, max_fps=None):
+        """
+        Yield JPEG bytes for new frames until the pipeline stops.
+        Viewers asking for the same (snapped) width/quality share encodes;
+        `max_fps` skips frames for slow links.
+        """
+        profile = normalize_profile(width, quality)
+        limiter = FrameRateLimiter(max_fps)
+        self.add_viewer()
+        try:
+            last_seq = 0
+            while self._running:
+                limiter.wait()
+                last_seq, frame = self.broadcaster.wait_for_frame(last_seq)
+                if frame is None:
+                    continue
+                jpeg = self.broadcaster.jpegs.get(last_seq, frame, profile)
+                if jpeg is not None:
+                    yield jpeg
+        finally:
+            self.remove_viewer()
+
+    def stats(self):
+        return {
+            "capture_fps": round(self.capture_meter.rate(), 1),
+            "analysis_fps": round(self.analysis_meter.rate(), 1),
+            "inference_fps": round(self.inference_meter.rate(), 1),
+            "frames_captured": self.capture_meter.total,
+            "frames_analyzed": self.analysis_meter.total,
+            "inference_runs": self.inference_meter.total,
+            "dropped_frames": self.queue.dropped,
+            "active_tracks": len(self.tracker.tracks),
+            "clips_recorded": self.recorder.clips_written if self.recorder is not None else 0,
+            "queue_depth": len(self.queue),
+            "viewers": self._viewers,
+            "stream_profiles": len(self.broadcaster.jpegs.profiles()),
+            "jpeg_encodes": self.broadcaster.jpegs.encodes,
+            "duty_tier": self.duty.tier["name"],
+            "duty_level": self.duty.index,
+        }
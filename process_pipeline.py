@@ -0,0 +1,539 @@
+"""
+Optional multi-process pipeline (PIPELINE_MODE=process).
+
+Per camera, a capture process writes frames into a shared-memory ring and
+a detection process runs motion + YOLO on the newest one. One classifier
+process serves every camera. The API process only tracks, stores and
+streams: frames never cross a process boundary pickled, only detection
+results and the (small) crops sent for classification.
+
+Workers are supervised and restarted with backoff when they die. Run the
+app through uvicorn (as the systemd service does): workers are spawned,
+and spawn re-imports a __main__ script.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import backends
+from camera import VideoCamera, open_camera_source
+from metrics import metrics
+from motion import MotionDetector, load_motion_settings
+from pipeline import CameraPipeline
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "thread").lower()
+# Threads each worker may use for OpenCV / PyTorch / ONNX Runtime
+PIPELINE_CAPTURE_THREADS = int(os.getenv("PIPELINE_CAPTURE_THREADS", "1"))
+PIPELINE_DETECT_THREADS = int(os.getenv("PIPELINE_DETECT_THREADS", "2"))
+PIPELINE_CLASSIFY_THREADS = int(os.getenv("PIPELINE_CLASSIFY_THREADS", "1"))
+PIPELINE_RING_SLOTS = int(os.getenv("PIPELINE_RING_SLOTS", "4"))
+# Larger frames are downscaled to fit the shared slots
+PIPELINE_MAX_FRAME = tuple(int(v) for v in os.getenv("PIPELINE_MAX_FRAME", "1920x1080").lower().split("x"))
+
+# Restart backoff: doubles while a worker keeps dying young
+RESTART_MIN_SECONDS = 1.0
+RESTART_MAX_SECONDS = 30.0
+STABLE_SECONDS = 60.0
+
+_context = multiprocessing.get_context("spawn")
+
+
+class SharedFrameRing:
+    """
+    Fixed slots of BGR frames in one shared-memory block, written by a
+    single process and read by others.
+
+    Every slot carries the sequence number of its frame; the writer marks
+    a slot -1 while copying, and readers re-check the number after copying
+    out, so a frame overwritten mid-read is reported as gone, never torn.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        # Row 0: latest seq, slots, max height, max width; row 1 + i: seq, height, width of slot i
+        slots = int(np.ndarray((1, 4), dtype=np.int64, buffer=shm.buf)[0, 1])
+        self.header = np.ndarray((slots + 1, 4), dtype=np.int64, buffer=shm.buf)
+        self.slots = slots
+        self.max_height, self.max_width = int(self.header[0, 2]), int(self.header[0, 3])
+        offset = self.header.nbytes
+        self.stamps = np.ndarray((slots,), dtype=np.float64, buffer=shm.buf, offset=offset)
+        offset += self.stamps.nbytes
+        self.data = np.ndarray((slots, self.max_height * self.max_width * 3), dtype=np.uint8,
+                               buffer=shm.buf, offset=offset)
+        self.name = shm.name
+
+    @classmethod
+    def create(cls, slots=PIPELINE_RING_SLOTS, max_size=PIPELINE_MAX_FRAME):
+        width, height = max_size
+        size = (slots + 1) * 32 + slots * 8 + slots * height * width * 3
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        header = np.ndarray((slots + 1, 4), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[0] = (0, slots, height, width)
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        try:
+            # 3.13+: the creating process alone owns (and unlinks) the block
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, owner=False)
+
+    def _view(self, slot, height, width):
+        return self.data[slot, :height * width * 3].reshape(height, width, 3)
+
+    def latest(self):
+        return int(self.header[0, 0])
+
+    def write(self, frame, timestamp):
+        """Store a frame as the newest one. Returns its sequence number."""
+        height, width = frame.shape[:2]
+        scale = min(self.max_width / width, self.max_height / height, 1.0)
+        if scale < 1.0:
+            height, width = int(height * scale), int(width * scale)
+        seq = self.latest() + 1
+        slot = seq % self.slots
+        row = self.header[slot + 1]
+        row[0] = -1
+        if scale < 1.0:
+            cv2.resize(frame, (width, height), dst=self._view(slot, height, width), interpolation=cv2.INTER_AREA)
+        else:
+            np.copyto(self._view(slot, height, width), frame)
+        row[1], row[2] = height, width
+        self.stamps[slot] = timestamp
+        row[0] = seq
+        self.header[0, 0] = seq
+        return seq
+
+    def read(self, seq):
+        """A private copy of frame `seq` and its timestamp, or (None, 0.0) if it was overwritten."""
+        slot = seq % self.slots
+        row = self.header[slot + 1]
+        if row[0] != seq:
+            return None, 0.0
+        frame = self._view(slot, int(row[1]), int(row[2])).copy()
+        timestamp = float(self.stamps[slot])
+        if row[0] != seq:
+            return None, 0.0
+        return frame, timestamp
+
+    def close(self):
+        del self.header, self.stamps, self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class WorkerStatus:
+    """Load state a worker reports back: "loading" until "ready" or "failed"."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.state = "loading"
+        self.info = None
+
+    def report(self, state, info=None):
+        with self.condition:
+            self.state, self.info = state, info
+            self.condition.notify_all()
+
+    def wait(self):
+        """Block until the worker is ready (returns its backend) or failed (raises)."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.state != "loading")
+            if self.state == "failed":
+                error, self.state = self.info, "loading"  # the supervisor restarts it
+                raise RuntimeError(error)
+            return self.info
+
+
+def configure_threads(threads, torch=False):
+    if threads <= 0:
+        return
+    cv2.setNumThreads(threads)
+    if torch:
+        # Read when torch is first imported, which happens during the model load
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+        backends.ONNX_THREADS = threads
+
+
+def capture_worker(source, tier, ring_name, commands, stopping, threads):
+    configure_threads(threads)
+    ring = SharedFrameRing.attach(ring_name)
+    camera = open_camera_source(source)
+    next_capture = 0.0
+    while not stopping.is_set():
+        # Waiting for the duty-cycle tier's next frame on the command queue,
+        # so a step up to full rate takes effect at once
+        delay = next_capture - time.monotonic() if tier["max_fps"] else 0.0
+        try:
+            command, value = commands.get(timeout=delay) if delay > 0 else commands.get_nowait()
+            if command == "source":
+                camera.set_source(value)
+            elif command == "tier":
+                tier, next_capture = value, 0.0
+            continue
+        except queue.Empty:
+            pass
+        if tier["max_fps"]:
+            next_capture = time.monotonic() + 1.0 / tier["max_fps"]
+        frame = camera.read()
+        if frame is None:
+            time.sleep(0.1)
+            continue
+        ring.write(frame, time.time())
+    ring.close()
+
+
+class DetachedCamera(VideoCamera):
+    """
+    A VideoCamera without a capture device: analyze() on frames handed to
+    it. `on_change(command, value)` is told about source/debug/motion changes.
+    """
+
+    def __init__(self, source, on_change=None):
+        self.on_change = None
+        super().__init__(source)
+        self.on_change = on_change
+
+    def open_camera(self, source=0):
+        with self.lock:
+            self.current_source = source
+            self.motion = MotionDetector(load_motion_settings(source))
+        if self.on_change is not None:
+            self.on_change("source", source)
+
+    def toggle_debug(self, enabled: bool):
+        super().toggle_debug(enabled)
+        if self.on_change is not None:
+            self.on_change("debug", enabled)
+
+    def update_motion_settings(self, overrides):
+        super().update_motion_settings(overrides)
+        if self.on_change is not None:
+            self.on_change("motion", None)
+
+
+def detect_worker(source, debug, tier, ring_name, hits_name, results, commands, stopping, threads):
+    configure_threads(threads, torch=True)
+    ring = SharedFrameRing.attach(ring_name)
+    hits = SharedFrameRing.attach(hits_name)
+    camera = DetachedCamera(source)
+    camera.debug_mode = debug
+    camera.apply_tier(tier)
+    try:
+        results.put(("ready", camera.detector.load()))
+    except Exception as e:
+        results.put(("failed", str(e)))
+        raise
+
+    last_seq = 0
+    while not stopping.is_set():
+        try:
+            command, value = commands.get_nowait()
+            if command == "source":
+                camera.open_camera(value)
+            elif command == "debug":
+                camera.debug_mode = value
+            elif command == "motion":
+                camera.motion = MotionDetector(load_motion_settings(camera.current_source))
+            elif command == "tier":
+                camera.apply_tier(value)
+        except queue.Empty:
+            pass
+
+        seq = ring.latest()
+        if seq == last_seq:
+            time.sleep(0.005)
+            continue
+        frame, timestamp = ring.read(seq)
+        if frame is None:
+            continue
+        dropped = seq - last_seq - 1 if last_seq else 0
+        last_seq = seq
+
+        inference_count = camera.inference_count
+        motion_detected, detections = camera.analyze(frame)
+        # The frame goes back only when the API process needs it for crops
+        hit_seq = hits.write(frame, timestamp) if motion_detected and detections else 0
+        results.put(("frame", {
+            "hit_seq": hit_seq,
+            "motion_detected": motion_detected,
+            "detections": detections,
+            "ran_inference": camera.inference_count != inference_count,
+            "timings": camera.timings,
+            "counter": camera.motion.counter,
+            "regions": camera.motion.regions,
+            "brightness": camera.motion.brightness,
+            "dropped": dropped,
+        }))
+    ring.close()
+    hits.close()
+
+
+def classify_worker(requests, responses, stopping, threads):
+    configure_threads(threads, torch=True)
+    from classifier import BirdClassifier
+
+    classifier = BirdClassifier()
+    try:
+        responses.put(("ready", None, classifier.load()))
+    except Exception as e:
+        responses.put(("failed", None, str(e)))
+        raise
+    while not stopping.is_set():
+        try:
+            request_id, crops = requests.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        responses.put(("result", request_id, classifier.predict_batch_embedded(crops)))
+
+
+class WorkerSupervisor:
+    """Starts the worker processes and restarts any that die."""
+
+    def __init__(self):
+        self.stopping = _context.Event()
+        self.workers = {}
+        self._thread = None
+
+    def add(self, name, target, args, on_start=None):
+        """`args()` builds the arguments afresh for every (re)start."""
+        self.workers[name] = {"target": target, "args": args, "on_start": on_start, "process": None,
+                              "restarts": 0, "started": 0.0, "next_start": 0.0, "delay": RESTART_MIN_SECONDS}
+
+    def start(self):
+        if self._thread is not None or not self.workers:
+            return
+        self.stopping.clear()
+        for name in self.workers:
+            self._spawn(name)
+        self._thread = threading.Thread(target=self._run, name="worker-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self.stopping.set()
+        self._thread.join(timeout=2.0)
+        self._thread = None
+        for worker in self.workers.values():
+            process = worker["process"]
+            process.join(timeout=3.0)
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout=1.0)
+
+    def _spawn(self, name):
+        worker = self.workers[name]
+        if worker["on_start"] is not None:
+            worker["on_start"]()
+        process = _context.Process(target=worker["target"], args=worker["args"](), name=name, daemon=True)
+        process.start()
+        worker["process"] = process
+        worker["started"] = time.monotonic()
+
+    def _run(self):
+        while not self.stopping.wait(1.0):
+            now = time.monotonic()
+            for name, worker in self.workers.items():
+                process = worker["process"]
+                if process.is_alive():
+                    continue
+                if not worker["next_start"]:
+                    # Quick crash loops back off; a worker that ran a while restarts at once
+                    if now - worker["started"] > STABLE_SECONDS:
+                        worker["delay"] = RESTART_MIN_SECONDS
+                    logger.warning("Worker %s exited (code %s), restarting in %.0fs",
+                                   name, process.exitcode, worker["delay"])
+                    worker["next_start"] = now + worker["delay"]
+                    worker["delay"] = min(worker["delay"] * 2, RESTART_MAX_SECONDS)
+                if now >= worker["next_start"]:
+                    worker["next_start"] = 0.0
+                    worker["restarts"] += 1
+                    metrics.inc("worker_restarts", name)
+                    self._spawn(name)
+
+    def status(self):
+        return {
+            name: {
+                "pid": worker["process"].pid if worker["process"] else None,
+                "alive": bool(worker["process"] and worker["process"].is_alive()),
+                "restarts": worker["restarts"],
+                "exitcode": worker["process"].exitcode if worker["process"] else None,
+            }
+            for name, worker in self.workers.items()
+        }
+
+
+class RemoteClassifier:
+    """
+    BirdClassifier stand-in that forwards predict_batch_embedded() to the
+    classifier process, so ClassifierWorker batches exactly as in-process.
+    """
+
+    def __init__(self, supervisor, threads=PIPELINE_CLASSIFY_THREADS, timeout=30.0):
+        self.requests = _context.Queue()
+        self.responses = _context.Queue()
+        self.timeout = timeout
+        self.status = WorkerStatus()
+        # Set once the worker has reported in, as BirdClassifier.loaded
+        self.loaded = threading.Event()
+        self._ids = itertools.count(1)
+        self._waiting = {}
+        self._lock = threading.Lock()
+        supervisor.add("classifier", classify_worker,
+                       lambda: (self.requests, self.responses, supervisor.stopping, threads),
+                       on_start=self._fail_waiting)
+        threading.Thread(target=self._dispatch, name="classifier-responses", daemon=True).start()
+
+    def load(self):
+        return self.status.wait()
+
+    def _fail_waiting(self):
+        # Requests sent to a worker that died are never answered
+        with self._lock:
+            waiting, self._waiting = self._waiting, {}
+        for future in waiting.values():
+            future.set_exception(RuntimeError("Classifier worker restarted"))
+
+    def _dispatch(self):
+        while True:
+            kind, request_id, payload = self.responses.get()
+            if kind == "result":
+                with self._lock:
+                    future = self._waiting.pop(request_id, None)
+                if future is not None:
+                    future.set_result(payload)
+            else:
+                self.status.report(kind, payload)
+                self.loaded.set()
+
+    def predict_batch(self, crops):
+        return [(label, score) for label, score, _ in self.predict_batch_embedded(crops)]
+
+    def predict_batch_embedded(self, crops):
+        if not crops:
+            return []
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            self._waiting[request_id] = future
+        self.requests.put((request_id, crops))
+        try:
+            return future.result(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self._waiting.pop(request_id, None)
+
+
+class ProcessCameraPipeline(CameraPipeline):
+    """
+    CameraPipeline whose capture and analysis run in worker processes.
+    The API-side threads only copy frames out for viewers and clips, and
+    turn detection results into tracks.
+    """
+
+    def __init__(self, source, supervisor, camera_id="0", capture_threads=PIPELINE_CAPTURE_THREADS,
+                 detect_threads=PIPELINE_DETECT_THREADS, **kwargs):
+        self.frames_ring = SharedFrameRing.create()
+        self.hits_ring = SharedFrameRing.create()
+        self.capture_commands = _context.Queue()
+        self.detect_commands = _context.Queue()
+        self.results = _context.Queue()
+        self.detector_status = WorkerStatus()
+        self._last_seq = 0
+        super().__init__(DetachedCamera(source, on_change=self._command), camera_id=camera_id, **kwargs)
+
+        # Restarted workers pick up the current source, debug mode and duty-cycle tier
+        supervisor.add(f"capture{camera_id}", capture_worker, lambda: (
+            self.camera.current_source, self.duty.tier, self.frames_ring.name, self.capture_commands,
+            supervisor.stopping, capture_threads))
+        supervisor.add(f"detect{camera_id}", detect_worker, lambda: (
+            self.camera.current_source, self.camera.debug_mode, self.duty.tier,
+            self.frames_ring.name, self.hits_ring.name,
+            self.results, self.detect_commands, supervisor.stopping, detect_threads))
+
+    def _command(self, command, value):
+        if command == "source":
+            self.capture_commands.put((command, value))
+        self.detect_commands.put((command, value))
+
+    def _apply_tier(self, tier):
+        self.capture_commands.put(("tier", tier))
+        self.detect_commands.put(("tier", tier))
+
+    def stop(self):
+        super().stop()
+        self.frames_ring.close()
+        self.hits_ring.close()
+
+    def stats(self):
+        stats = super().stats()
+        try:
+            stats["queue_depth"] = self.results.qsize()
+        except NotImplementedError:  # macOS
+            pass
+        return stats
+
+    def _capture_once(self):
+        seq = self.frames_ring.latest()
+        if seq == self._last_seq:
+            time.sleep(0.005)
+            return
+        for _ in range(min(seq - self._last_seq, 10)):
+            self.capture_meter.tick()
+        self._last_seq = seq
+        # Frames are only copied out of shared memory when someone needs them
+        if not self._viewers and self.recorder is None:
+            return
+        frame, timestamp = self.frames_ring.read(seq)
+        if frame is None:
+            return
+        if self.recorder is not None:
+            self.ring.push(frame, timestamp)
+        self._publish(frame)
+
+    def _analyze_once(self):
+        try:
+            kind, result = self.results.get(timeout=0.5)
+        except queue.Empty:
+            return
+        if kind != "frame":
+            self.detector_status.report(kind, result)
+            return
+
+        self.queue.dropped += result["dropped"]
+        if result["ran_inference"]:
+            self.camera.inference_count += 1
+        self.camera.motion.counter = result["counter"]
+        self.camera.motion.regions = result["regions"]
+        self.camera.motion.brightness = result["brightness"]
+        frame, detections = None, result["detections"]
+        if result["hit_seq"]:
+            frame, _ = self.hits_ring.read(result["hit_seq"])
+            if frame is None:
+                # Fell behind by a whole ring; these boxes can't be cropped any more
+                detections = []
+        self._handle_analysis(frame, result["motion_detected"], detections,
+                              result["ran_inference"], result["timings"])
+
+
+def wait_for_detectors(pipelines):
+    """ModelRegistry loader: every camera's detection worker has its model."""
+    return ",".join(sorted({str(p.detector_status.wait()) for p in pipelines}))
@@ -0,0 +1,250 @@
+"""
+Replay recorded footage through the detection pipeline without a camera.
+
+Sources yield (frame, timestamp) with timestamps taken from the recording,
+so motion trigger counts and tracker timeouts behave as they would live,
+however fast the frames are processed.
+"""
+import glob
+import os
+import resource
+import time
+
+import cv2
+import numpy as np
+
+from camera import VideoCamera
+from metrics import Metrics
+from motion import MotionDetector, load_motion_settings
+from tracker import IouTracker
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.bmp")
+
+
+class VideoFileSource:
+    """Frames of a video file, stamped with their position in the file."""
+
+    def __init__(self, path, max_frames=None):
+        self.path = path
+        self.max_frames = max_frames
+        self.name = os.path.basename(path)
+
+    def __iter__(self):
+        video = cv2.VideoCapture(self.path)
+        if not video.isOpened():
+            raise FileNotFoundError(f"Cannot open video {self.path}")
+        fps = video.get(cv2.CAP_PROP_FPS) or 25.0
+        try:
+            index = 0
+            while self.max_frames is None or index < self.max_frames:
+                success, frame = video.read()
+                if not success:
+                    break
+                yield frame, index / fps
+                index += 1
+        finally:
+            video.release()
+
+
+class ImageDirSource:
+    """Images of a directory in name order, spaced 1/fps apart."""
+
+    def __init__(self, path, fps=10.0, max_frames=None):
+        self.path = path
+        self.fps = fps
+        self.max_frames = max_frames
+        self.name = os.path.basename(os.path.normpath(path))
+        self.files = sorted(f for pattern in IMAGE_PATTERNS for f in glob.glob(os.path.join(path, pattern)))
+        if not self.files:
+            raise FileNotFoundError(f"No images in {path}")
+
+    def __iter__(self):
+        for index, path in enumerate(self.files[:self.max_frames]):
+            frame = cv2.imread(path)
+            if frame is not None:
+                yield frame, index / self.fps
+
+
+class SyntheticSource:
+    """
+    Deterministic generated footage: a textured static scene with a
+    bird-sized blob crossing it. Needs no files, so it runs anywhere; it
+    exercises capture/motion/detector timing but YOLO won't call it a bird.
+    """
+
+    def __init__(self, frames=300, size=(1280, 720), fps=15.0, seed=0):
+        self.frames = frames
+        self.size = size
+        self.fps = fps
+        self.seed = seed
+        self.name = f"synthetic-{size[0]}x{size[1]}"
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed)
+        width, height = self.size
+        background = rng.integers(60, 180, size=(height // 8, width // 8, 3), dtype=np.uint8)
+        background = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+        radius = max(8, height // 24)
+        for index in range(self.frames):
+            frame = background.copy()
+            # Sensor noise so the background model has something to ignore
+            noise = rng.integers(-4, 5, size=frame.shape, dtype=np.int16)
+            frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+            # The visitor shows up for the middle half of the clip
+            if self.frames // 4 <= index < 3 * self.frames // 4:
+                progress = (index - self.frames // 4) / (self.frames / 2)
+                center = (int(width * (0.2 + 0.6 * progress)), int(height * 0.6))
+                cv2.ellipse(frame, center, (radius * 2, radius), 0, 0, 360, (40, 70, 120), -1)
+                cv2.circle(frame, (center[0] + radius * 2, center[1] - radius // 2), radius // 2, (30, 50, 90), -1)
+            yield frame, index / self.fps
+
+
+def open_source(spec, max_frames=None):
+    """'synthetic[:frames]', a video file or an image directory."""
+    if spec.startswith("synthetic"):
+        frames = int(spec.split(":", 1)[1]) if ":" in spec else (max_frames or 300)
+        return SyntheticSource(frames=frames)
+    if os.path.isdir(spec):
+        return ImageDirSource(spec, max_frames=max_frames)
+    return VideoFileSource(spec, max_frames=max_frames)
+
+
+class ReplayCamera(VideoCamera):
+    """
+    VideoCamera fed from a replay source instead of a device.
+    With `realtime` frames are paced to the recording's clock (for running
+    the app against footage); otherwise read() returns them as fast as asked.
+    """
+
+    def __init__(self, source, camera_id="replay", realtime=False, loop=False):
+        self.camera_id = camera_id
+        self.realtime = realtime
+        self.loop = loop
+        self.timestamp = 0.0
+        self.finished = False
+        super().__init__(source)
+
+    @property
+    def source_name(self):
+        # current_source is the replay source object; camera_id is its spec
+        return self.camera_id
+
+    def open_camera(self, source=0):
+        with self.lock:
+            self.current_source = source
+            self.frames = iter(source)
+            self.started = time.monotonic()
+            self.motion = MotionDetector(load_motion_settings(self.camera_id))
+
+    def read(self):
+        with self.lock:
+            try:
+                frame, self.timestamp = next(self.frames)
+            except StopIteration:
+                if not self.loop:
+                    self.finished = True
+                    return None
+                self.frames = iter(self.current_source)
+                self.started = time.monotonic()
+                frame, self.timestamp = next(self.frames)
+        if self.realtime:
+            delay = self.started + self.timestamp - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return frame
+
+
+class ReplayResult(dict):
+    """Benchmark numbers of one replay (a dict, so it serializes as-is)."""
+
+    def summary(self):
+        lines = [
+            f"{self['source']}: {self['frames']} frames in {self['elapsed_s']:.2f}s "
+            f"({self['fps']:.1f} fps, {self['realtime_factor']:.1f}x real time)",
+            f"  motion triggers {self['motion_triggers']}, YOLO passes {self['inference_runs']}, "
+            f"detections {self['detections']}, visits {self['visits']}",
+            f"  peak RSS {self['peak_rss_mb']:.0f} MB",
+        ]
+        for stage, summary in self["stages"].items():
+            lines.append(f"  {stage:<12} n={summary['count']:<6} p50 {summary['p50_ms']} ms  "
+                         f"p95 {summary['p95_ms']} ms  p99 {summary['p99_ms']} ms")
+        if self["species"]:
+            lines.append("  species: " + ", ".join(f"{name} x{count}" for name, count in self["species"].items()))
+        return "\n".join(lines)
+
+
+def run_replay(source, classifier=None, motion_settings=None, track_timeout=30.0):
+    """
+    Push every frame of `source` through motion -> YOLO -> tracker ->
+    classifier, synchronously and as fast as possible. Returns a ReplayResult.
+    """
+    camera = ReplayCamera(source)
+    # No background loading here: the first frames must already be detected
+    camera.detector.load()
+    if motion_settings:
+        # Not update_motion_settings(): a replay must not rewrite motion.json
+        camera.motion = MotionDetector({**camera.motion.settings, **motion_settings})
+    tracker = IouTracker("replay", max_age=track_timeout)
+    stage_metrics = Metrics()
+    species = {}
+    frames = detections = triggers = visits = 0
+    was_triggered = False
+
+    def classify(tracks):
+        nonlocal visits
+        crops = [track.best_crop for track in tracks]
+        if classifier is None or not crops:
+            return
+        with stage_metrics.time("classify"):
+            results = classifier.predict_batch(crops)
+        for track, (label, score) in zip(tracks, results):
+            if label and score > 0.1:
+                if track.label is None:
+                    visits += 1
+                elif track.label in species:
+                    species[track.label] -= 1
+                track.label = label.replace('_', ' ').lower().title()
+                species[track.label] = species.get(track.label, 0) + 1
+
+    start = time.perf_counter()
+    while True:
+        read_start = time.perf_counter()
+        frame = camera.read()
+        if frame is None:
+            break
+        stage_metrics.observe("capture", time.perf_counter() - read_start)
+        frames += 1
+
+        motion_detected, found = camera.analyze(frame)
+        for stage, seconds in camera.timings.items():
+            stage_metrics.observe(stage, seconds)
+        triggered = camera.motion.counter >= int(camera.motion.settings["trigger_frames"])
+        if triggered and not was_triggered:
+            triggers += 1
+        was_triggered = triggered
+
+        confirmed = found if motion_detected else []
+        detections += len(confirmed)
+        to_classify, _ = tracker.update(confirmed, frame, camera.timestamp)
+        classify(to_classify)
+        for track in to_classify:
+            track.pending = False
+    elapsed = time.perf_counter() - start
+
+    snapshot = stage_metrics.snapshot()
+    duration = camera.timestamp or 0.0
+    return ReplayResult(
+        source=getattr(source, "name", str(source)),
+        frames=frames,
+        elapsed_s=round(elapsed, 3),
+        fps=round(frames / elapsed, 2) if elapsed else 0.0,
+        realtime_factor=round(duration / elapsed, 2) if elapsed else 0.0,
+        motion_triggers=triggers,
+        inference_runs=camera.inference_count,
+        detections=detections,
+        visits=visits,
+        species=dict(sorted((name, count) for name, count in species.items() if count)),
+        # ru_maxrss is in KiB on Linux
+        peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        stages={stage: cameras[""] for stage, cameras in snapshot["stages"].items()},
+    )
@@ -0,0 +1,278 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# 0 disables a rule; every rule that deletes visits is off unless configured
+RETENTION_MAX_DISK_MB = float(os.getenv("RETENTION_MAX_DISK_MB", "0"))
+RETENTION_MIN_FREE_MB = float(os.getenv("RETENTION_MIN_FREE_MB", "0"))
+RETENTION_MAX_AGE_DAYS = float(os.getenv("RETENTION_MAX_AGE_DAYS", "0"))
+RETENTION_KEEP_PER_SPECIES_DAY = int(os.getenv("RETENTION_KEEP_PER_SPECIES_DAY", "0"))
+RETENTION_INTERVAL_MINUTES = float(os.getenv("RETENTION_INTERVAL_MINUTES", "60"))
+# Convert a database created before incremental auto-vacuum (one full VACUUM)
+RETENTION_CONVERT_DB = os.getenv("RETENTION_CONVERT_DB", "false").lower() == "true"
+
+# Files are written shortly before their row; don't mistake them for orphans
+ORPHAN_GRACE_SECONDS = 600
+DELETE_BATCH = 100
+FREE_SPACE_CHECK_SECONDS = 60
+
+MB = 1024 * 1024
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class RetentionManager:
+    """
+    Background housekeeping for captures and the database.
+
+    Each run applies the configured rules in order - max age, best N per
+    species per day, disk quota (total size and free space) - then removes
+    orphaned files and returns freed database pages with an incremental
+    VACUUM. Runs on a timer or on request; status() reports progress.
+    """
+
+    def __init__(self, root, db_path=database.DB_NAME, on_deleted=None, max_disk_mb=RETENTION_MAX_DISK_MB,
+                 min_free_mb=RETENTION_MIN_FREE_MB, max_age_days=RETENTION_MAX_AGE_DAYS,
+                 keep_per_species_day=RETENTION_KEEP_PER_SPECIES_DAY, interval_minutes=RETENTION_INTERVAL_MINUTES,
+                 convert_db=RETENTION_CONVERT_DB):
+        self.root = root
+        self.db_path = db_path
+        # Called as on_deleted(ids) after rows are removed
+        self.on_deleted = on_deleted
+        self.max_disk_mb = max_disk_mb
+        self.min_free_mb = min_free_mb
+        self.max_age_days = max_age_days
+        self.keep_per_species_day = keep_per_species_day
+        self.interval = interval_minutes * 60
+        self.convert_db = convert_db
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.state = "idle"
+        self.phase = None
+        self.progress = None
+        self.current = None
+        self.last_run = None
+        self.next_run = None
+        self.usage = None
+        self._thread = None
+        self._running = False
+
+    # --- Control ---
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self.wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def run_now(self):
+        """Ask for a run as soon as the current one (if any) is done."""
+        self.wakeup.set()
+
+    def settings(self):
+        return {
+            "max_disk_mb": self.max_disk_mb,
+            "min_free_mb": self.min_free_mb,
+            "max_age_days": self.max_age_days,
+            "keep_per_species_day": self.keep_per_species_day,
+            "interval_minutes": self.interval / 60,
+            "convert_db": self.convert_db,
+        }
+
+    def status(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "phase": self.phase,
+                "progress": self.progress,
+                "current": dict(self.current) if self.current else None,
+                "last_run": self.last_run,
+                "next_run": self.next_run,
+                "settings": self.settings(),
+                "usage_mb": round(self.usage / MB, 1) if self.usage is not None else None,
+            }
+
+    def _due(self):
+        """Sleep until the next run is due, a run is requested or free space runs low."""
+        deadline = time.monotonic() + self.interval
+        with self.lock:
+            self.next_run = datetime.now() + timedelta(seconds=self.interval)
+        while self._running:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.wakeup.wait(timeout=min(remaining, FREE_SPACE_CHECK_SECONDS)):
+                break
+            if self.min_free_mb and self.free_space() < self.min_free_mb * MB:
+                break
+        self.wakeup.clear()
+
+    def _run(self):
+        while self._running:
+            self._due()
+            if not self._running:
+                break
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception("Retention run failed")
+                with self.lock:
+                    self.state = "idle"
+                    self.last_run = {**(self.current or {}), "error": str(e)}
+
+    # --- Accounting ---
+
+    def disk_usage(self):
+        """Bytes used by captures plus the database (with its WAL)."""
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                total += _file_size(os.path.join(dirpath, name))
+        for suffix in ("", "-wal", "-shm"):
+            total += _file_size(self.db_path + suffix)
+        self.usage = total
+        return total
+
+    def free_space(self):
+        return shutil.disk_usage(self.root).free
+
+    def _set_phase(self, phase, total=None):
+        with self.lock:
+            self.phase = phase
+            self.progress = {"done": 0, "total": total}
+
+    def _advance(self, count):
+        with self.lock:
+            self.progress["done"] += count
+
+    def _count(self, key, value):
+        with self.lock:
+            self.current[key] += value
+
+    # --- Work ---
+
+    def _delete_rows(self, ids):
+        """Delete rows (in batches) and the files only they used."""
+        ids = list(ids)
+        for start in range(0, len(ids), DELETE_BATCH):
+            batch = ids[start:start + DELETE_BATCH]
+            paths = database.delete_detections(batch).result()
+            freed = 0
+            for path in paths:
+                size = _file_size(path)
+                try:
+                    os.unlink(path)
+                    freed += size
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning("Failed to delete %s: %s", path, e)
+            self._count("deleted_rows", len(batch))
+            self._count("deleted_files", len(paths))
+            self._count("freed_bytes", freed)
+            self._advance(len(batch))
+            if self.on_deleted is not None:
+                self.on_deleted(batch)
+
+    def _over_quota(self, usage):
+        if self.max_disk_mb and usage > self.max_disk_mb * MB:
+            return True
+        return bool(self.min_free_mb) and self.free_space() < self.min_free_mb * MB
+
+    def _enforce_quota(self):
+        usage = self.disk_usage()
+        self._set_phase("quota")
+        while self._running and self._over_quota(usage):
+            rows = database.get_oldest_file_rows(DELETE_BATCH)
+            if not rows:
+                break
+            before = usage
+            self._delete_rows(row_id for row_id, _ in rows)
+            usage = self.disk_usage()
+            if usage >= before:
+                # Nothing left that deleting rows would free
+                break
+
+    def _remove_orphans(self):
+        referenced = {os.path.normpath(path) for path in database.get_file_paths()}
+        cutoff = time.time() - ORPHAN_GRACE_SECONDS
+        candidates = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if os.path.normpath(path) not in referenced:
+                    candidates.append(path)
+        self._set_phase("orphans", len(candidates))
+        for path in candidates:
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime < cutoff:
+                    os.unlink(path)
+                    self._count("orphans", 1)
+                    self._count("freed_bytes", stat.st_size)
+            except OSError:
+                pass
+            self._advance(1)
+        # Drop shard directories left empty
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            if dirpath != self.root and not dirnames and not filenames:
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+    def run_once(self):
+        with self.lock:
+            self.state = "running"
+            self.current = {
+                "started": datetime.now(), "finished": None, "deleted_rows": 0, "deleted_files": 0,
+                "orphans": 0, "freed_bytes": 0, "vacuumed_pages": 0,
+            }
+
+        if self.max_age_days:
+            ids = database.get_ids_older_than(datetime.now() - timedelta(days=self.max_age_days))
+            self._set_phase("age", len(ids))
+            self._delete_rows(ids)
+
+        if self.keep_per_species_day:
+            # Only whole days: today's visits are still coming in
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            ids = database.get_ids_beyond_best(self.keep_per_species_day, today)
+            self._set_phase("best_per_day", len(ids))
+            self._delete_rows(ids)
+
+        self._enforce_quota()
+        self._remove_orphans()
+
+        self._set_phase("vacuum")
+        self._count("vacuumed_pages", database.compact(convert=self.convert_db))
+        self.disk_usage()
+
+        with self.lock:
+            self.current["finished"] = datetime.now()
+            self.last_run, self.current = self.current, None
+            self.state = "idle"
+            self.phase = None
+            self.progress = None
+            result = dict(self.last_run)
+        logger.info("Retention run finished: %s", result)
+        return result
@@ -0,0 +1,201 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_INDEX = os.getenv("SIMILARITY_INDEX", "similarity.npz")
+# A new track whose crop is within this many pHash bits of one classified on
+# the same camera in the last DEDUPE_WINDOW_SECONDS reuses that label and image
+DEDUPE_MAX_DISTANCE = int(os.getenv("DEDUPE_MAX_DISTANCE", "6"))
+DEDUPE_WINDOW_SECONDS = float(os.getenv("DEDUPE_WINDOW_SECONDS", "600"))
+# The index is rewritten after this many changes (and on shutdown)
+SAVE_EVERY = 25
+
+RecentCrop = collections.namedtuple("RecentCrop", "camera_id image_hash label score capture track_id seen")
+
+
+def phash(image):
+    """64-bit DCT perceptual hash of a BGR image, as an int."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # Median of the low frequencies, leaving out the DC term (overall brightness)
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def hamming(hashes, image_hash):
+    """Bit distance from `image_hash` to every entry of a uint64 array."""
+    xor = np.bitwise_xor(hashes, np.uint64(image_hash))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class SimilarityIndex:
+    """
+    Fingerprints of stored visits - pHash plus the classifier's embedding -
+    in compact numpy arrays, persisted as one .npz file.
+
+    Search is brute force: a matrix-vector product over float16 rows,
+    a few milliseconds for the tens of thousands of visits a feeder
+    collects. Rows without an embedding (older ONNX exports, or images
+    indexed while the classifier was down) are compared by pHash.
+
+    Separately, it remembers recently classified crops per camera so
+    near-duplicates can skip the classifier altogether.
+    """
+
+    def __init__(self, path=SIMILARITY_INDEX):
+        self.path = path
+        self.lock = threading.Lock()
+        self.size = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.embeddings = None
+        self.has_embedding = np.empty(0, dtype=bool)
+        self.changes = 0
+        self.recent = collections.deque(maxlen=256)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                self.ids = data["ids"]
+                self.hashes = data["hashes"]
+                self.has_embedding = data["has_embedding"]
+                self.embeddings = data["embeddings"] if "embeddings" in data else None
+            self.size = len(self.ids)
+            logger.info("Similarity index: %d entries", self.size)
+        except Exception as e:
+            logger.warning("Ignoring unreadable similarity index %s: %s", self.path, e)
+
+    def save(self):
+        with self.lock:
+            if not self.changes:
+                return
+            arrays = {
+                "ids": self.ids[:self.size],
+                "hashes": self.hashes[:self.size],
+                "has_embedding": self.has_embedding[:self.size],
+            }
+            if self.embeddings is not None:
+                arrays["embeddings"] = self.embeddings[:self.size]
+            # Same directory, so the rename is atomic
+            tmp = f"{self.path}.tmp.npz"
+            np.savez(tmp, **arrays)
+            os.replace(tmp, self.path)
+            self.changes = 0
+
+    def _changed(self):
+        self.changes += 1
+        return self.changes >= SAVE_EVERY
+
+    def _grow(self):
+        capacity = max(64, len(self.ids) * 2)
+        self.ids = np.resize(self.ids, capacity)
+        self.hashes = np.resize(self.hashes, capacity)
+        self.has_embedding = np.resize(self.has_embedding, capacity)
+        if self.embeddings is not None:
+            embeddings = np.zeros((capacity, self.embeddings.shape[1]), dtype=np.float16)
+            embeddings[:self.size] = self.embeddings[:self.size]
+            self.embeddings = embeddings
+
+    def add(self, detection_id, image_hash, embedding=None):
+        """Index (or re-index, after a better crop) a stored visit."""
+        with self.lock:
+            if embedding is not None and self.embeddings is not None \
+                    and self.embeddings.shape[1] != len(embedding):
+                # A different classifier: old embeddings are no longer comparable
+                self.embeddings = None
+                self.has_embedding[:self.size] = False
+            rows = np.flatnonzero(self.ids[:self.size] == detection_id)
+            if len(rows):
+                row = rows[0]
+            else:
+                if self.size == len(self.ids):
+                    self._grow()
+                row = self.size
+                self.size += 1
+            if embedding is not None and self.embeddings is None:
+                self.embeddings = np.zeros((len(self.ids), len(embedding)), dtype=np.float16)
+            self.ids[row] = detection_id
+            self.hashes[row] = np.uint64(image_hash)
+            self.has_embedding[row] = embedding is not None
+            if embedding is not None:
+                self.embeddings[row] = embedding
+            save = self._changed()
+        if save:
+            self.save()
+
+    def remove(self, ids):
+        with self.lock:
+            keep = ~np.isin(self.ids[:self.size], list(ids))
+            kept = int(keep.sum())
+            if kept == self.size:
+                return
+            self.ids[:kept] = self.ids[:self.size][keep]
+            self.hashes[:kept] = self.hashes[:self.size][keep]
+            self.has_embedding[:kept] = self.has_embedding[:self.size][keep]
+            if self.embeddings is not None:
+                self.embeddings[:kept] = self.embeddings[:self.size][keep]
+            self.size = kept
+            save = self._changed()
+        if save:
+            self.save()
+
+    def clear(self):
+        with self.lock:
+            self.size = 0
+            self.recent.clear()
+            self.changes += 1
+        self.save()
+
+    def __contains__(self, detection_id):
+        with self.lock:
+            return bool(np.any(self.ids[:self.size] == detection_id))
+
+    def similar(self, detection_id, limit=12):
+        """[(id, similarity 0..1)] most like `detection_id`, best first."""
+        with self.lock:
+            rows = np.flatnonzero(self.ids[:self.size] == detection_id)
+            if not len(rows):
+                return []
+            row = rows[0]
+            scores = 1.0 - hamming(self.hashes[:self.size], int(self.hashes[row])) / 64.0
+            if self.has_embedding[row]:
+                with_embedding = self.has_embedding[:self.size]
+                cosine = self.embeddings[:self.size][with_embedding].astype(np.float32) \
+                    @ self.embeddings[row].astype(np.float32)
+                scores[with_embedding] = np.clip(cosine, 0.0, 1.0)
+            scores[row] = -1.0
+            count = min(limit, self.size - 1)
+            if count <= 0:
+                return []
+            best = np.argpartition(-scores, count - 1)[:count]
+            best = best[np.argsort(-scores[best])]
+            return [(int(self.ids[i]), float(scores[i])) for i in best]
+
+    def remember(self, camera_id, image_hash, label, score, capture, track_id):
+        """Note a classified crop for near-duplicate checks."""
+        with self.lock:
+            self.recent.append(RecentCrop(camera_id, image_hash, label, score, capture, track_id, time.time()))
+
+    def recent_match(self, camera_id, image_hash):
+        """The newest recent crop of this camera that `image_hash` nearly duplicates, or None."""
+        cutoff = time.time() - DEDUPE_WINDOW_SECONDS
+        with self.lock:
+            for crop in reversed(self.recent):
+                if crop.seen < cutoff:
+                    break
+                if crop.camera_id == camera_id \
+                        and bin(crop.image_hash ^ image_hash).count("1") <= DEDUPE_MAX_DISTANCE \
+                        and os.path.exists(crop.capture.image_path):  # retention may have pruned it
+                    return crop
+        return None
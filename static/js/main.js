@@ -44,7 +44,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const timeStr = date.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
 
             card.innerHTML = `
-                <img src="${detection.image_path}" alt="${detection.species}" class="bird-thumb">
+                <img src="${detection.thumb_path || detection.image_path}" alt="${detection.species}" class="bird-thumb" loading="lazy">
                 <div class="bird-info">
                     <div class="bird-species">${detection.species}</div>
                     <div class="bird-meta">
@@ -129,30 +129,29 @@ document.addEventListener('DOMContentLoaded', () => {
 
     loadCameras();
 
-    // Poll every 3 seconds
-    fetchDetections();
-    setInterval(fetchDetections, 3000);
-    // Poll for processing status
+    // Live updates: the server pushes detection changes and status over SSE.
+    // (Re)connecting resyncs the list.
     const statusText = document.getElementById('status-text');
 
-    setInterval(() => {
-        fetch('/api/status')
-            .then(res => res.json())
-            .then(data => {
-                if (data.processing) {
-                    statusText.textContent = "AI Analysis in progress...";
-                    statusText.style.color = "var(--accent)";
-                    statusText.style.fontWeight = "bold";
-                } else if (data.cooldown > 0) {
-                    statusText.textContent = `Cooldown: ${Math.ceil(data.cooldown)}s`;
-                    statusText.style.color = "var(--text-secondary)";
-                    statusText.style.fontWeight = "normal";
-                } else {
-                    statusText.textContent = "Monitoring for movement...";
-                    statusText.style.color = "var(--text-primary)";
-                    statusText.style.fontWeight = "normal";
-                }
-            })
-            .catch(err => console.log("Status poll error", err));
-    }, 1000);
+    function renderStatus(data) {
+        if (data.processing) {
+            statusText.textContent = "AI Analysis in progress...";
+            statusText.style.color = "var(--accent)";
+            statusText.style.fontWeight = "bold";
+        } else if (data.tracking > 0) {
+            statusText.textContent = `Tracking ${data.tracking} bird${data.tracking === 1 ? '' : 's'}`;
+            statusText.style.color = "var(--text-secondary)";
+            statusText.style.fontWeight = "normal";
+        } else {
+            statusText.textContent = "Monitoring for movement...";
+            statusText.style.color = "var(--text-primary)";
+            statusText.style.fontWeight = "normal";
+        }
+    }
+
+    fetchDetections();
+    const events = new EventSource('/api/events');
+    events.addEventListener('open', fetchDetections);
+    events.addEventListener('detection', fetchDetections);
+    events.addEventListener('status', (e) => renderStatus(JSON.parse(e.data)));
 });
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import cv2
+
+from framepool import frame_pool
+from metrics import metrics
+
+# Requested sizes/qualities are snapped to a few steps so viewers asking
+# for similar streams share one encode.
+WIDTH_STEPS = (320, 480, 640, 960, 1280, 1920)
+DEFAULT_QUALITY = 80
+MIN_QUALITY, MAX_QUALITY = 30, 95
+
+
+def normalize_profile(width=None, quality=None):
+    """
+    Snap a requested (width, quality) to a shared profile.
+    width None/0 means the source resolution.
+    """
+    if width:
+        width = min(WIDTH_STEPS, key=lambda step: abs(step - int(width)))
+    else:
+        width = 0
+    if quality is None:
+        quality = DEFAULT_QUALITY
+    quality = max(MIN_QUALITY, min(MAX_QUALITY, int(round(int(quality) / 5.0)) * 5))
+    return width, quality
+
+
+def encode_jpeg(frame, width, quality):
+    if width and width < frame.shape[1]:
+        height = int(round(frame.shape[0] * width / frame.shape[1]))
+        frame = cv2.resize(frame, (width, height), dst=frame_pool.acquire((height, width, 3)),
+                           interpolation=cv2.INTER_AREA)
+    ret, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return jpeg.tobytes() if ret else None
+
+
+class JpegCache:
+    """
+    Encodes each published frame at most once per profile. The first
+    viewer that needs (frame seq, profile) encodes it; everyone else on
+    that profile gets the same bytes.
+    """
+
+    def __init__(self, label=""):
+        self.label = label
+        self.lock = threading.Lock()
+        self.profile_locks = {}
+        self.entries = {}  # profile -> (seq, jpeg bytes)
+        self.encodes = 0
+
+    def get(self, seq, frame, profile):
+        with self.lock:
+            profile_lock = self.profile_locks.setdefault(profile, threading.Lock())
+        with profile_lock:
+            cached = self.entries.get(profile)
+            if cached is not None and cached[0] == seq:
+                return cached[1]
+            with metrics.time("stream_encode", self.label):
+                jpeg = encode_jpeg(frame, *profile)
+            self.entries[profile] = (seq, jpeg)
+            self.encodes += 1
+            return jpeg
+
+    def profiles(self):
+        with self.lock:
+            return list(self.entries)
+
+
+class FrameRateLimiter:
+    """Lets a viewer skip frames to stay under `max_fps`."""
+
+    def __init__(self, max_fps=None):
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if now < self.next_time:
+            time.sleep(self.next_time - now)
+        self.next_time = max(now, self.next_time) + self.interval
@@ -0,0 +1,19 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# The app is a flat set of modules at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh database file with its own writer thread and connections."""
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "birdybird.db"))
+    monkeypatch.setattr(database, "_local", threading.local())
+    monkeypatch.setattr(database, "writer", database.DatabaseWriter())
+    return database
@@ -0,0 +1,12 @@
+import time
+
+from camera import VideoCamera
+
+
+def test_first_open_does_not_wait_for_frames(tmp_path):
+    start = time.monotonic()
+    camera = VideoCamera(str(tmp_path / "missing.mp4"))
+    # No warm-up for the first device: the capture loop backs off on None
+    assert time.monotonic() - start < 1.0
+    assert camera.source_name == str(tmp_path / "missing.mp4")
+    assert camera.read() is None
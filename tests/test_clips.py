@@ -0,0 +1,116 @@
+import glob
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from captures import CLIP_FOLDER, CaptureStore
+from clips import ClipRecorder, FrameRing
+from tracker import Track, when_all_settled
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class FedRecorder:
+    """A ClipRecorder whose ring is fed with frames by a background thread."""
+
+    def __init__(self, clip_dir, on_clip):
+        self.ring = FrameRing(seconds=2, fps=20, width=64)
+        self.recorder = ClipRecorder(self.ring, clip_dir, "camera0", on_clip=on_clip,
+                                     pre_seconds=0.2, post_seconds=0.6, fps=20)
+        self.running = True
+        self.feeder = threading.Thread(target=self._feed, daemon=True)
+
+    def _feed(self):
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        while self.running:
+            frame[:] = int(time.time() * 100) % 255
+            self.ring.push(frame, time.time())
+            time.sleep(0.01)
+
+    def __enter__(self):
+        self.feeder.start()
+        self.recorder.start()
+        return self.recorder
+
+    def __exit__(self, *exc_info):
+        self.running = False
+        self.recorder.stop()
+        self.feeder.join()
+
+
+def test_clear_while_recording_keeps_the_clip(tmp_path):
+    store = CaptureStore(str(tmp_path))
+    clip_dir = os.path.join(str(tmp_path), CLIP_FOLDER)
+    clips = []
+    track = Track("camera0", (0, 0, 10, 10), 0.9, time.time())
+    try:
+        with FedRecorder(clip_dir, lambda *args: clips.append(args)) as recorder:
+            # An older clip, which clear() must remove
+            os.makedirs(clip_dir)
+            old_clip = os.path.join(clip_dir, "clip_camera0_0_0.mp4")
+            open(old_clip, "wb").close()
+
+            recorder.trigger([track], 0.9, time.time())
+            assert _wait_for(lambda: glob.glob(os.path.join(clip_dir, ".*.tmp.mp4")))
+            store.clear()
+            assert not os.path.exists(old_clip)
+
+            assert _wait_for(lambda: recorder.clips_written == 1)
+        assert len(clips) == 1
+        tracks, clip_path, _ = clips[0]
+        assert tracks == [track]
+        assert os.path.isfile(clip_path)
+    finally:
+        store.stop()
+
+
+def test_clip_waits_for_classification_that_finishes_later(tmp_path):
+    clip_dir = os.path.join(str(tmp_path), CLIP_FOLDER)
+    linked = []
+    visit = Track("camera0", (0, 0, 10, 10), 0.9, time.time())
+    weak = Track("camera0", (20, 20, 30, 30), 0.4, time.time())
+    # Both queued for classification, as the tracker does on their first hit
+    visit.pending = weak.pending = True
+
+    def on_clip(tracks, clip_path, poster_path):
+        when_all_settled(tracks, lambda visits: linked.append((visits, clip_path)))
+
+    with FedRecorder(clip_dir, on_clip) as recorder:
+        recorder.trigger([visit, weak], 0.9, time.time())
+        assert _wait_for(lambda: recorder.clips_written == 1)
+    # The clip is done, but neither track has been classified yet
+    assert linked == []
+
+    # One track is too weak to store; the clip still waits for the other
+    weak.settle()
+    assert linked == []
+
+    # The way save_visit stores a visit
+    with visit.lock:
+        visit.pending = False
+        visit.detection_future = Future()
+    visit.settle()
+    assert len(linked) == 1
+    visits, clip_path = linked[0]
+    assert visits == [visit]
+    assert os.path.isfile(clip_path)
+
+
+def test_clip_without_visits_is_reported_once_all_settle():
+    tracks = [Track("camera0", (0, 0, 10, 10), 0.9, 0.0) for _ in range(2)]
+    tracks[0].pending = True
+    results = []
+    when_all_settled(tracks, results.append)
+    assert results == []
+    tracks[0].settle()
+    assert results == [[]]
@@ -0,0 +1,255 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+
+def _auto_vacuum(db):
+    conn = sqlite3.connect(db.DB_NAME)
+    try:
+        return conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _create_baseline(db):
+    """The schema (and data) the app had before migrations existed."""
+    conn = sqlite3.connect(db.DB_NAME)
+    conn.execute('''
+        CREATE TABLE detections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            species TEXT,
+            confidence REAL,
+            image_path TEXT,
+            timestamp DATETIME,
+            interesting_fact TEXT
+        )
+    ''')
+    conn.executemany(
+        'INSERT INTO detections (species, confidence, image_path, timestamp, interesting_fact) VALUES (?, ?, ?, ?, ?)',
+        [('Robin', 0.9, 'static/captures/a.jpg', '2024-05-01 08:15:00', 'fact'),
+         ('Robin', 0.5, 'static/captures/b.jpg', '2024-05-01 08:45:00', 'fact'),
+         ('Blue Tit', 0.7, 'static/captures/c.jpg', '2024-05-02 17:00:00', 'fact')])
+    conn.commit()
+    conn.close()
+
+
+def test_new_database_uses_incremental_auto_vacuum(db):
+    db.init_db()
+    assert _auto_vacuum(db) == 2
+
+
+def test_existing_database_is_only_converted_on_request(db):
+    _create_baseline(db)
+    db.init_db()
+    assert _auto_vacuum(db) == 0
+
+    db.compact()
+    assert _auto_vacuum(db) == 0
+
+    db.compact(convert=True)
+    assert _auto_vacuum(db) == 2
+
+
+def test_baseline_database_is_migrated(db):
+    _create_baseline(db)
+    db.init_db()
+
+    conn = db.get_connection()
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(db.MIGRATIONS)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(detections)')}
+    assert {'camera_id', 'track_id', 'ended_at', 'bbox', 'thumb_path', 'clip_path', 'cloud_species'} <= columns
+    indexes = {row[1] for row in conn.execute('PRAGMA index_list(detections)')}
+    assert {'idx_detections_timestamp', 'idx_detections_timestamp_id'} <= indexes
+
+    rows = conn.execute('SELECT species, image_path FROM detections ORDER BY id').fetchall()
+    assert [tuple(row) for row in rows] == [
+        ('Robin', 'static/captures/a.jpg'), ('Robin', 'static/captures/b.jpg'), ('Blue Tit', 'static/captures/c.jpg')]
+
+
+def test_migrations_run_once(db):
+    db.init_db()
+    db.add_detection('Robin', 0.9, 'a.jpg', 'fact')
+    # A second start must not re-run any step (nor re-count the rollups)
+    db.init_db()
+
+    conn = db.get_connection()
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(db.MIGRATIONS)
+    assert conn.execute('SELECT COUNT(*) FROM detections').fetchone()[0] == 1
+    assert conn.execute('SELECT SUM(visits) FROM stats_daily').fetchone()[0] == 1
+
+
+def test_failed_write_does_not_sink_its_batch(db):
+    db.init_db()
+    good = db.add_detection_async('Robin', 0.9, 'a.jpg', 'fact')
+    bad = db.queue_write(lambda conn: conn.execute('INSERT INTO missing_table VALUES (1)'))
+    other = db.add_detection_async('Wren', 0.8, 'b.jpg', 'fact')
+
+    assert good.result(timeout=5) < other.result(timeout=5)
+    assert isinstance(bad.exception(timeout=5), sqlite3.OperationalError)
+    assert [row['species'] for row in db.get_recent_detections()] == ['Wren', 'Robin']
+
+
+def _add_visits(db, visits):
+    """Insert (species, confidence, timestamp, camera) rows; returns their ids."""
+    return [db.add_detection(species, confidence, f'{species}.jpg', 'fact', timestamp=timestamp, camera_id=camera)
+            for species, confidence, timestamp, camera in visits]
+
+
+def _pages(db, limit, **filters):
+    pages, before = [], None
+    while True:
+        rows, before = db.query_detections(limit, before=before, **filters)
+        pages.append([row['id'] for row in rows])
+        if before is None:
+            return pages
+
+
+def test_pagination_walks_every_row_once_across_equal_timestamps(db):
+    db.init_db()
+    # Three rows share a timestamp, so a page boundary falls inside the tie
+    ids = _add_visits(db, [
+        ('Robin', 0.9, '2024-05-01 08:00:00', '0'),
+        ('Wren', 0.8, '2024-05-01 09:00:00', '0'),
+        ('Robin', 0.7, '2024-05-01 09:00:00', '1'),
+        ('Wren', 0.6, '2024-05-01 09:00:00', '0'),
+        ('Robin', 0.5, '2024-05-01 10:00:00', '1'),
+    ])
+
+    assert _pages(db, 2) == [[ids[4], ids[3]], [ids[2], ids[1]], [ids[0]]]
+    # A full last page still reports the end
+    assert _pages(db, 5) == [list(reversed(ids))]
+    assert _pages(db, 6) == [list(reversed(ids))]
+
+
+def test_pagination_keeps_filters_across_pages(db):
+    db.init_db()
+    ids = _add_visits(db, [
+        ('Robin', 0.9, '2024-05-01 08:00:00', '0'),
+        ('Wren', 0.8, '2024-05-01 09:00:00', '0'),
+        ('Robin', 0.7, '2024-05-02 09:00:00', '1'),
+        ('Robin', 0.3, '2024-05-03 09:00:00', '0'),
+        ('Robin', 0.6, '2024-05-04 09:00:00', '0'),
+    ])
+
+    assert _pages(db, 1, species=['Robin'], min_confidence=0.5) == [[ids[4]], [ids[2]], [ids[0]]]
+    assert _pages(db, 2, species=['Robin', 'Wren'], camera_id='0') == [[ids[4], ids[3]], [ids[1], ids[0]]]
+    assert _pages(db, 10, max_confidence=0.7) == [[ids[4], ids[3], ids[2]]]
+    # since is inclusive, until exclusive
+    assert _pages(db, 10, since=datetime(2024, 5, 2, 9), until=datetime(2024, 5, 4, 9)) == [[ids[3], ids[2]]]
+
+
+def test_data_version_changes_with_every_write(db):
+    db.init_db()
+    version, _ = db.get_data_version()
+    [row_id] = _add_visits(db, [('Robin', 0.9, '2024-05-01 08:00:00', '0')])
+    added, _ = db.get_data_version()
+    assert added != version
+
+    db.update_detection(row_id, 'Wren', 'fact', 0.8)
+    updated, _ = db.get_data_version()
+    assert updated != added
+
+    # Reads leave it alone, so unchanged polls keep their ETag
+    db.query_detections(10)
+    assert db.get_data_version()[0] == updated
+
+
+def test_data_version_ignores_writes_that_leave_detections_alone(db):
+    db.init_db()
+    _add_visits(db, [('Robin', 0.9, '2024-05-01 08:00:00', '0')])
+    version, last_modified = db.get_data_version()
+
+    db.cache_enrichment('Robin', 'abc123', {'fact': 'Sings at dawn'}).result(timeout=5)
+    db.flush_writes()
+    db.compact()
+    # Detection writes that match no row change nothing either
+    assert not db.update_detection(12345, 'Wren', 'fact', 0.5)
+    assert not db.delete_detection(12345)
+
+    assert db.get_data_version() == (version, last_modified)
+
+
+def _rollup(db, table):
+    return {tuple(row[:3]): (row[3], round(row[4], 6)) for row in db.get_connection().execute(
+        f'SELECT bucket, camera_id, species, visits, confidence_sum FROM {table}')}
+
+
+def _recount(db, table):
+    """The rollup recomputed from scratch, to check the triggers against."""
+    bucket = db.ROLLUPS[table].format(row='detections')
+    return {tuple(row[:3]): (row[3], round(row[4], 6)) for row in db.get_connection().execute(f'''
+        SELECT {bucket}, COALESCE(camera_id, ''), species, COUNT(*), TOTAL(confidence)
+        FROM detections WHERE species IS NOT NULL AND timestamp IS NOT NULL GROUP BY 1, 2, 3
+    ''')}
+
+
+def _assert_rollups_match(db):
+    for table in db.ROLLUPS:
+        assert _rollup(db, table) == _recount(db, table)
+
+
+def test_rollups_are_backfilled_by_the_migration(db):
+    _create_baseline(db)
+    db.init_db()
+    _assert_rollups_match(db)
+    assert _rollup(db, 'stats_daily') == {
+        ('2024-05-01', '', 'Robin'): (2, 1.4),
+        ('2024-05-02', '', 'Blue Tit'): (1, 0.7),
+    }
+
+
+def test_rollups_follow_inserts_updates_and_deletes(db):
+    db.init_db()
+    robin, wren, other = _add_visits(db, [
+        ('Robin', 0.9, '2024-05-01 08:15:00', '0'),
+        ('Wren', 0.5, '2024-05-01 08:45:00', '0'),
+        ('Robin', 0.4, '2024-05-01 09:05:00', None),
+    ])
+    _assert_rollups_match(db)
+    assert _rollup(db, 'stats_hourly')[('2024-05-01 08:00:00', '0', 'Robin')] == (1, 0.9)
+
+    # Relabelled: moves between species
+    db.update_detection(wren, 'Robin', 'fact', 0.6)
+    _assert_rollups_match(db)
+    assert _rollup(db, 'stats_daily')[('2024-05-01', '0', 'Robin')] == (2, 1.5)
+    assert ('2024-05-01', '0', 'Wren') not in _rollup(db, 'stats_daily')
+
+    # Re-classified with a better frame: confidence changes, the count doesn't
+    db.update_visit(robin, 'Robin', 0.95, 'a.jpg', 'fact', datetime(2024, 5, 1, 8, 20)).result(timeout=5)
+    _assert_rollups_match(db)
+
+    # Columns the rollups don't use leave them alone
+    db.end_visit(other, datetime(2024, 5, 1, 9, 30)).result(timeout=5)
+    _assert_rollups_match(db)
+
+    db.delete_detection(robin)
+    db.delete_detections([other]).result(timeout=5)
+    _assert_rollups_match(db)
+    assert _rollup(db, 'stats_daily') == {('2024-05-01', '0', 'Robin'): (1, 0.6)}
+
+    db.clear_all_detections()
+    for table in db.ROLLUPS:
+        assert _rollup(db, table) == {}
+
+
+def test_statistics_read_the_rollups(db):
+    db.init_db()
+    _add_visits(db, [
+        ('Robin', 0.9, '2024-05-01 08:15:00', '0'),
+        ('Robin', 0.7, '2024-05-01 08:45:00', '1'),
+        ('Wren', 0.5, '2024-05-02 17:00:00', '0'),
+    ])
+
+    totals = db.get_species_totals()
+    assert [(row['species'], row['visits']) for row in totals] == [('Robin', 2), ('Wren', 1)]
+    assert totals[0]['avg_confidence'] == pytest.approx(0.8)
+    assert [row['species'] for row in db.get_species_totals(camera_id='1')] == ['Robin']
+
+    assert db.get_visit_series('day', since=datetime(2024, 5, 2)) == [
+        {'bucket': '2024-05-02', 'species': 'Wren', 'visits': 1}]
+    assert db.get_visit_series('hour', species=['Robin']) == [
+        {'bucket': '2024-05-01 08:00:00', 'species': 'Robin', 'visits': 2}]
+    assert db.get_activity_heatmap() == [
+        {'day': '2024-05-01', 'hour': 8, 'visits': 2}, {'day': '2024-05-02', 'hour': 17, 'visits': 1}]
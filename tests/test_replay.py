@@ -0,0 +1,7 @@
+from camera import open_camera_source
+
+
+def test_replay_camera_reports_its_configured_source():
+    camera = open_camera_source("replay:synthetic:5")
+    assert camera.source_name == "replay:synthetic:5"
+    assert camera.read() is not None
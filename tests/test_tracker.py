@@ -0,0 +1,28 @@
+import numpy as np
+
+from tracker import IouTracker
+
+
+def test_flat_crop_is_kept_and_classified():
+    tracker = IouTracker("camera0")
+    # A black frame: the crop has no sharpness at all
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    to_classify, ended = tracker.update([(10, 10, 60, 60, 0.8)], frame, 0.0)
+
+    assert ended == []
+    assert len(to_classify) == 1
+    track = to_classify[0]
+    assert track.best_crop is not None
+    assert track.best_crop.shape == (50, 50, 3)
+    assert track.best_quality == 0.0
+
+
+def test_track_without_crop_is_not_classified():
+    tracker = IouTracker("camera0")
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    # Entirely outside the frame, so there is nothing to crop
+    to_classify, _ = tracker.update([(200, 200, 240, 240, 0.8)], frame, 0.0)
+
+    assert to_classify == []
+    assert tracker.tracks[0].best_crop is None
+    assert not tracker.tracks[0].pending
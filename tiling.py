@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+
+
+def _expand(window, min_w, min_h, frame_w, frame_h):
+    """Grow a window around its centre to at least min_w x min_h (within the frame)."""
+    x1, y1, x2, y2 = window
+    if x2 - x1 < min_w:
+        cx = (x1 + x2) // 2
+        x1 = max(0, min(cx - min_w // 2, frame_w - min_w))
+        x2 = min(frame_w, x1 + min_w)
+    if y2 - y1 < min_h:
+        cy = (y1 + y2) // 2
+        y1 = max(0, min(cy - min_h // 2, frame_h - min_h))
+        y2 = min(frame_h, y1 + min_h)
+    return x1, y1, x2, y2
+
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _merge(windows):
+    """Union overlapping windows until none overlap."""
+    windows = list(windows)
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        while windows:
+            current = windows.pop()
+            for i, other in enumerate(windows):
+                if _overlaps(current, other):
+                    windows[i] = (min(current[0], other[0]), min(current[1], other[1]),
+                                  max(current[2], other[2]), max(current[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(current)
+        windows = result
+    return windows
+
+
+def _split(start, end, size, step):
+    """Tile offsets covering [start, end) with tiles of `size`."""
+    if end - start <= size:
+        return [start]
+    offsets = list(range(start, end - size, step))
+    offsets.append(end - size)
+    return offsets
+
+
+def plan_tiles(regions, frame_shape, tile_size=640, padding=0.5, min_padding=32, overlap=0.2):
+    """
+    Turn motion regions into native-resolution crop windows for the detector.
+
+    Each region is padded (so a partly-moving bird is fully inside), grown
+    to at least one tile, merged with overlapping neighbours, and windows
+    larger than a tile are split into overlapping tiles.
+    Returns a list of (x1, y1, x2, y2) windows in frame pixels.
+    """
+    frame_h, frame_w = frame_shape[:2]
+    tile_w, tile_h = min(tile_size, frame_w), min(tile_size, frame_h)
+
+    windows = []
+    for (x1, y1, x2, y2) in regions:
+        pad_x = max(min_padding, int((x2 - x1) * padding))
+        pad_y = max(min_padding, int((y2 - y1) * padding))
+        window = (max(0, x1 - pad_x), max(0, y1 - pad_y), min(frame_w, x2 + pad_x), min(frame_h, y2 + pad_y))
+        windows.append(_expand(window, tile_w, tile_h, frame_w, frame_h))
+
+    step_x = max(1, int(tile_w * (1 - overlap)))
+    step_y = max(1, int(tile_h * (1 - overlap)))
+    tiles = []
+    for (x1, y1, x2, y2) in _merge(windows):
+        for ty in _split(y1, y2, tile_h, step_y):
+            for tx in _split(x1, x2, tile_w, step_x):
+                tiles.append((tx, ty, min(x2, tx + tile_w), min(y2, ty + tile_h)))
+    return tiles
+
+
+def nms(detections, iou_threshold=0.45):
+    """
+    Non-maximum suppression over (x1, y1, x2, y2, conf) boxes, used to
+    merge duplicates where tiles overlap.
+    """
+    if len(detections) < 2:
+        return list(detections)
+    boxes = [[d[0], d[1], d[2] - d[0], d[3] - d[1]] for d in detections]
+    scores = [float(d[4]) for d in detections]
+    keep = cv2.dnn.NMSBoxes(boxes, scores, 0.0, iou_threshold)
+    return [detections[int(i)] for i in np.array(keep).flatten()]
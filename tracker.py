@@ -0,0 +1,198 @@
+import itertools
+import math
+import threading
+
+import cv2
+
+_track_ids = itertools.count(1)
+
+
+def box_iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def crop_quality(crop, conf):
+    """Sharpness (variance of the Laplacian) weighted by detector confidence."""
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    return cv2.Laplacian(gray, cv2.CV_64F).var() * conf
+
+
+class Track:
+    """One bird visit: a box followed across frames."""
+
+    def __init__(self, camera_id, box, conf, now):
+        self.id = f"{camera_id}-{int(now)}-{next(_track_ids)}"
+        self.box = box
+        self.conf = conf
+        self.start_time = now
+        self.last_seen = now
+        self.hits = 1
+
+        # Best crop seen so far, and the quality of the crop last classified
+        self.best_crop = None
+        self.best_quality = 0.0
+        self.classified_quality = 0.0
+        self.classifications = 0
+
+        # Filled in by the classification stage
+        self.lock = threading.Lock()
+        self.pending = False
+        # Future resolving to the visit's detections row id
+        self.detection_future = None
+        self.label = None
+        self.score = 0.0
+        self.image_path = None
+        # captures.Capture holding the stored best frame
+        self.capture = None
+        # Label last sent for cloud enrichment
+        self.enriched_label = None
+        # Run by settle() once the classification in flight is handled
+        self._on_settled = []
+
+    def when_settled(self, callback):
+        """Run callback(track) now, or once no classification is in flight."""
+        with self.lock:
+            if self.pending:
+                self._on_settled.append(callback)
+                return
+        callback(self)
+
+    def settle(self):
+        """Called once a classification result has been handled (stored or not)."""
+        with self.lock:
+            self.pending = False
+            callbacks, self._on_settled = self._on_settled, []
+        for callback in callbacks:
+            callback(self)
+
+
+def when_all_settled(tracks, callback):
+    """
+    Run callback(visits) once none of `tracks` is waiting for its
+    classification; `visits` are those that have (or are getting) a stored
+    visit, i.e. a detection_future.
+    """
+    lock = threading.Lock()
+    waiting = [len(tracks)]
+    visits = []
+
+    def on_settled(track):
+        with track.lock:
+            stored = track.detection_future is not None
+        with lock:
+            if stored:
+                visits.append(track)
+            waiting[0] -= 1
+            done = waiting[0] == 0
+        if done:
+            callback(visits)
+
+    if not tracks:
+        callback([])
+    for track in tracks:
+        track.when_settled(on_settled)
+
+
+class IouTracker:
+    """
+    Lightweight IoU/centroid tracker.
+
+    Detections are greedily matched to live tracks by IoU (falling back to
+    centroid distance for fast movers). update() reports which tracks need
+    (re-)classification - new tracks, or ones that just got a clearly
+    sharper crop - and which tracks ended because they went unseen.
+    """
+
+    def __init__(self, camera_id, iou_threshold=0.3, max_age=30.0, min_hits=1, reclassify_gain=1.5):
+        self.camera_id = camera_id
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.reclassify_gain = reclassify_gain
+        self.tracks = []
+
+    def _match(self, detections):
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            tx, ty = (track.box[0] + track.box[2]) / 2, (track.box[1] + track.box[3]) / 2
+            diag = math.hypot(track.box[2] - track.box[0], track.box[3] - track.box[1])
+            for di, det in enumerate(detections):
+                iou = box_iou(track.box, det)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, ti, di))
+                    continue
+                dx, dy = (det[0] + det[2]) / 2, (det[1] + det[3]) / 2
+                distance = math.hypot(tx - dx, ty - dy)
+                if diag > 0 and distance < diag / 2:
+                    # Rank centroid matches below any IoU match
+                    pairs.append((-distance / diag, ti, di))
+
+        matches, used_tracks, used_dets = [], set(), set()
+        for _, ti, di in sorted(pairs, reverse=True):
+            if ti in used_tracks or di in used_dets:
+                continue
+            matches.append((ti, di))
+            used_tracks.add(ti)
+            used_dets.add(di)
+        return matches, used_dets
+
+    def update(self, detections, frame, now):
+        """
+        Feed this frame's (x1, y1, x2, y2, conf) detections.
+        Returns (tracks_to_classify, ended_tracks).
+        """
+        matches, used_dets = self._match(detections)
+        touched = []
+        for ti, di in matches:
+            track = self.tracks[ti]
+            x1, y1, x2, y2, conf = detections[di]
+            track.box = (x1, y1, x2, y2)
+            track.conf = conf
+            track.last_seen = now
+            track.hits += 1
+            touched.append((track, detections[di]))
+
+        for di, det in enumerate(detections):
+            if di not in used_dets:
+                track = Track(self.camera_id, det[:4], det[4], now)
+                self.tracks.append(track)
+                touched.append((track, det))
+
+        to_classify = []
+        # `frame` is only needed (and may be None) when there are detections
+        height, width = frame.shape[:2] if touched else (0, 0)
+        for track, (x1, y1, x2, y2, conf) in touched:
+            x1, y1 = max(0, int(x1)), max(0, int(y1))
+            x2, y2 = min(width, int(x2)), min(height, int(y2))
+            if x1 >= x2 or y1 >= y2:
+                continue
+            crop = frame[y1:y2, x1:x2]
+            quality = crop_quality(crop, conf)
+            # The first crop counts even if it is flat (dark or overexposed)
+            if track.best_crop is None or quality > track.best_quality:
+                track.best_quality = quality
+                # Copy: the frame buffer is not ours to keep
+                track.best_crop = crop.copy()
+
+            if track.hits < self.min_hits or track.pending or track.best_crop is None:
+                continue
+            if track.classifications == 0 or track.best_quality > track.classified_quality * self.reclassify_gain:
+                track.classified_quality = track.best_quality
+                track.classifications += 1
+                # Cleared by the classification stage once the result is in
+                track.pending = True
+                to_classify.append(track)
+
+        ended = [t for t in self.tracks if now - t.last_seen > self.max_age]
+        if ended:
+            self.tracks = [t for t in self.tracks if now - t.last_seen <= self.max_age]
+        return to_classify, ended
+
+    def flush(self):
+        """End every live track (e.g. on shutdown or source switch)."""
+        ended, self.tracks = self.tracks, []
+        return ended
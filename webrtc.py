@@ -0,0 +1,133 @@
+"""
+Optional WebRTC (H.264) live view. Needs `aiortc`; without it the MJPEG
+feed is the only transport and available() returns False.
+"""
+import asyncio
+import fractions
+import time
+
+import cv2
+
+try:
+    from aiortc import RTCPeerConnection, RTCRtpSender, RTCSessionDescription, VideoStreamTrack
+    from av import VideoFrame
+except ImportError:
+    RTCPeerConnection = None
+    VideoStreamTrack = object
+
+from framepool import frame_pool
+from streaming import FrameRateLimiter, normalize_profile
+
+VIDEO_CLOCK_RATE = 90000
+# A peer that hasn't connected by then (e.g. never completed ICE) is dropped
+CONNECT_TIMEOUT = 30.0
+
+_peers = {}  # RTCPeerConnection -> PipelineVideoTrack
+
+
+def available():
+    return RTCPeerConnection is not None
+
+
+class PipelineVideoTrack(VideoStreamTrack):
+    """Feeds a CameraPipeline's broadcast frames into a WebRTC video track."""
+
+    kind = "video"
+
+    def __init__(self, pipeline, width=None, max_fps=None):
+        super().__init__()
+        self.pipeline = pipeline
+        self.width = normalize_profile(width)[0]
+        self.limiter = FrameRateLimiter(max_fps or 15)
+        self.last_seq = 0
+        self.start = None
+        # Counted as a viewer from its first frame, so offers that never
+        # connect don't keep the pipeline at full rate
+        self.viewing = False
+
+    def _next_frame(self):
+        self.limiter.wait()
+        while self.pipeline.running:
+            self.last_seq, frame = self.pipeline.broadcaster.wait_for_frame(self.last_seq)
+            if frame is not None:
+                return frame
+        return None
+
+    async def recv(self):
+        if not self.viewing and self.readyState != "ended":
+            self.viewing = True
+            self.pipeline.add_viewer()
+        frame = await asyncio.to_thread(self._next_frame)
+        if frame is None:
+            self.stop()
+            raise ConnectionError("pipeline stopped")
+        if self.width and self.width < frame.shape[1]:
+            height = int(round(frame.shape[0] * self.width / frame.shape[1])) // 2 * 2
+            frame = cv2.resize(frame, (self.width, height), dst=frame_pool.acquire((height, self.width, 3)),
+                               interpolation=cv2.INTER_AREA)
+
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        video_frame = VideoFrame.from_ndarray(frame, format="bgr24")
+        video_frame.pts = int((now - self.start) * VIDEO_CLOCK_RATE)
+        video_frame.time_base = fractions.Fraction(1, VIDEO_CLOCK_RATE)
+        return video_frame
+
+    def stop(self):
+        if self.viewing:
+            self.viewing = False
+            self.pipeline.remove_viewer()
+        super().stop()
+
+
+def _prefer_h264(pc):
+    codecs = RTCRtpSender.getCapabilities("video").codecs
+    h264 = [c for c in codecs if c.mimeType == "video/H264"]
+    for transceiver in pc.getTransceivers():
+        if transceiver.kind == "video" and h264:
+            transceiver.setCodecPreferences(h264)
+
+
+async def answer(pipeline, sdp, offer_type, width=None, max_fps=None):
+    """Answer a browser's SDP offer with a track of `pipeline`'s frames."""
+    pc = RTCPeerConnection()
+    track = PipelineVideoTrack(pipeline, width=width, max_fps=max_fps)
+    _peers[pc] = track
+
+    @pc.on("connectionstatechange")
+    async def on_state_change():
+        if pc.connectionState in ("failed", "closed"):
+            await _close(pc)
+
+    try:
+        pc.addTrack(track)
+        _prefer_h264(pc)
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type=offer_type))
+        await pc.setLocalDescription(await pc.createAnswer())
+    except Exception:
+        # E.g. a malformed offer: nothing may stay registered
+        await _close(pc)
+        raise
+
+    def expire():
+        if pc in _peers and pc.connectionState != "connected":
+            asyncio.ensure_future(_close(pc))
+
+    asyncio.get_running_loop().call_later(CONNECT_TIMEOUT, expire)
+    return {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}
+
+
+async def _close(pc):
+    track = _peers.pop(pc, None)
+    if track is not None:
+        track.stop()
+    await pc.close()
+
+
+async def close_all():
+    peers = list(_peers.items())
+    _peers.clear()
+    for _, track in peers:
+        track.stop()
+    await asyncio.gather(*(pc.close() for pc, _ in peers), return_exceptions=True)